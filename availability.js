@@ -0,0 +1,75 @@
+// Cập nhật số vé còn lại theo thời gian thực qua Server-Sent Events.
+// Phần tử cần cập nhật có data-availability-event="<id sự kiện>";
+// data-format (mặc định "Còn {n} vé") quy định cách hiển thị khi còn vé.
+// Khi không dùng được SSE (trình duyệt không hỗ trợ, máy chủ hết suất kết nối và trả 503,
+// hoặc kết nối lỗi liên tục) thì chuyển sang long-poll data-poll.
+(function () {
+    const script = document.currentScript;
+    if (!script || !document.querySelector('[data-availability-event]')) {
+        return;
+    }
+
+    function render(node, available) {
+        const format = node.dataset.format || 'Còn {n} vé';
+        node.textContent = available > 0 ? format.replace('{n}', available) : 'Hết vé';
+        node.classList.toggle('sold-out', available <= 0);
+    }
+
+    let version = 0;
+
+    function apply(data) {
+        version = data.version;
+        Object.entries(data.events).forEach(([eventId, available]) => {
+            if (available === null) {
+                return;
+            }
+            document.querySelectorAll(`[data-availability-event="${eventId}"]`).forEach((node) => render(node, available));
+        });
+    }
+
+    let backoff = 0;
+
+    function poll() {
+        fetch(`${script.dataset.poll}?since=${version}&wait=20`, {
+            credentials: 'same-origin',
+            headers: { 'Accept': 'application/json' }
+        })
+            .then((response) => {
+                if (!response.ok) {
+                    throw new Error(`HTTP ${response.status}`);
+                }
+                return response.json();
+            })
+            .then((data) => {
+                backoff = 0;
+                apply(data);
+                // Máy chủ không giữ request (hết suất) thì báo bao lâu nữa mới hỏi lại
+                setTimeout(poll, (data.poll_after || 0) * 1000);
+            })
+            .catch(() => {
+                // Lỗi mạng hoặc máy chủ: chờ lâu dần 2s, 4s, 8s... tối đa 60s
+                backoff = Math.min(backoff ? backoff * 2 : 2000, 60000);
+                setTimeout(poll, backoff);
+            });
+    }
+
+    if (!window.EventSource) {
+        poll();
+        return;
+    }
+
+    const source = new EventSource(script.dataset.stream);
+    let failures = 0;
+    source.addEventListener('availability', (event) => {
+        failures = 0;
+        apply(JSON.parse(event.data));
+    });
+    source.addEventListener('error', () => {
+        // Phản hồi không phải 200 (ví dụ 503) làm EventSource đóng hẳn và không tự kết nối lại
+        failures += 1;
+        if (source.readyState === EventSource.CLOSED || failures >= 3) {
+            source.close();
+            poll();
+        }
+    });
+})();
@@ -0,0 +1,1260 @@
+# Các benchmark hiệu năng cho hệ thống đặt vé.
+#
+# Chạy: python bench.py <tên benchmark> [tùy chọn]   (xem python bench.py -h)
+# Mặc định mỗi lần chạy dùng một CSDL SQLite và thư mục ảnh tạm,
+# không đụng tới my_database.db. Đặt DATABASE_URL để chạy trên CSDL khác.
+import os
+import sys
+import time
+import queue
+import argparse
+import tempfile
+import threading
+import random
+import datetime
+import json
+import uuid
+import heapq
+import statistics
+import socket
+import subprocess
+import http.client
+from collections import Counter
+
+BENCH_DIR = tempfile.mkdtemp(prefix='ticketbox-bench-')
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(BENCH_DIR, 'bench.db'))
+
+import run  # noqa: E402
+from run import (app, db, User, Event, Ticket, TicketController, ticket_render_queue, ticket_art,  # noqa: E402
+                 upgrade_database, _migrate_hot_indexes, QueryCounter, request_profiler, event_search,
+                 find_events, find_events_like, user_search, find_users, login_identifiers, PasswordHasher,
+                 seat_inventory)
+from sqlalchemy import text, event as sqla_event  # noqa: E402
+from sqlalchemy.exc import SQLAlchemyError  # noqa: E402
+from werkzeug.security import generate_password_hash  # noqa: E402
+
+# Ảnh nền và cache ảnh vé nằm trong thư mục tạm thay vì thư mục của dự án
+app.root_path = BENCH_DIR
+app.config['TICKET_IMAGE_DISK_CACHE_DIR'] = os.path.join(BENCH_DIR, 'ticket_images')
+# Các benchmark gửi thẳng tới route đặt vé; benchmark waitingroom tự bật phòng chờ
+app.config['WAITING_ROOM_ENABLED'] = False
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def seed_event(total_tickets, name='Bench concert'):
+    event = Event(
+        name=name,
+        date=datetime.datetime(2030, 1, 1),
+        location='Hội trường A',
+        description='Sự kiện dùng cho benchmark',
+        total_tickets=total_tickets,
+        available_tickets=total_tickets,
+    )
+    db.session.add(event)
+    db.session.commit()
+    return event.id
+
+
+def seed_students(count, prefix='bench'):
+    # Bỏ qua băm mật khẩu: benchmark không đăng nhập bằng các tài khoản này
+    start = (db.session.query(db.func.max(User.id)).scalar() or 0) + 1
+    users = [
+        User(
+            username=f'{prefix}{start + i}',
+            password_hash='!',
+            role='sinh_vien',
+            fullname=f'Sinh viên {start + i}',
+            student_id=f'{prefix}{start + i}',
+            faculty='Công nghệ thông tin',
+            student_class='K66 CNTT',
+        )
+        for i in range(count)
+    ]
+    db.session.add_all(users)
+    db.session.commit()
+    return [user.id for user in users]
+
+
+def bench_booking(args):
+    """Nhiều luồng cùng đặt vé cho một sự kiện; kiểm tra không bán vượt số vé."""
+    with app.app_context():
+        upgrade_database()
+        event_id = seed_event(args.tickets)
+        user_ids = seed_students(args.students or args.tickets * 2)
+
+    pending = queue.Queue()
+    for user_id in user_ids:
+        pending.put(user_id)
+        if args.duplicates:
+            pending.put(user_id)
+
+    booked = []
+    rejected = []
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            try:
+                user_id = pending.get_nowait()
+            except queue.Empty:
+                return
+            with app.app_context():
+                ticket_code = TicketController.process_booking(user_id, event_id)
+            with lock:
+                (booked if ticket_code else rejected).append(user_id)
+
+    threads = [threading.Thread(target=worker) for _ in range(args.threads)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        seat_inventory.flush()
+        event = db.session.get(Event, event_id)
+        sold = Ticket.query.filter_by(event_id=event_id).count()
+        holders = db.session.query(db.func.count(db.distinct(Ticket.user_id))).filter(
+            Ticket.event_id == event_id).scalar()
+        available = event.available_tickets
+
+    print(f'Luồng: {args.threads}  vé: {args.tickets}  lượt đặt: {len(booked) + len(rejected)}')
+    print(f'Đặt thành công: {len(booked)}  bị từ chối: {len(rejected)}')
+    print(f'Vé trong CSDL: {sold}  người giữ vé: {holders}  còn lại: {available}')
+    print(f'Thời gian: {elapsed:.2f}s  ->  {len(booked) / elapsed:.1f} lượt đặt/giây')
+
+    oversold = sold > args.tickets or available < 0 or sold + available != args.tickets
+    if oversold or holders != sold or sold != len(booked):
+        print('LỖI: số vé không nhất quán (bán vượt hoặc đặt trùng).')
+        return 1
+    # Còn người muốn mua thì không được còn vé (lượt gửi trùng không được làm mất chỗ)
+    if sold != min(args.tickets, len(user_ids)):
+        print(f'LỖI: bán thiếu, {min(args.tickets, len(user_ids)) - sold} vé không bán được dù còn người mua.')
+        return 1
+    print('OK: không bán vượt, không bán thiếu, không đặt trùng.')
+    return 0
+
+
+def use_project_templates():
+    """Cho các benchmark render trang: template của dự án có thể nằm cạnh run.py thay vì trong templates/."""
+    if not os.path.isdir(os.path.join(app.root_path, app.template_folder)):
+        app.template_folder = os.path.dirname(os.path.abspath(__file__))
+
+
+def logged_in_client(user_id):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+    return client
+
+
+def seed_tickets(event_id, user_ids):
+    tickets = [
+        Ticket(
+            user_id=user_id,
+            event_id=event_id,
+            ticket_code=str(uuid.uuid4()),
+            is_approved=True,
+            is_used=False,
+            user_info_json=json.dumps({"fullname": f'Sinh viên {user_id}'}),
+            event_info_json=json.dumps({"name": 'Bench concert', "date": '01/01/2030'}),
+        )
+        for user_id in user_ids
+    ]
+    db.session.add_all(tickets)
+    db.session.execute(db.update(Event).where(Event.id == event_id)
+                       .values(available_tickets=Event.available_tickets - len(tickets)))
+    db.session.commit()
+    return [(ticket.ticket_code, ticket.user_id, TicketController.qr_payload(ticket)) for ticket in tickets]
+
+
+def seed_staff(role='admin'):
+    staff = User(username=f'{role}-{uuid.uuid4().hex[:8]}', password_hash='!', role=role, fullname='Ban tổ chức')
+    db.session.add(staff)
+    db.session.commit()
+    return staff.id
+
+
+def measure_requests(clients_and_paths, threads, method='post'):
+    """Gửi các request theo nhiều luồng, trả về (độ trễ từng request, thời gian tổng, các response).
+
+    Mỗi phần tử là (client, path) hoặc (client, path, json) cho request JSON."""
+    pending = queue.Queue()
+    for item in clients_and_paths:
+        pending.put(item)
+    latencies = []
+    responses = []
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            try:
+                client, path, *body = pending.get_nowait()
+            except queue.Empty:
+                return
+            started = time.perf_counter()
+            response = getattr(client, method)(path, json=body[0] if body else None)
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                responses.append(response)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return latencies, time.perf_counter() - started, responses
+
+
+def bench_render(args):
+    """So sánh độ trễ /student/confirm-booking khi tạo ảnh vé ngay và khi đưa vào hàng đợi."""
+    app.config['TICKET_RENDER_QUEUE_SIZE'] = max(args.requests, app.config['TICKET_RENDER_QUEUE_SIZE'])
+    print(f'{"chế độ":>8} {"p50 (ms)":>10} {"p99 (ms)":>10} {"req/s":>8}')
+    for mode in ('inline', 'queued'):
+        app.config['TICKET_RENDER_MODE'] = mode
+        with app.app_context():
+            upgrade_database()
+            event_id = seed_event(args.requests, name=f'Bench render {mode}')
+            user_ids = seed_students(args.requests, prefix=f'render-{mode}-')
+        requests = [(logged_in_client(user_id), f'/student/confirm-booking/{event_id}') for user_id in user_ids]
+        latencies, elapsed, _ = measure_requests(requests, args.threads)
+        print(f'{mode:>8} {percentile(latencies, 50) * 1000:10.1f} '
+              f'{percentile(latencies, 99) * 1000:10.1f} {len(latencies) / elapsed:8.1f}')
+
+    started = time.perf_counter()
+    ticket_render_queue.join()
+    print(f'Hàng đợi tạo ảnh xử lý xong sau thêm {time.perf_counter() - started:.2f}s')
+    with app.app_context():
+        statuses = dict(db.session.query(Ticket.render_status, db.func.count(Ticket.id))
+                        .group_by(Ticket.render_status).all())
+    print(f'Trạng thái ảnh vé: {statuses}')
+    return 0
+
+
+def sample_ticket(index=0):
+    return Ticket(
+        id=index + 1,
+        user_id=1,
+        event_id=1,
+        ticket_code=f'00000000-0000-4000-8000-{index:012d}',
+        user_info_json=json.dumps({"fullname": f'Sinh viên {index}', "student_id": f'2021{index:04d}',
+                                   "student_class": 'K66 CNTT', "faculty": 'Công nghệ thông tin',
+                                   "email": None}),
+        event_info_json=json.dumps({"name": 'Đêm nhạc sinh viên', "date": '20/11/2025',
+                                    "location": 'Sân khấu ngoài trời'}),
+    )
+
+
+def write_ticket_template(size=(1600, 800)):
+    from PIL import Image
+    static_dir = os.path.join(BENCH_DIR, 'static')
+    os.makedirs(static_dir, exist_ok=True)
+    Image.effect_noise(size, 64).convert('RGB').save(os.path.join(static_dir, 'ticket_template.png'))
+
+
+def bench_art(args):
+    """Số vé tạo được mỗi giây khi nạp lại ảnh nền/font mỗi lần so với dùng cache."""
+    write_ticket_template()
+    tickets = [sample_ticket(i) for i in range(args.tickets)]
+    print(f'{"cache":>8} {"vé/giây":>10}')
+    for label, cold in (('tắt', True), ('bật', False)):
+        ticket_art.invalidate()
+        started = time.perf_counter()
+        with app.app_context():
+            for ticket in tickets:
+                if cold:
+                    ticket_art.invalidate()
+                qr_data = json.dumps({"ticket_code": ticket.ticket_code, "user_id": 1, "event_id": 1})
+                TicketController.generate_e_ticket(qr_data, ticket)
+        elapsed = time.perf_counter() - started
+        print(f'{label:>8} {len(tickets) / elapsed:10.1f}')
+    return 0
+
+
+def bench_checkin(args):
+    """Nhiều cổng soát vé cùng quét qua /api/checkin; đo lượt quét/giây và p99."""
+    with app.app_context():
+        upgrade_database()
+        event_id = seed_event(args.tickets, name='Bench check-in')
+        tickets = seed_tickets(event_id, seed_students(args.tickets, prefix='checkin-'))
+        staff_id = seed_staff()
+
+    gates = [logged_in_client(staff_id) for _ in range(args.threads)]
+    scans = []
+    if args.batch:
+        # Mỗi request gửi một lô lượt quét lên /api/checkin/batch
+        records = [{"qr_data": qr_data, "gate_id": f'gate-{index % len(gates)}'}
+                   for index, (_, _, qr_data) in enumerate(tickets * args.passes)]
+        for index, start in enumerate(range(0, len(records), args.batch)):
+            body = {"event_id": event_id, "scans": records[start:start + args.batch]}
+            scans.append((gates[index % len(gates)], '/api/checkin/batch', body))
+    else:
+        for index, (_, _, qr_data) in enumerate(tickets * args.passes):
+            scans.append((gates[index % len(gates)], '/api/checkin', {"qr_data": qr_data}))
+
+    latencies, elapsed, responses = measure_requests(scans, args.threads)
+    if args.batch:
+        outcomes = Counter(result['status'] for response in responses for result in response.get_json()['results'])
+    else:
+        outcomes = Counter(response.get_json()['status'] for response in responses)
+    total_scans = sum(outcomes.values())
+    print(f'Cổng: {args.threads}  vé: {args.tickets}  lượt quét: {total_scans}  request: {len(latencies)}')
+    print(f'Kết quả: {dict(outcomes)}')
+    print(f'{total_scans / elapsed:.1f} lượt quét/giây  p50 {percentile(latencies, 50) * 1000:.1f}ms  '
+          f'p99 {percentile(latencies, 99) * 1000:.1f}ms (mỗi request)')
+
+    with app.app_context():
+        used = Ticket.query.filter_by(event_id=event_id, is_used=True).count()
+    if outcomes['accepted'] != args.tickets or used != args.tickets:
+        print('LỖI: có vé được chấp nhận nhiều lần hoặc bị bỏ sót.')
+        return 1
+    print('OK: mỗi vé được chấp nhận đúng một lần.')
+    return 0
+
+
+FACULTIES = ['Công nghệ thông tin', 'Điện tử viễn thông', 'Kinh tế', 'Ngôn ngữ Anh', 'Du lịch',
+             'Dược', 'Y khoa', 'Luật', 'Kiến trúc', 'Quản trị kinh doanh', 'Tài chính', 'Truyền thông']
+
+
+def bulk_seed(users, tickets, events, seed=42):
+    """Tạo nhanh dữ liệu lớn bằng INSERT nhiều dòng, bỏ qua ORM."""
+    rng = random.Random(seed)
+    base = datetime.datetime(2025, 1, 1)
+    batch = 20000
+
+    event_rows = [{"name": f'Sự kiện {i}', "date": base + datetime.timedelta(days=rng.randrange(730)),
+                   "location": 'Hội trường A', "total_tickets": tickets, "available_tickets": tickets}
+                  for i in range(events)]
+    db.session.execute(db.insert(Event.__table__), event_rows)
+
+    for start in range(0, users, batch):
+        db.session.execute(db.insert(User.__table__), [
+            {"username": f'sv{i}', "password_hash": '!', "role": 'doan_truong' if i % 500 == 0 else 'sinh_vien',
+             "fullname": f'Sinh viên {i}', "student_id": f'SV{i:07d}', "faculty": FACULTIES[i % len(FACULTIES)],
+             "student_class": f'K{66 + i % 4} {i % 40}'}
+            for i in range(start, min(users, start + batch))
+        ])
+    db.session.commit()
+
+    # Vé thứ i thuộc sinh viên (i % users), mỗi sinh viên giữ vé ở các sự kiện khác nhau
+    for start in range(0, tickets, batch):
+        rows = []
+        for i in range(start, min(tickets, start + batch)):
+            user_index, round_ = i % users, i // users
+            rows.append({
+                "user_id": user_index + 1,
+                "event_id": (user_index + round_ * 7) % events + 1,
+                "ticket_code": f'{i:08d}-0000-4000-8000-{rng.getrandbits(48):012x}',
+                "booking_date": base + datetime.timedelta(seconds=rng.randrange(60 * 86400)),
+                "is_approved": True,
+                "is_used": rng.random() < 0.3,
+            })
+        db.session.execute(db.insert(Ticket.__table__), rows)
+    db.session.commit()
+
+
+def time_query(run_query, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run_query()
+        timings.append(time.perf_counter() - started)
+        db.session.rollback()
+    return statistics.median(timings)
+
+
+def bench_indexes(args):
+    """Thời gian các truy vấn nóng của từng route trước và sau khi có chỉ mục."""
+    rng = random.Random(7)
+    with app.app_context():
+        upgrade_database()
+        started = time.perf_counter()
+        bulk_seed(args.users, args.tickets, args.events)
+        print(f'Đã tạo {args.users} sinh viên, {args.tickets} vé, {args.events} sự kiện '
+              f'trong {time.perf_counter() - started:.1f}s')
+
+        queries = [
+            ('my_tickets', lambda: Ticket.query.filter_by(user_id=rng.randrange(1, args.users)).all()),
+            ('book_ticket', lambda: Ticket.query.filter_by(user_id=rng.randrange(1, args.users),
+                                                           event_id=rng.randrange(1, args.events)).first()),
+            ('manage_tickets (50 vé mới nhất)',
+             lambda: Ticket.query.order_by(Ticket.booking_date.desc()).limit(50).all()),
+            ('manage_users (doan_truong)', lambda: User.query.filter_by(role='doan_truong').all()),
+            ('manage_users (theo khoa)', lambda: User.query.filter_by(faculty=FACULTIES[0]).limit(50).all()),
+            ('admin_dashboard (SV theo khoa)',
+             lambda: db.session.query(User.faculty, db.func.count(User.id)).group_by(User.faculty).all()),
+            ('manage_events', lambda: Event.query.order_by(Event.date.asc()).limit(50).all()),
+            ('soát vé (vé chưa dùng của sự kiện)',
+             lambda: Ticket.query.filter_by(event_id=rng.randrange(1, args.events), is_used=False).count()),
+        ]
+
+        results = {}
+        for phase in ('không chỉ mục', 'có chỉ mục'):
+            with db.engine.begin() as connection:
+                if phase == 'không chỉ mục':
+                    for model in (User, Event, Ticket):
+                        for index in model.__table__.indexes:
+                            index.drop(connection, checkfirst=True)
+                else:
+                    _migrate_hot_indexes(connection)
+                if db.engine.dialect.name == 'sqlite':
+                    connection.execute(db.text('ANALYZE'))
+            for name, run_query in queries:
+                results.setdefault(name, []).append(time_query(run_query, args.repeat))
+
+    print(f'{"route":<38} {"không chỉ mục":>14} {"có chỉ mục":>12} {"nhanh hơn":>10}')
+    for name, (before, after) in results.items():
+        print(f'{name:<38} {before * 1000:12.2f}ms {after * 1000:10.2f}ms {before / after:9.1f}x')
+    return 0
+
+
+# Số câu lệnh SQL tối đa của mỗi trang danh sách, không phụ thuộc số dòng hiển thị
+# (kể cả câu nạp current_user của Flask-Login).
+QUERY_BUDGETS = [
+    ('sinh_vien', '/student/my-tickets', 2),
+    ('admin', '/admin/manage-tickets', 3),
+    ('admin', '/admin/manage-tickets?per_page=200', 3),
+    ('admin', '/admin/manage-tickets?faculty=Công nghệ thông tin', 3),
+    ('admin', '/api/admin/tickets?per_page=200', 2),
+    ('admin', '/admin/manage-users?per_page=200', 2),
+]
+
+
+def bench_queries(args):
+    """Đếm câu lệnh SQL của các trang danh sách và so với ngân sách trong QUERY_BUDGETS."""
+    use_project_templates()
+    with app.app_context():
+        upgrade_database()
+        user_ids = seed_students(args.students)
+        for i in range(args.events):
+            seed_tickets(seed_event(args.students, f'Sự kiện {i}'), user_ids)
+        clients = {'sinh_vien': logged_in_client(user_ids[0]), 'admin': logged_in_client(seed_staff('admin'))}
+
+    failed = 0
+    for role, path, budget in QUERY_BUDGETS:
+        with QueryCounter() as counter:
+            started = time.perf_counter()
+            status = clients[role].get(path).status_code
+            elapsed = time.perf_counter() - started
+        ok = status == 200 and counter.count <= budget
+        failed += not ok
+        print(f'{path:<55} {status}  {counter.count:4d} câu SQL (ngân sách {budget})  '
+              f'{elapsed * 1000:7.1f}ms  {"OK" if ok else "VƯỢT"}')
+    return 1 if failed else 0
+
+
+def bench_profiler(args):
+    """Độ trễ của các route khi tắt và bật đo hiệu năng theo request (PROFILING_ENABLED)."""
+    use_project_templates()
+    with app.app_context():
+        upgrade_database()
+        user_ids = seed_students(args.students)
+        seed_tickets(seed_event(args.students), user_ids)
+        client = logged_in_client(seed_staff('admin'))
+
+    paths = ['/admin/manage-tickets', '/api/admin/tickets', '/admin/manage-users']
+    for path in paths:  # làm nóng cache template và kết nối
+        client.get(path)
+    results = {}
+    # Xen kẽ tắt/bật theo từng request để nhiễu của máy ảnh hưởng đều hai bên
+    for _ in range(args.requests):
+        for path in paths:
+            for enabled in (False, True):
+                app.config['PROFILING_ENABLED'] = enabled
+                started = time.perf_counter()
+                client.get(path)
+                results.setdefault((path, enabled), []).append(time.perf_counter() - started)
+
+    print(f'{"route":<28} {"tắt p50":>10} {"bật p50":>10} {"chênh lệch":>11}')
+    for path in paths:
+        off = statistics.median(results[(path, False)])
+        on = statistics.median(results[(path, True)])
+        print(f'{path:<28} {off * 1000:8.2f}ms {on * 1000:8.2f}ms {(on - off) / off * 100:+10.1f}%')
+    endpoints, _ = request_profiler.snapshot()
+    print(f'Số endpoint đã ghi nhận: {len(endpoints)}')
+    return 0
+
+
+EVENT_WORDS = ['Đêm nhạc', 'Hội thảo', 'Giải bóng đá', 'Ngày hội việc làm', 'Cuộc thi', 'Lễ hội', 'Tọa đàm',
+               'Triển lãm', 'Chung kết', 'Workshop', 'Hội chợ', 'Đại nhạc hội']
+EVENT_TOPICS = ['sinh viên', 'công nghệ', 'trí tuệ nhân tạo', 'khởi nghiệp', 'âm nhạc', 'mùa xuân', 'tình nguyện',
+                'ẩm thực', 'thể thao', 'văn hóa', 'Đại Nam', 'kỹ năng mềm', 'điện ảnh', 'du lịch']
+SEARCH_QUERIES = ['Đêm nhạc', 'dem nhac', 'hoi thao cong nghe', 'khoi ng', 'am thuc', 'Đại Nam', 'dai nam',
+                  'tri tue nhan tao', 'chung ket the thao', 'xyz khong co']
+
+
+def bench_search(args):
+    """Tìm kiếm sự kiện: chỉ mục FTS5 bỏ dấu so với ILIKE trên tên sự kiện."""
+    rng = random.Random(3)
+    with app.app_context():
+        upgrade_database()
+        base = datetime.datetime(2026, 1, 1)
+        for start in range(0, args.events, 10000):
+            db.session.execute(db.insert(Event.__table__), [
+                {"name": f'{rng.choice(EVENT_WORDS)} {rng.choice(EVENT_TOPICS)} {i}',
+                 "date": base + datetime.timedelta(hours=i),
+                 "location": rng.choice(['Hội trường A', 'Sân vận động', 'Nhà thi đấu', 'Thư viện']),
+                 "description": f'Sự kiện về {rng.choice(EVENT_TOPICS)} và {rng.choice(EVENT_TOPICS)}',
+                 "total_tickets": 100, "available_tickets": 100}
+                for i in range(start, min(args.events, start + 10000))
+            ])
+        db.session.commit()
+        with db.engine.begin() as connection:
+            if not event_search.supported(connection):
+                print('SQLite không hỗ trợ FTS5, không chạy được benchmark này.')
+                return 1
+            started = time.perf_counter()
+            event_search.rebuild(connection)
+        print(f'{args.events} sự kiện, dựng chỉ mục trong {time.perf_counter() - started:.2f}s')
+
+        print(f'{"truy vấn":<22} {"FTS5 p50":>10} {"kết quả":>8} {"ILIKE p50":>10} {"kết quả":>8}')
+        for query in SEARCH_QUERIES:
+            row = [query]
+            for search in (find_events, find_events_like):
+                timings = []
+                for _ in range(args.repeat):
+                    started = time.perf_counter()
+                    events, has_more = search(query, 1, 24)
+                    timings.append(time.perf_counter() - started)
+                    db.session.rollback()
+                row += [statistics.median(timings) * 1000, f'{len(events)}{"+" if has_more else ""}']
+            print(f'{row[0]:<22} {row[1]:8.2f}ms {row[2]:>8} {row[3]:8.2f}ms {row[4]:>8}')
+    return 0
+
+
+HO = ['Nguyễn', 'Trần', 'Lê', 'Phạm', 'Hoàng', 'Huỳnh', 'Phan', 'Vũ', 'Võ', 'Đặng', 'Bùi', 'Đỗ', 'Hồ', 'Ngô', 'Dương']
+DEM = ['Văn', 'Thị', 'Đức', 'Minh', 'Ngọc', 'Thu', 'Hữu', 'Quang', 'Thanh', 'Hoài']
+TEN = ['An', 'Bình', 'Châu', 'Dũng', 'Giang', 'Hà', 'Hải', 'Hoa', 'Huy', 'Khánh', 'Lan', 'Linh', 'Long', 'Mai',
+       'Nam', 'Nga', 'Phong', 'Phương', 'Quân', 'Sơn', 'Tâm', 'Thảo', 'Trang', 'Tuấn', 'Việt', 'Yến']
+USER_QUERIES = [
+    ('nguyen van', {}), ('Nguyễn Văn Hải', {}), ('tran thi tha', {}), ('duong hoai', {}), ('phuong', {}),
+    ('2021', {}), ('202100', {}), ('0012', {}), ('sv1234', {}), ('sv12345@', {}),
+    ('le minh', {'faculty': FACULTIES[3]}), ('', {'faculty': FACULTIES[0], 'student_class': 'K66 12'}),
+]
+
+
+def bench_user_search(args):
+    """Tìm người dùng cho ô gợi ý: chỉ mục (FTS5 bỏ dấu + tiền tố) so với ILIKE trên nhiều cột."""
+    rng = random.Random(5)
+    with app.app_context():
+        upgrade_database()
+        for start in range(0, args.users, 20000):
+            db.session.execute(db.insert(User.__table__), [
+                {"username": f'sv{i}', "password_hash": '!', "role": 'sinh_vien',
+                 "fullname": f'{rng.choice(HO)} {rng.choice(DEM)} {rng.choice(TEN)}',
+                 "student_id": f'{2020 + i % 5}{i:06d}', "cccd": f'{i * 7919 % 10 ** 12:012d}',
+                 "email": f'sv{i}@dainam.edu.vn', "faculty": FACULTIES[i % len(FACULTIES)],
+                 "student_class": f'K{66 + i % 4} {i % 40}'}
+                for i in range(start, min(args.users, start + 20000))
+            ])
+        db.session.commit()
+        with db.engine.begin() as connection:
+            if not user_search.supported(connection):
+                print('SQLite không hỗ trợ FTS5, không chạy được benchmark này.')
+                return 1
+            started = time.perf_counter()
+            user_search.rebuild(connection)
+        print(f'{args.users} người dùng, dựng chỉ mục trong {time.perf_counter() - started:.2f}s')
+
+        def naive(text_query, filters):
+            query = User.query
+            for name, value in filters.items():
+                query = query.filter(getattr(User, name) == value)
+            pattern = f'%{text_query}%'
+            columns = (User.fullname, User.username, User.email, User.student_id, User.cccd)
+            return query.filter(db.or_(*[column.ilike(pattern) for column in columns])).limit(21).all()
+
+        def indexed(text_query, filters):
+            query = User.query
+            for name, value in filters.items():
+                query = query.filter(getattr(User, name) == value)
+            return find_users(query, text_query, 1, 20)[0]
+
+        print(f'{"truy vấn":<32} {"chỉ mục p50":>12} {"p99":>8} {"kq":>4} {"ILIKE p50":>10} {"p99":>8} {"kq":>4}')
+        for text_query, filters in USER_QUERIES:
+            label = text_query + (' +' + '/'.join(filters.values()) if filters else '')
+            row = []
+            for search in (indexed, naive):
+                timings = []
+                for _ in range(args.repeat):
+                    started = time.perf_counter()
+                    found = search(text_query, filters)
+                    timings.append(time.perf_counter() - started)
+                    db.session.rollback()
+                row += [statistics.median(timings) * 1000, percentile(timings, 99) * 1000, min(len(found), 20)]
+            print(f'{label[:32]:<32} {row[0]:10.2f}ms {row[1]:6.2f}ms {row[2]:4d} '
+                  f'{row[3]:8.2f}ms {row[4]:6.2f}ms {row[5]:4d}')
+    return 0
+
+
+def legacy_find_user(value, kinds=None):
+    """Cách tra cứu cũ: OR trên các cột của bảng user."""
+    columns = [getattr(User, kind) for kind in (kinds or login_identifiers.kinds)]
+    return User.query.filter(db.or_(*[column == value for column in columns])).first()
+
+
+def bench_logins(args):
+    """Đăng nhập ở quy mô lớn: tra bảng định danh so với OR trên bốn cột của bảng user."""
+    rng = random.Random(9)
+    with app.app_context():
+        upgrade_database()
+        # Băm rẻ và dùng chung cho mọi tài khoản để thời gian đo chủ yếu là phần tra cứu
+        password_hash = generate_password_hash('bench-pass', method='pbkdf2:sha256:1000')
+        for start in range(0, args.users, 20000):
+            db.session.execute(db.insert(User.__table__), [
+                {"username": f'sv{i}', "password_hash": password_hash, "role": 'sinh_vien',
+                 "fullname": f'Sinh viên {i}', "student_id": f'{2020 + i % 5}{i:06d}',
+                 "cccd": f'{i * 7919 % 10 ** 12:012d}', "email": f'sv{i}@dainam.edu.vn',
+                 "faculty": FACULTIES[i % len(FACULTIES)]}
+                for i in range(start, min(args.users, start + 20000))
+            ])
+        db.session.commit()
+        with db.engine.begin() as connection:
+            started = time.perf_counter()
+            login_identifiers.rebuild(connection)
+        print(f'{args.users} người dùng, dựng bảng định danh trong {time.perf_counter() - started:.2f}s')
+
+        def identifier(i):
+            return rng.choice([f'sv{i}', f'sv{i}@dainam.edu.vn', f'{2020 + i % 5}{i:06d}',
+                               f'{i * 7919 % 10 ** 12:012d}', f'khong-ton-tai-{i}'])
+        samples = [identifier(rng.randrange(args.users)) for _ in range(args.logins)]
+
+        print(f'{"tra cứu":<12} {"lượt/s":>9} {"p50":>9} {"p99":>9}')
+        for label, find in (('định danh', login_identifiers.find_user), ('OR 4 cột', legacy_find_user)):
+            timings = []
+            for value in samples:
+                started = time.perf_counter()
+                find(value)
+                timings.append(time.perf_counter() - started)
+                db.session.rollback()
+            print(f'{label:<12} {len(timings) / sum(timings):9.0f} {statistics.median(timings) * 1000:7.3f}ms '
+                  f'{percentile(timings, 99) * 1000:7.3f}ms')
+
+
+    # Cả request POST /login (kiểm tra mật khẩu, lưu phiên), ngoài app context ở trên để
+    # current_user không bị giữ lại giữa các request
+    timings, accepted = [], 0
+    for _ in range(args.logins // 10 or 1):
+        i = rng.randrange(args.users)
+        client = app.test_client()
+        started = time.perf_counter()
+        response = client.post('/login', data={'username': f'{2020 + i % 5}{i:06d}', 'password': 'bench-pass'})
+        timings.append(time.perf_counter() - started)
+        accepted += response.status_code == 302
+    print(f'POST /login: {len(timings) / sum(timings):.0f} lượt/s, p50 {statistics.median(timings) * 1000:.2f}ms, '
+              f'p99 {percentile(timings, 99) * 1000:.2f}ms, thành công {accepted}/{len(timings)}')
+    return 0
+
+
+def bench_login_storm(args):
+    """Độ trễ đặt vé khi cùng lúc có nhiều luồng đăng nhập (băm mật khẩu tốn CPU)."""
+    with app.app_context():
+        upgrade_database()
+        accounts = []
+        for i in range(args.accounts):
+            user = User(username=f'storm{i}', role='sinh_vien', fullname=f'Sinh viên {i}')
+            user.set_password('storm-pass')
+            accounts.append(user)
+        db.session.add_all(accounts)
+        db.session.commit()
+    print(f'Băm {app.config["PASSWORD_HASH_METHOD"]}, {args.storm} luồng đăng nhập, '
+          f'{args.bookings} lượt đặt vé trên {args.threads} luồng')
+    print(f'{"kịch bản":<24} {"đặt vé p50":>11} {"p99":>9} {"đăng nhập/s":>12} {"503":>5}')
+
+    scenarios = [('không có đăng nhập', None), (f'băm trực tiếp ({args.storm} luồng)', args.storm),
+                 (f'nhóm {args.workers} luồng băm', args.workers)]
+    for label, workers in scenarios:
+        if workers:
+            # Nhóm luồng mới với số luồng của kịch bản; hàng đợi đủ chứa mọi luồng đăng nhập
+            app.config['PASSWORD_HASH_WORKERS'] = workers
+            app.config['PASSWORD_HASH_QUEUE_SIZE'] = max(args.storm, 1)
+            run.password_hasher = PasswordHasher()
+        with app.app_context():
+            event_id = seed_event(args.bookings, name=f'Bench storm {label}')
+            user_ids = seed_students(args.bookings, prefix=f'storm-{workers}-')
+
+        stop = threading.Event()
+        logins = Counter()
+        lock = threading.Lock()
+
+        def login_worker(index):
+            rng = random.Random(index)
+            client = app.test_client()
+            while not stop.is_set():
+                response = client.post('/login', data={'username': f'storm{rng.randrange(args.accounts)}',
+                                                       'password': 'storm-pass'})
+                client.get('/logout')
+                with lock:
+                    logins[response.status_code] += 1
+
+        storm = [threading.Thread(target=login_worker, args=(i,)) for i in range(args.storm if workers else 0)]
+        for thread in storm:
+            thread.start()
+        time.sleep(0.5 if storm else 0)
+        started = time.perf_counter()
+        with lock:
+            logins.clear()
+        requests = [(logged_in_client(user_id), f'/student/confirm-booking/{event_id}') for user_id in user_ids]
+        latencies, _, _ = measure_requests(requests, args.threads)
+        elapsed = time.perf_counter() - started
+        stop.set()
+        for thread in storm:
+            thread.join()
+        ticket_render_queue.join()  # ảnh vé của kịch bản này không tranh CPU với kịch bản sau
+        print(f'{label:<24} {percentile(latencies, 50) * 1000:9.1f}ms {percentile(latencies, 99) * 1000:7.1f}ms '
+              f'{logins[302] / elapsed:12.1f} {logins[503]:5d}')
+    return 0
+
+
+def bench_waiting_room(args):
+    """Mở bán: mọi sinh viên cùng bấm đặt vé, có và không có phòng chờ."""
+    app.config['WAITING_ROOM_ADMIT_RATE'] = args.rate
+    app.config['WAITING_ROOM_BURST'] = args.rate
+    app.config['WAITING_ROOM_POLL_SECONDS'] = args.poll
+    print(f'{args.students} sinh viên, {args.tickets} vé, {args.threads} luồng, '
+          f'cho vào {args.rate}/giây, hỏi vị trí mỗi {args.poll}s')
+    print(f'{"phòng chờ":>9} {"đặt vé p50":>11} {"p99":>9} {"đồng thời":>9} {"POST đặt vé":>11} '
+          f'{"bán":>5} {"hỏi vị trí p50":>15} {"thời gian":>9}')
+    for enabled in (False, True):
+        app.config['WAITING_ROOM_ENABLED'] = enabled
+        with app.app_context():
+            upgrade_database()
+            event_id = seed_event(args.tickets, name=f'Bench waiting room {enabled}')
+            user_ids = seed_students(args.students, prefix=f'wait-{enabled}-')
+
+        # Mỗi sinh viên là một chuỗi bước (vào trang đặt vé, hỏi vị trí, gửi đặt vé)
+        # được lên lịch theo thời điểm; các luồng lấy bước tới hạn sớm nhất để chạy
+        started = time.perf_counter()
+        steps = [(started, i, 'book' if not enabled else 'arrive', logged_in_client(user_id))
+                 for i, user_id in enumerate(user_ids)]
+        heapq.heapify(steps)
+        condition = threading.Condition()
+        state = {"pending": len(steps), "in_flight": 0, "peak": 0}
+        bookings, polls, outcomes = [], [], Counter()
+
+        def schedule(at, index, step, client):
+            with condition:
+                heapq.heappush(steps, (at, index, step, client))
+                condition.notify()
+
+        def finish(outcome):
+            with condition:
+                outcomes[outcome] += 1
+                state["pending"] -= 1
+                condition.notify_all()
+
+        def run_step(index, step, client):
+            if step == 'arrive':
+                location = client.get(f'/student/book/{event_id}').headers.get('Location', '')
+                if 'waiting-room' in location:
+                    schedule(time.perf_counter() + args.poll, index, 'poll', client)
+                elif 'confirm-booking' in location:
+                    schedule(time.perf_counter(), index, 'book', client)
+                else:
+                    finish('sold_out')
+            elif step == 'poll':
+                polled = time.perf_counter()
+                data = client.get(f'/api/events/{event_id}/queue').get_json()
+                polls.append(time.perf_counter() - polled)
+                if data['state'] == 'admitted':
+                    schedule(time.perf_counter(), index, 'book', client)
+                elif data['state'] == 'waiting':
+                    schedule(time.perf_counter() + data['poll_after'], index, 'poll', client)
+                else:
+                    finish('sold_out')
+            else:
+                with condition:
+                    state["in_flight"] += 1
+                    state["peak"] = max(state["peak"], state["in_flight"])
+                booked = time.perf_counter()
+                response = client.post(f'/student/confirm-booking/{event_id}')
+                bookings.append(time.perf_counter() - booked)
+                with condition:
+                    state["in_flight"] -= 1
+                finish('booked' if '/student/ticket/' in response.headers.get('Location', '') else 'rejected')
+
+        def worker():
+            while True:
+                with condition:
+                    while True:
+                        if state["pending"] == 0:
+                            return
+                        wait = steps[0][0] - time.perf_counter() if steps else None
+                        if wait is not None and wait <= 0:
+                            _, index, step, client = heapq.heappop(steps)
+                            break
+                        condition.wait(wait)
+                run_step(index, step, client)
+
+        threads = [threading.Thread(target=worker) for _ in range(args.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        ticket_render_queue.join()
+        label = 'bật' if enabled else 'tắt'
+        print(f'{label:>9} {percentile(bookings, 50) * 1000:9.1f}ms {percentile(bookings, 99) * 1000:7.1f}ms '
+              f'{state["peak"]:9d} {len(bookings):11d} {outcomes["booked"]:5d} '
+              f'{percentile(polls, 50) * 1000:13.2f}ms {elapsed:8.1f}s')
+    return 0
+
+
+def bench_inventory(args):
+    """Đặt vé đồng thời: trừ vé trên dòng sự kiện trong CSDL so với kho vé trong bộ nhớ."""
+    print(f'{args.students} sinh viên tranh {args.tickets} vé trên {args.threads} luồng')
+    print(f'{"kho vé":>9} {"lượt/s":>8} {"p50":>8} {"p99":>9} {"bán":>5} {"còn lại":>8} {"lệch":>5}')
+    failed = False
+    for mode in ('database', 'memory'):
+        app.config['INVENTORY_MODE'] = mode
+        with app.app_context():
+            upgrade_database()
+            event_id = seed_event(args.tickets, name=f'Bench inventory {mode}')
+            user_ids = seed_students(args.students, prefix=f'inventory-{mode}-')
+
+        pending = queue.Queue()
+        for user_id in user_ids:
+            pending.put(user_id)
+        latencies, booked = [], []
+        lock = threading.Lock()
+
+        def worker():
+            while True:
+                try:
+                    user_id = pending.get_nowait()
+                except queue.Empty:
+                    return
+                started = time.perf_counter()
+                with app.app_context():
+                    ticket_code = TicketController.process_booking(user_id, event_id)
+                elapsed = time.perf_counter() - started
+                with lock:
+                    latencies.append(elapsed)
+                    if ticket_code:
+                        booked.append(user_id)
+
+        threads = [threading.Thread(target=worker) for _ in range(args.threads)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        ticket_render_queue.join()
+
+        with app.app_context():
+            seat_inventory.flush()
+            sold = Ticket.query.filter_by(event_id=event_id).count()
+            available = db.session.get(Event, event_id).available_tickets
+            with db.engine.begin() as connection:
+                drift = seat_inventory.reconcile(connection)
+        print(f'{mode:>9} {len(booked) / elapsed:8.1f} {percentile(latencies, 50) * 1000:6.1f}ms '
+              f'{percentile(latencies, 99) * 1000:7.1f}ms {sold:5d} {available:8d} {len(drift):5d}')
+        failed |= sold != len(booked) or sold + available != args.tickets or bool(drift)
+        failed |= sold != min(args.tickets, len(user_ids))
+    if failed:
+        print('LỖI: số vé không nhất quán (bán vượt/bán thiếu hoặc số vé còn lại bị lệch).')
+        return 1
+    print('OK: không bán vượt, không bán thiếu, số vé còn lại khớp với số vé đã bán.')
+    return 0
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(workers, threads, port):
+    """Chạy gunicorn với wsgi:app trên CSDL của benchmark; trả về tiến trình khi đã nhận kết nối."""
+    env = dict(os.environ,
+               WEB_CONCURRENCY=str(workers),
+               GUNICORN_THREADS=str(threads),
+               GUNICORN_ACCESS_LOG='',
+               FLASK_WAITING_ROOM_ENABLED='false',
+               FLASK_TICKET_IMAGE_DISK_CACHE_DIR=json.dumps(os.path.join(BENCH_DIR, 'ticket_images')))
+    root = os.path.dirname(os.path.abspath(__file__))
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app',
+                               '--bind', f'127.0.0.1:{port}', '--log-level', 'warning'],
+                              cwd=root, env=env)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f'gunicorn thoát với mã {server.returncode}')
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError('gunicorn không khởi động kịp')
+
+
+def bench_serve(args):
+    """Số request/giây qua gunicorn với số worker khác nhau (trộn API đọc và POST đặt vé)."""
+    try:
+        import gunicorn  # noqa: F401
+    except ImportError:
+        print('Cần cài gunicorn: pip install gunicorn')
+        return 1
+    serializer = app.session_interface.get_signing_serializer(app)
+
+    def session_cookie(user_id):
+        return serializer.dumps({'_user_id': str(user_id), '_fresh': True})
+
+    print(f'{args.threads} client keep-alive, {args.server_threads} luồng/worker, {args.warmup:.0f}s khởi động + '
+          f'{args.duration:.0f}s đo mỗi cấu hình; mỗi client: 3 lượt GET API rồi 1 lượt đặt vé')
+    print(f'{"worker":>6} {"request/s":>10} {"p50":>8} {"p99":>9} {"lỗi":>5} {"bán":>6} {"còn lại":>8}')
+    failed = False
+    workers_list = [int(value) for value in args.workers.split(',')]
+    for workers in workers_list:
+        with app.app_context():
+            upgrade_database()
+            event_id = seed_event(args.tickets, name=f'Bench serve {workers}')
+            admin_id = seed_staff()
+            user_ids = seed_students(args.students, prefix=f'serve-{workers}-')
+        port = free_port()
+        server = start_server(workers, args.server_threads, port)
+        latencies, errors = [], Counter()
+        lock = threading.Lock()
+        students = queue.Queue()
+        for user_id in user_ids:
+            students.put(user_id)
+        admin_cookie = session_cookie(admin_id)
+        # Các worker import run.py song song sau khi gunicorn mở cổng; bỏ qua giai đoạn khởi động
+        measured = time.perf_counter() + args.warmup
+        deadline = measured + args.duration
+
+        def client():
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            local, step = [], 0
+            while time.perf_counter() < deadline:
+                if step % 4 == 3:
+                    try:
+                        user_id = students.get_nowait()
+                    except queue.Empty:
+                        step += 1
+                        continue
+                    method, path, cookie = 'POST', f'/student/confirm-booking/{event_id}', session_cookie(user_id)
+                elif step % 2:
+                    method, path, cookie = 'GET', '/api/admin/tickets?per_page=20', admin_cookie
+                else:
+                    method, path, cookie = 'GET', '/api/events/availability', admin_cookie
+                step += 1
+                started = time.perf_counter()
+                try:
+                    connection.request(method, path, headers={'Cookie': f'session={cookie}',
+                                                             'Content-Length': '0'})
+                    response = connection.getresponse()
+                    response.read()
+                    status = response.status
+                except (OSError, http.client.HTTPException):
+                    connection.close()
+                    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+                    status = 'lỗi kết nối'
+                if started < measured:
+                    continue
+                local.append(time.perf_counter() - started)
+                if status not in (200, 302):
+                    with lock:
+                        errors[status] += 1
+            connection.close()
+            with lock:
+                latencies.extend(local)
+
+        threads = [threading.Thread(target=client) for _ in range(args.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - measured
+        server.terminate()
+        server.wait()
+        # Worker đã ghi kho vé xuống CSDL khi dừng (atexit), số còn lại phải khớp số đã bán
+        with app.app_context():
+            sold = Ticket.query.filter_by(event_id=event_id).count()
+            available = db.session.get(Event, event_id).available_tickets
+        print(f'{workers:6d} {len(latencies) / elapsed:10.1f} {percentile(latencies, 50) * 1000:6.1f}ms '
+              f'{percentile(latencies, 99) * 1000:7.1f}ms {sum(errors.values()):5d} {sold:6d} {available:8d}')
+        if errors:
+            print(f'       mã lỗi: {dict(errors)}')
+        failed |= sold + available != args.tickets
+    if failed:
+        print('LỖI: số vé còn lại không khớp với số vé đã bán.')
+        return 1
+    return 0
+
+
+def bench_database(args):
+    """Đặt vé đồng thời khi có truy vấn thống kê chạy song song, theo từng cấu hình SQLite."""
+    app.config['INVENTORY_MODE'] = 'database'  # mỗi lượt đặt vé đều ghi xuống CSDL
+    with app.app_context():
+        upgrade_database()
+        if db.engine.dialect.name != 'sqlite':
+            print('Benchmark này so sánh các cấu hình SQLite; DATABASE_URL đang trỏ tới CSDL khác.')
+            return 1
+        print(f'Tạo {args.users} sinh viên, {args.tickets} vé cho truy vấn thống kê...')
+        bulk_seed(args.users, args.tickets, 20)
+    print(f'{args.threads} luồng đặt vé ({args.bookings} lượt), {args.readers} luồng đọc thống kê; '
+          f'busy_timeout {app.config["SQLITE_BUSY_TIMEOUT_MS"]}ms')
+    print(f'{"journal/synchronous":>20} {"lượt/s":>8} {"p50":>8} {"p99":>9} {"lỗi":>5} {"đọc/s":>7}')
+    report = text('SELECT u.faculty, COUNT(*), SUM(t.is_used) FROM ticket t JOIN user u ON u.id = t.user_id '
+                  'GROUP BY u.faculty')
+    for journal_mode, synchronous in (('delete', 'full'), ('wal', 'full'), ('wal', 'normal')):
+        ticket_render_queue.join()
+        app.config['SQLITE_JOURNAL_MODE'] = journal_mode
+        app.config['SQLITE_SYNCHRONOUS'] = synchronous
+        with app.app_context():
+            db.engine.dispose()  # kết nối mới chạy lại các PRAGMA theo cấu hình ở trên
+            mode = db.session.connection().exec_driver_sql('PRAGMA journal_mode').scalar()
+            event_id = seed_event(args.bookings, name=f'Bench database {journal_mode} {synchronous}')
+            user_ids = seed_students(args.bookings, prefix=f'database-{journal_mode}-{synchronous}-')
+
+        pending = queue.Queue()
+        for user_id in user_ids:
+            pending.put(user_id)
+        latencies, failures, reads = [], [], []
+        lock = threading.Lock()
+        done = threading.Event()
+
+        def booker():
+            while True:
+                try:
+                    user_id = pending.get_nowait()
+                except queue.Empty:
+                    return
+                started = time.perf_counter()
+                try:
+                    with app.app_context():
+                        ticket_code = TicketController.process_booking(user_id, event_id)
+                except SQLAlchemyError:  # hết kết nối trong pool khi các transaction chờ khóa quá lâu
+                    ticket_code = None
+                elapsed = time.perf_counter() - started
+                with lock:
+                    latencies.append(elapsed)
+                    if not ticket_code:
+                        failures.append(user_id)
+
+        def reader():
+            with app.app_context():
+                while not done.is_set():
+                    with db.engine.connect() as connection:
+                        connection.execute(report).all()
+                    reads.append(1)
+
+        readers = [threading.Thread(target=reader) for _ in range(args.readers)]
+        bookers = [threading.Thread(target=booker) for _ in range(args.threads)]
+        started = time.perf_counter()
+        for thread in readers + bookers:
+            thread.start()
+        for thread in bookers:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        done.set()
+        for thread in readers:
+            thread.join()
+        label = f'{mode}/{synchronous}'
+        print(f'{label:>20} {(len(latencies) - len(failures)) / elapsed:8.1f} '
+              f'{percentile(latencies, 50) * 1000:6.1f}ms {percentile(latencies, 99) * 1000:7.1f}ms '
+              f'{len(failures):5d} {len(reads) / elapsed:7.1f}')
+    ticket_render_queue.join()
+    return 0
+
+
+def bench_read_routing(args):
+    """Độ trễ đặt vé khi admin tải các trang thống kê/danh sách, có và không có engine đọc."""
+    use_project_templates()
+    app.config['INVENTORY_MODE'] = 'database'
+    with app.app_context():
+        upgrade_database()
+        if 'read' not in db.engines:
+            print('Không có engine đọc: đặt DATABASE_READ_URL hoặc dùng CSDL SQLite trong file.')
+            return 1
+        print(f'Tạo {args.users} sinh viên, {args.tickets} vé cho các trang quản lý...')
+        bulk_seed(args.users, args.tickets, 20)
+        admin_id = seed_staff('admin')
+        engines = {'chính': db.engine, 'đọc': db.engines['read']}
+    statements = Counter()
+    for name, engine in engines.items():
+        sqla_event.listen(engine, 'before_cursor_execute',
+                          lambda *_, name=name: statements.update((name,)))
+    pages = ['/admin/dashboard', '/admin/manage-tickets?per_page=200', '/admin/manage-users?per_page=200']
+    print(f'{args.threads} luồng đặt vé ({args.bookings} lượt), {args.readers} luồng tải trang quản lý')
+    print(f'{"tải dashboard":>20} {"đặt vé p50":>11} {"p99":>9} {"trang/s":>8} {"SQL chính":>10} {"SQL đọc":>8}')
+    for label, readers, routed in (('không', 0, False), ('trên CSDL chính', args.readers, False),
+                                   ('trên engine đọc', args.readers, True)):
+        ticket_render_queue.join()
+        app.config['READ_ROUTING_ENABLED'] = routed
+        with app.app_context():
+            event_id = seed_event(args.bookings, name=f'Bench read routing {label}')
+            user_ids = seed_students(args.bookings, prefix=f'routing-{routed}-{readers}-')
+        statements.clear()
+        pending = queue.Queue()
+        for user_id in user_ids:
+            pending.put(user_id)
+        latencies, loads = [], []
+        done = threading.Event()
+
+        def booker():
+            while True:
+                try:
+                    user_id = pending.get_nowait()
+                except queue.Empty:
+                    return
+                started = time.perf_counter()
+                with app.app_context():
+                    TicketController.process_booking(user_id, event_id)
+                latencies.append(time.perf_counter() - started)
+
+        def reader(offset):
+            admin = logged_in_client(admin_id)
+            for i in range(offset, 10 ** 9):
+                if done.is_set():
+                    return
+                admin.get(pages[i % len(pages)])
+                loads.append(1)
+
+        threads = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+        bookers = [threading.Thread(target=booker) for _ in range(args.threads)]
+        started = time.perf_counter()
+        for thread in threads + bookers:
+            thread.start()
+        for thread in bookers:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        done.set()
+        for thread in threads:
+            thread.join()
+        print(f'{label:>20} {percentile(latencies, 50) * 1000:9.1f}ms {percentile(latencies, 99) * 1000:7.1f}ms '
+              f'{len(loads) / elapsed:8.1f} {statements["chính"]:10d} {statements["đọc"]:8d}')
+    ticket_render_queue.join()
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark hệ thống đặt vé concert')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    booking = commands.add_parser('booking', help='Đặt vé đồng thời cho một sự kiện')
+    booking.add_argument('--threads', type=int, default=32)
+    booking.add_argument('--tickets', type=int, default=500)
+    booking.add_argument('--students', type=int, default=0,
+                         help='Số sinh viên tranh vé (mặc định gấp đôi số vé)')
+    booking.add_argument('--duplicates', action='store_true',
+                         help='Mỗi sinh viên gửi yêu cầu đặt vé hai lần')
+    booking.set_defaults(func=bench_booking)
+
+    render = commands.add_parser('render', help='Độ trễ đặt vé: tạo ảnh ngay so với hàng đợi nền')
+    render.add_argument('--threads', type=int, default=8)
+    render.add_argument('--requests', type=int, default=300)
+    render.set_defaults(func=bench_render)
+
+    art = commands.add_parser('art', help='Tốc độ tạo ảnh vé có và không có cache ảnh nền/font')
+    art.add_argument('--tickets', type=int, default=200)
+    art.set_defaults(func=bench_art)
+
+    checkin = commands.add_parser('checkin', help='Tải đồng thời lên API soát vé /api/checkin')
+    checkin.add_argument('--threads', type=int, default=16, help='Số cổng quét đồng thời')
+    checkin.add_argument('--tickets', type=int, default=2000)
+    checkin.add_argument('--passes', type=int, default=2, help='Mỗi vé bị quét bao nhiêu lần')
+    checkin.add_argument('--batch', type=int, default=0,
+                         help='Gửi theo lô N lượt quét qua /api/checkin/batch (0: từng lượt)')
+    checkin.set_defaults(func=bench_checkin)
+
+    indexes = commands.add_parser('indexes', help='Truy vấn theo route trước/sau khi tạo chỉ mục')
+    indexes.add_argument('--users', type=int, default=100000)
+    indexes.add_argument('--tickets', type=int, default=500000)
+    indexes.add_argument('--events', type=int, default=200)
+    indexes.add_argument('--repeat', type=int, default=5)
+    indexes.set_defaults(func=bench_indexes)
+
+    queries = commands.add_parser('queries', help='Số câu SQL của các trang danh sách (phát hiện N+1)')
+    queries.add_argument('--students', type=int, default=300)
+    queries.add_argument('--events', type=int, default=5)
+    queries.set_defaults(func=bench_queries)
+
+    profiler = commands.add_parser('profiler', help='Chi phí của việc đo hiệu năng theo request')
+    profiler.add_argument('--students', type=int, default=500)
+    profiler.add_argument('--requests', type=int, default=200)
+    profiler.set_defaults(func=bench_profiler)
+
+    search = commands.add_parser('search', help='Tìm kiếm sự kiện: FTS5 bỏ dấu so với ILIKE')
+    search.add_argument('--events', type=int, default=50000)
+    search.add_argument('--repeat', type=int, default=20)
+    search.set_defaults(func=bench_search)
+
+    user_search_parser = commands.add_parser('usersearch', help='Tìm người dùng: chỉ mục so với ILIKE nhiều cột')
+    user_search_parser.add_argument('--users', type=int, default=200000)
+    user_search_parser.add_argument('--repeat', type=int, default=20)
+    user_search_parser.set_defaults(func=bench_user_search)
+
+    logins = commands.add_parser('logins', help='Đăng nhập: bảng định danh so với OR trên bốn cột')
+    logins.add_argument('--users', type=int, default=200000)
+    logins.add_argument('--logins', type=int, default=5000)
+    logins.set_defaults(func=bench_logins)
+
+    storm = commands.add_parser('loginstorm', help='Độ trễ đặt vé khi có nhiều lượt đăng nhập cùng lúc')
+    storm.add_argument('--storm', type=int, default=32, help='Số luồng liên tục gửi POST /login')
+    storm.add_argument('--workers', type=int, default=1, help='Số luồng băm mật khẩu khi có giới hạn')
+    storm.add_argument('--accounts', type=int, default=20)
+    storm.add_argument('--bookings', type=int, default=200)
+    storm.add_argument('--threads', type=int, default=4)
+    storm.set_defaults(func=bench_login_storm)
+
+    waiting = commands.add_parser('waitingroom', help='Mở bán với và không có phòng chờ')
+    waiting.add_argument('--students', type=int, default=1500)
+    waiting.add_argument('--tickets', type=int, default=300)
+    waiting.add_argument('--threads', type=int, default=64)
+    waiting.add_argument('--rate', type=int, default=40, help='Số sinh viên được vào trang đặt vé mỗi giây')
+    waiting.add_argument('--poll', type=float, default=0.5, help='Chu kỳ hỏi vị trí (giây)')
+    waiting.set_defaults(func=bench_waiting_room)
+
+    inventory = commands.add_parser('inventory', help='Đặt vé: trừ vé trong CSDL so với kho vé trong bộ nhớ')
+    inventory.add_argument('--threads', type=int, default=32)
+    inventory.add_argument('--tickets', type=int, default=1000)
+    inventory.add_argument('--students', type=int, default=1500)
+    inventory.set_defaults(func=bench_inventory)
+
+    serve = commands.add_parser('serve', help='Số request/giây qua gunicorn theo số worker')
+    serve.add_argument('--workers', default='1,2,4', help='Các số worker cần đo, cách nhau bởi dấu phẩy')
+    serve.add_argument('--server-threads', type=int, default=8)
+    serve.add_argument('--threads', type=int, default=32, help='Số client gửi request đồng thời')
+    serve.add_argument('--duration', type=float, default=10)
+    serve.add_argument('--warmup', type=float, default=5)
+    serve.add_argument('--tickets', type=int, default=100000)
+    serve.add_argument('--students', type=int, default=20000)
+    serve.set_defaults(func=bench_serve)
+
+    database = commands.add_parser('database', help='Đặt vé trên SQLite: rollback journal so với WAL')
+    database.add_argument('--threads', type=int, default=32)
+    database.add_argument('--bookings', type=int, default=1000)
+    database.add_argument('--readers', type=int, default=2, help='Số luồng chạy truy vấn thống kê song song')
+    database.add_argument('--users', type=int, default=5000)
+    database.add_argument('--tickets', type=int, default=50000)
+    database.set_defaults(func=bench_database)
+
+    routing = commands.add_parser('readrouting', help='Độ trễ đặt vé khi tải dashboard: CSDL chính so với engine đọc')
+    routing.add_argument('--threads', type=int, default=16)
+    routing.add_argument('--bookings', type=int, default=1000)
+    routing.add_argument('--readers', type=int, default=4, help='Số luồng liên tục tải trang quản lý')
+    routing.add_argument('--users', type=int, default=20000)
+    routing.add_argument('--tickets', type=int, default=100000)
+    routing.set_defaults(func=bench_read_routing)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
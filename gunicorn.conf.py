@@ -0,0 +1,26 @@
+# Cấu hình gunicorn: gunicorn -c gunicorn.conf.py wsgi:app
+#
+# Mỗi worker là một tiến trình với nhiều luồng (gthread). Các dịch vụ trong bộ nhớ
+# (kho vé, phòng chờ, luồng số vé còn lại, cache trang sự kiện) là riêng của từng
+# worker, nên:
+#   - chạy nhiều worker thì kho vé chuyển sang INVENTORY_MODE=database;
+#   - phòng chờ xếp hàng theo từng worker: đặt proxy giữ phiên (sticky) hoặc chạy
+#     một worker nhiều luồng trong đợt mở bán lớn.
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+worker_class = 'gthread'
+timeout = 60
+graceful_timeout = 30
+keepalive = 5
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-') or None  # rỗng để tắt
+
+if workers > 1:
+    os.environ.setdefault('INVENTORY_MODE', 'database')
+
+# Mỗi kết nối SSE (và mỗi long-poll đang chờ) giữ một luồng tới AVAILABILITY_STREAM_SECONDS
+# giây; chừa ít nhất một nửa số luồng cho các request thường. Trình duyệt bị từ chối sẽ
+# chuyển sang hỏi định kỳ nên tăng GUNICORN_THREADS nếu muốn nhiều luồng SSE hơn
+os.environ.setdefault('FLASK_AVAILABILITY_MAX_STREAMS', str(max(threads // 2, 1)))
@@ -1,23 +1,93 @@
+import io
 import os
+import atexit
 import uuid
 import datetime
+import time
+import click
 import qrcode
 import json
+import gzip
+import hmac
+import base64
+import struct
+import queue
+import hashlib
+import threading
+import bisect
+import heapq
+import re
+import unicodedata
+import sqlite3
+from collections import OrderedDict, namedtuple, Counter
+from concurrent.futures import ProcessPoolExecutor, Future
 from PIL import Image, ImageDraw, ImageFont
 from functools import wraps
-from flask import Flask, render_template, request, redirect, url_for, flash, send_from_directory, jsonify
+from flask import (Flask, render_template, request, redirect, url_for, flash, send_from_directory, send_file, jsonify,
+                   Response, make_response, session, abort, before_render_template, template_rendered, g,
+                   has_request_context)
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session as FlaskSession
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
-from sqlalchemy.exc import IntegrityError
-from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy import or_, and_, update, insert, case, bindparam, text, event as sqla_event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.orm import joinedload, contains_eager
+from sqlalchemy.schema import CreateColumn
+from sqlalchemy.sql.dml import UpdateBase
 
 # 1. Khởi tạo ứng dụng và cấu hình
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your_super_secret_key'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///my_database.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///my_database.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+# CSDL chọn bằng DATABASE_URL: SQLite (mặc định) hoặc CSDL máy chủ (postgresql://, mysql+pymysql://...).
+# SQLite: mỗi kết nối bật WAL để người đọc không chặn người ghi, chờ khóa tối đa
+# SQLITE_BUSY_TIMEOUT_MS thay vì báo "database is locked", và synchronous=NORMAL (trong WAL
+# chỉ có thể mất vài transaction cuối khi mất điện, CSDL không bị hỏng).
+# Nhóm kết nối mỗi tiến trình: DB_POOL_SIZE kết nối thường trực + DB_MAX_OVERFLOW khi cao điểm;
+# với CSDL máy chủ, kết nối được kiểm tra trước khi dùng và làm mới sau DB_POOL_RECYCLE giây.
+app.config['SQLITE_JOURNAL_MODE'] = os.environ.get('SQLITE_JOURNAL_MODE', 'wal')
+app.config['SQLITE_SYNCHRONOUS'] = os.environ.get('SQLITE_SYNCHRONOUS', 'normal')
+app.config['SQLITE_BUSY_TIMEOUT_MS'] = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+
+def database_engine_options(uri):
+    """Tùy chọn engine SQLAlchemy cho uri theo các biến môi trường DB_*."""
+    url = make_url(uri)
+    pool = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 20)),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30)),
+    }
+    if url.get_backend_name() == 'sqlite':
+        # SQLite trong bộ nhớ chỉ có một kết nối dùng chung (StaticPool của Flask-SQLAlchemy)
+        if url.database in (None, '', ':memory:'):
+            return {}
+        return pool
+    return dict(pool, pool_pre_ping=True, pool_recycle=int(os.environ.get('DB_POOL_RECYCLE', 1800)))
+
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = database_engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+
+# Engine đọc cho các route chỉ đọc (trang thống kê, danh sách quản lý, danh sách sự kiện):
+# DATABASE_READ_URL trỏ tới bản sao; không đặt thì SQLite dùng chính file CSDL mở chỉ đọc
+# (WAL cho phép đọc song song với người ghi). Sau khi người dùng ghi, các trang của họ đọc
+# từ CSDL chính trong READ_STALENESS_SECONDS giây: độ trễ của bản sao phải nhỏ hơn ngân sách này.
+def read_database_url(uri):
+    if os.environ.get('DATABASE_READ_URL'):
+        return os.environ['DATABASE_READ_URL']
+    url = make_url(uri)
+    if url.get_backend_name() != 'sqlite' or url.database in (None, '', ':memory:') or url.query.get('uri'):
+        return None
+    return url.set(database=f'file:{url.database}', query={'mode': 'ro', 'uri': 'true'}).render_as_string(hide_password=False)
+
+app.config['READ_ROUTING_ENABLED'] = os.environ.get('READ_ROUTING_ENABLED', '1') == '1'
+app.config['READ_STALENESS_SECONDS'] = float(os.environ.get('READ_STALENESS_SECONDS', 5))
+_read_url = read_database_url(app.config['SQLALCHEMY_DATABASE_URI'])
+if _read_url:
+    app.config['SQLALCHEMY_BINDS'] = {'read': dict(database_engine_options(_read_url), url=_read_url)}
 app.config['TEMPLATES_AUTO_RELOAD'] = True  # Tắt cache template
 
 # Cấu hình thư mục để lưu ảnh tải lên
@@ -26,6 +96,88 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
 
+# Mã QR trên vé là token ký HMAC; mã QR JSON cũ vẫn được chấp nhận trong thời gian chuyển tiếp
+app.config['QR_SIGNING_KEY'] = app.config['SECRET_KEY']
+app.config['QR_ACCEPT_LEGACY_JSON'] = True
+
+# Tạo ảnh vé: 'queued' đẩy sang luồng nền, 'inline' tạo ngay trong request đặt vé
+app.config['TICKET_RENDER_MODE'] = 'queued'
+app.config['TICKET_RENDER_WORKERS'] = 2
+app.config['TICKET_RENDER_QUEUE_SIZE'] = 1000
+
+# Ảnh vé được tạo khi cần và giữ trong cache LRU (bộ nhớ + thư mục đĩa tùy chọn)
+app.config['TICKET_IMAGE_CACHE_ENTRIES'] = 512
+app.config['TICKET_IMAGE_DISK_CACHE_DIR'] = os.path.join(app.instance_path, 'ticket_images')  # None để tắt
+app.config['TICKET_IMAGE_DISK_CACHE_FILES'] = 20000
+
+# Số lượt quét tối đa trong một request soát vé theo lô
+app.config['CHECKIN_BATCH_LIMIT'] = 1000
+
+# Đo hiệu năng theo request (số câu SQL, thời gian CSDL/template) cho /admin/metrics và /metrics
+app.config['PROFILING_ENABLED'] = os.environ.get('PROFILING_ENABLED') == '1'
+app.config['PROFILING_SLOW_STATEMENTS'] = 20
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')  # Bearer token cho máy thu thập /metrics
+
+# Luồng số vé còn lại (Server-Sent Events): gom thay đổi tối đa vài lần mỗi giây,
+# đọc lại CSDL định kỳ để thấy cả lượt đặt vé ở tiến trình khác
+app.config['AVAILABILITY_POLL_SECONDS'] = 2
+app.config['AVAILABILITY_MIN_INTERVAL'] = 0.25
+app.config['AVAILABILITY_KEEPALIVE_SECONDS'] = 15
+app.config['AVAILABILITY_STREAM_SECONDS'] = 300  # trình duyệt tự kết nối lại sau khi luồng đóng
+# Mỗi luồng SSE (và mỗi long-poll đang chờ) giữ một luồng xử lý request suốt thời gian mở, nên
+# AVAILABILITY_MAX_STREAMS phải nhỏ hơn số luồng của mỗi worker (gunicorn.conf.py đặt bằng một
+# nửa) để còn luồng cho đặt vé. Quá giới hạn thì SSE trả 503 và trình duyệt chuyển sang hỏi
+# định kỳ /api/events/availability mỗi AVAILABILITY_FALLBACK_POLL_SECONDS giây.
+app.config['AVAILABILITY_MAX_STREAMS'] = 200  # máy chủ phát triển: mỗi request một luồng
+app.config['AVAILABILITY_FALLBACK_POLL_SECONDS'] = 5
+
+# Cache danh sách/chi tiết sự kiện cho các trang xem sự kiện (LRU + TTL). Khi có người
+# đặt vé, số vé còn lại trong cache được phép cũ tối đa CATALOG_COUNTS_MAX_AGE giây.
+app.config['CATALOG_CACHE_ENTRIES'] = 256
+app.config['CATALOG_CACHE_TTL'] = 60
+app.config['CATALOG_COUNTS_MAX_AGE'] = 1.0
+
+# Số sự kiện mỗi trang kết quả tìm kiếm
+app.config['SEARCH_PAGE_SIZE'] = 24
+
+# Phân trang các trang quản lý: các cỡ trang được chọn, cỡ trang đầu tiên là mặc định
+app.config['ADMIN_PAGE_SIZES'] = (50, 25, 100, 200)
+
+# Băm mật khẩu/câu trả lời bảo mật: thuật toán theo cú pháp của werkzeug ('scrypt',
+# 'scrypt:16384:8:1', 'pbkdf2:sha256:600000'...). Băm cũ được băm lại khi người dùng đăng nhập.
+# Chỉ PASSWORD_HASH_WORKERS luồng được băm cùng lúc; quá PASSWORD_HASH_QUEUE_SIZE lượt chờ
+# thì đăng nhập trả về 503 thay vì chiếm hết CPU của các route khác.
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', max(1, (os.cpu_count() or 2) // 2)))
+app.config['PASSWORD_HASH_QUEUE_SIZE'] = 32
+
+# Phòng chờ trước trang đặt vé: mỗi sự kiện cho vào tối đa WAITING_ROOM_ADMIT_RATE
+# sinh viên/giây theo thứ tự xếp hàng; hàng đợi đóng ngay khi hết vé
+app.config['WAITING_ROOM_ENABLED'] = True
+app.config['WAITING_ROOM_ADMIT_RATE'] = 20
+app.config['WAITING_ROOM_BURST'] = 20
+app.config['WAITING_ROOM_POLL_SECONDS'] = 3
+
+# Số vé còn lại: 'memory' giữ bộ đếm trong tiến trình và ghi xuống CSDL theo lô mỗi
+# INVENTORY_FLUSH_SECONDS giây (chỉ đúng khi chạy MỘT tiến trình); 'database' trừ vé
+# bằng câu UPDATE có điều kiện trên dòng sự kiện (dùng khi chạy nhiều tiến trình)
+app.config['INVENTORY_MODE'] = os.environ.get('INVENTORY_MODE', 'memory')
+app.config['INVENTORY_FLUSH_SECONDS'] = 0.5
+# Hết chỗ nhưng còn lượt đặt vé đang giữ chỗ (có thể thất bại và trả lại): chờ tối đa
+# chừng này giây trước khi báo hết vé
+app.config['INVENTORY_RESERVATION_WAIT'] = 2.0
+
+# Số dòng (slot) của mỗi bộ đếm thống kê; tăng khi nhiều luồng đặt vé cùng lúc trên CSDL máy chủ
+app.config['DASHBOARD_COUNTER_SLOTS'] = 8
+
+# Mọi khóa cấu hình ở trên ghi đè được bằng biến môi trường FLASK_<KHÓA> (giá trị JSON, ví dụ
+# FLASK_SECRET_KEY='"..."', FLASK_WAITING_ROOM_ADMIT_RATE=50). Đọc một lần khi import để
+# `python run.py`, gunicorn (wsgi.py) và các lệnh `flask --app run ...` dùng cùng cấu hình.
+app.config.from_prefixed_env()
+# Khóa ký QR đi theo SECRET_KEY nếu không được đặt riêng
+if 'FLASK_QR_SIGNING_KEY' not in os.environ:
+    app.config['QR_SIGNING_KEY'] = app.config['SECRET_KEY']
+
 # Các định dạng file ảnh cho phép
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 
@@ -38,7 +190,35 @@ SECURITY_QUESTIONS = [
     "Tên món ăn yêu thích của bạn là gì?"
 ]
 
-db = SQLAlchemy(app)
+class RoutingSession(FlaskSession):
+    """Session gửi câu SELECT của route có @use_read_engine sang engine đọc.
+
+    Flush và câu INSERT/UPDATE/DELETE luôn chạy trên CSDL chính và được ghi nhận để các
+    request tiếp theo của người dùng đọc lại từ CSDL chính (xem READ_STALENESS_SECONDS).
+    """
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_request_context():
+            if self._flushing or isinstance(clause, UpdateBase):
+                g.db_wrote = True
+            elif g.get('db_read_engine'):
+                return db.engines['read']
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
+
+@sqla_event.listens_for(Engine, 'connect')
+def _configure_sqlite_connection(dbapi_connection, connection_record):
+    # Chạy cho mọi kết nối mới; đổi cấu hình SQLITE_* rồi engine.dispose() để áp dụng lại
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA busy_timeout = {int(app.config['SQLITE_BUSY_TIMEOUT_MS'])}")
+    try:
+        cursor.execute(f"PRAGMA journal_mode = {app.config['SQLITE_JOURNAL_MODE']}")
+    except sqlite3.OperationalError:
+        pass  # kết nối chỉ đọc (engine đọc) không đổi được chế độ journal; kết nối ghi sẽ đổi
+    cursor.execute(f"PRAGMA synchronous = {app.config['SQLITE_SYNCHRONOUS']}")
+    cursor.close()
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 
@@ -50,41 +230,43 @@ def allowed_file(filename):
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
-    password_hash = db.Column(db.String(128), nullable=False)
-    role = db.Column(db.String(20), nullable=False)  # 'admin', 'doan_truong', 'sinh_vien'
+    password_hash = db.Column(db.String(255), nullable=False)
+    role = db.Column(db.String(20), nullable=False, index=True)  # 'admin', 'doan_truong', 'sinh_vien'
     student_id = db.Column(db.String(20), unique=True, nullable=True)
     cccd = db.Column(db.String(20), unique=True, nullable=True)
     fullname = db.Column(db.String(100), nullable=True)
     email = db.Column(db.String(100), unique=True, nullable=True)
     phone = db.Column(db.String(20), nullable=True)
-    faculty = db.Column(db.String(100), nullable=True)
-    student_class = db.Column(db.String(50), nullable=True)
+    faculty = db.Column(db.String(100), nullable=True, index=True)
+    student_class = db.Column(db.String(50), nullable=True, index=True)
     dob = db.Column(db.Date, nullable=True)
     course = db.Column(db.String(50), nullable=True)
     security_question = db.Column(db.String(200), nullable=True)
-    security_answer_hash = db.Column(db.String(128), nullable=True)
+    security_answer_hash = db.Column(db.String(255), nullable=True)
     tickets = db.relationship('Ticket', back_populates='user', lazy=True)
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return password_hasher.verify(self.password_hash, password)
 
     def set_security_answer(self, answer):
-        self.security_answer_hash = generate_password_hash(answer.lower().strip())
+        self.security_answer_hash = password_hasher.hash(answer.lower().strip())
 
     def check_security_answer(self, answer):
-        return check_password_hash(self.security_answer_hash, answer.lower().strip())
+        return password_hasher.verify(self.security_answer_hash, answer.lower().strip())
 
 class Event(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
-    date = db.Column(db.DateTime, nullable=False)
+    date = db.Column(db.DateTime, nullable=False, index=True)
     location = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text, nullable=True)
     total_tickets = db.Column(db.Integer, nullable=False)
     available_tickets = db.Column(db.Integer, nullable=False)
+    # Vé đã soát rồi bị xóa: chỗ không được hoàn, vẫn tính là đã bán khi đếm lại số vé còn lại
+    retired_tickets = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     image_url = db.Column(db.String(200), nullable=True)
     tickets = db.relationship('Ticket', back_populates='event', lazy=True)
 
@@ -93,65 +275,563 @@ class Ticket(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     event_id = db.Column(db.Integer, db.ForeignKey('event.id'), nullable=False)
     ticket_code = db.Column(db.String(50), unique=True, nullable=False)
-    booking_date = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    booking_date = db.Column(db.DateTime, default=datetime.datetime.utcnow, index=True)
     is_approved = db.Column(db.Boolean, default=False)
     is_used = db.Column(db.Boolean, default=False)
     user_info_json = db.Column(db.String(1000), nullable=True)
     event_info_json = db.Column(db.String(1000), nullable=True)
+    render_status = db.Column(db.String(10), nullable=False, default='pending', server_default='pending')  # 'pending', 'ready', 'failed'
+    used_at = db.Column(db.DateTime, nullable=True)
+    checkin_gate = db.Column(db.String(50), nullable=True)
     user = db.relationship('User', back_populates='tickets', lazy=True)
     event = db.relationship('Event', back_populates='tickets', lazy=True)
 
+    __table_args__ = (
+        # Mỗi sinh viên chỉ được giữ một vé cho mỗi sự kiện; cũng là chỉ mục cho truy vấn theo user_id
+        db.UniqueConstraint('user_id', 'event_id', name='uq_ticket_user_event'),
+        db.Index('ix_ticket_event_user', 'event_id', 'user_id'),
+        db.Index('ix_ticket_event_used', 'event_id', 'is_used'),
+        db.Index('ix_ticket_event_booking', 'event_id', 'booking_date'),
+    )
+
+class DashboardCounter(db.Model):
+    # Bộ đếm cho trang thống kê: name là 'users', 'tickets', 'events', 'faculty_users',
+    # 'faculty_tickets' hoặc 'event_tickets'; key là tên khoa ('' với bộ đếm tổng hoặc khoa
+    # chưa khai báo), với 'event_tickets' là id sự kiện.
+    # Mỗi bộ đếm chia thành nhiều dòng (slot) để các lượt đặt vé đồng thời không cùng khóa
+    # một dòng; giá trị thật là tổng các slot
+    name = db.Column(db.String(20), primary_key=True)
+    key = db.Column(db.String(100), primary_key=True, default='')
+    slot = db.Column(db.Integer, primary_key=True, default=0)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+class LoginIdentifier(db.Model):
+    # Mỗi giá trị dùng để đăng nhập (tên đăng nhập, email, MSSV, CCCD) của một người dùng;
+    # đăng nhập chỉ cần tra một khóa chính thay vì OR trên bốn cột của bảng user
+    __tablename__ = 'login_identifier'
+    identifier = db.Column(db.String(100), primary_key=True)
+    kind = db.Column(db.String(20), primary_key=True)  # 'username', 'email', 'student_id', 'cccd'
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+
+class SchemaVersion(db.Model):
+    __tablename__ = 'schema_version'
+    version = db.Column(db.Integer, primary_key=True)
+    description = db.Column(db.String(200), nullable=False)
+    applied_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+
 @login_manager.user_loader
 def load_user(user_id):
     return User.query.get(int(user_id))
 
+# Migration lược đồ: mỗi bước có số phiên bản tăng dần, phiên bản đã áp dụng
+# được ghi vào bảng schema_version. CSDL tạo mới bằng create_all() đã có đủ
+# lược đồ nên chỉ được đánh dấu ở phiên bản mới nhất.
+MIGRATIONS = []
+
+def migration(version, description):
+    def register(upgrade):
+        MIGRATIONS.append((version, description, upgrade))
+        MIGRATIONS.sort(key=lambda item: item[0])
+        return upgrade
+    return register
+
+def _add_column(connection, model, column_name):
+    table = model.__table__
+    existing = {column['name'] for column in db.inspect(connection).get_columns(table.name)}
+    if column_name in existing:
+        return
+    column_ddl = CreateColumn(table.c[column_name]).compile(dialect=connection.dialect)
+    table_name = connection.dialect.identifier_preparer.format_table(table)
+    connection.execute(text(f'ALTER TABLE {table_name} ADD COLUMN {column_ddl}'))
+
+def _widen_column(connection, model, column_name):
+    # SQLite không giới hạn độ dài VARCHAR nên không cần (và không thể) ALTER COLUMN
+    if connection.dialect.name == 'sqlite':
+        return
+    table = model.__table__
+    preparer = connection.dialect.identifier_preparer
+    table_name = preparer.format_table(table)
+    if connection.dialect.name in ('mysql', 'mariadb'):
+        column_ddl = CreateColumn(table.c[column_name]).compile(dialect=connection.dialect)
+        connection.execute(text(f'ALTER TABLE {table_name} MODIFY COLUMN {column_ddl}'))
+    else:
+        column_type = table.c[column_name].type.compile(dialect=connection.dialect)
+        connection.execute(text(f'ALTER TABLE {table_name} ALTER COLUMN '
+                                f'{preparer.format_column(table.c[column_name])} TYPE {column_type}'))
+
+def _create_indexes(connection, model):
+    for index in model.__table__.indexes:
+        index.create(connection, checkfirst=True)
+
+@migration(1, 'Vé: mỗi sinh viên một vé cho mỗi sự kiện')
+def _migrate_ticket_unique(connection):
+    inspector = db.inspect(connection)
+    names = {item['name'] for item in inspector.get_unique_constraints('ticket')}
+    names |= {item['name'] for item in inspector.get_indexes('ticket')}
+    if 'uq_ticket_user_event' not in names:
+        _remove_duplicate_tickets(connection)
+        connection.execute(text('CREATE UNIQUE INDEX uq_ticket_user_event ON ticket (user_id, event_id)'))
+
+def _remove_duplicate_tickets(connection):
+    # Kiểm tra "đã có vé chưa" cũ không chặn được hai lượt đặt song song: mỗi cặp
+    # (user_id, event_id) bị trùng giữ vé đã soát hoặc vé đặt sớm nhất, các vé còn lại
+    # bị xóa (ghi log) và chỗ của chúng được hoàn cho sự kiện
+    tickets, events = Ticket.__table__, Event.__table__
+    duplicated = connection.execute(
+        db.select(tickets.c.user_id, tickets.c.event_id)
+        .group_by(tickets.c.user_id, tickets.c.event_id)
+        .having(db.func.count() > 1)
+    ).all()
+    refunds = Counter()
+    for user_id, event_id in duplicated:
+        rows = connection.execute(
+            db.select(tickets.c.id, tickets.c.ticket_code, tickets.c.is_used)
+            .where(tickets.c.user_id == user_id, tickets.c.event_id == event_id)
+        ).all()
+        keep = min(rows, key=lambda row: (not row.is_used, row.id))
+        removed = [row for row in rows if row.id != keep.id]
+        connection.execute(tickets.delete().where(tickets.c.id.in_([row.id for row in removed])))
+        refunds[event_id] += len(removed)
+        app.logger.warning('Sinh viên %s có %d vé cho sự kiện %s: giữ vé %s, xóa vé %s',
+                           user_id, len(rows), event_id, keep.ticket_code,
+                           ', '.join(row.ticket_code for row in removed))
+    for event_id, count in refunds.items():
+        connection.execute(events.update().where(events.c.id == event_id)
+                           .values(available_tickets=events.c.available_tickets + count))
+
+@migration(2, 'Vé: trạng thái tạo ảnh vé')
+def _migrate_ticket_render_status(connection):
+    _add_column(connection, Ticket, 'render_status')
+
+@migration(3, 'Vé: thời điểm và cổng soát vé')
+def _migrate_ticket_checkin(connection):
+    _add_column(connection, Ticket, 'used_at')
+    _add_column(connection, Ticket, 'checkin_gate')
+
+@migration(4, 'Chỉ mục cho các cột lọc/sắp xếp thường dùng')
+def _migrate_hot_indexes(connection):
+    for model in (User, Event, Ticket):
+        _create_indexes(connection, model)
+
+@migration(5, 'Chỉ mục phân trang vé theo sự kiện')
+def _migrate_ticket_paging_index(connection):
+    _create_indexes(connection, Ticket)
+
+@migration(6, 'Bộ đếm cho trang thống kê')
+def _migrate_dashboard_counters(connection):
+    dashboard_stats.reconcile(connection)
+
+@migration(7, 'Chỉ mục tìm kiếm toàn văn cho sự kiện')
+def _migrate_event_search(connection):
+    if event_search.create(connection):
+        event_search.rebuild(connection)
+
+@migration(8, 'Tìm kiếm người dùng: chỉ mục lớp và chỉ mục toàn văn họ tên')
+def _migrate_user_search(connection):
+    _create_indexes(connection, User)
+    if user_search.create(connection):
+        user_search.rebuild(connection)
+
+@migration(9, 'Bảng định danh đăng nhập')
+def _migrate_login_identifiers(connection):
+    LoginIdentifier.__table__.create(connection, checkfirst=True)
+    login_identifiers.rebuild(connection)
+
+@migration(10, 'Sự kiện: số vé đã soát bị xóa, đối soát số vé còn lại')
+def _migrate_seat_inventory(connection):
+    _add_column(connection, Event, 'retired_tickets')
+    # Phần chênh giữa số vé đã bán theo available_tickets và số vé thực có là các vé
+    # đã bị xóa mà không được hoàn chỗ
+    events = Event.__table__
+    sold = (db.select(db.func.count()).select_from(Ticket.__table__)
+            .where(Ticket.__table__.c.event_id == events.c.id).scalar_subquery())
+    retired = events.c.total_tickets - events.c.available_tickets - sold
+    connection.execute(events.update().values(retired_tickets=case((retired > 0, retired), else_=0)))
+
+@migration(11, 'Bộ đếm thống kê chia slot')
+def _migrate_dashboard_counter_slots(connection):
+    # Bộ đếm chỉ là dữ liệu suy ra: tạo lại bảng với khóa chính mới rồi đếm lại
+    DashboardCounter.__table__.drop(connection, checkfirst=True)
+    DashboardCounter.__table__.create(connection)
+    dashboard_stats.reconcile(connection)
+
+@migration(12, 'Người dùng: cột băm mật khẩu đủ dài cho scrypt')
+def _migrate_hash_columns(connection):
+    # Chuỗi băm scrypt của werkzeug dài khoảng 162 ký tự, vượt VARCHAR(128) cũ
+    _widen_column(connection, User, 'password_hash')
+    _widen_column(connection, User, 'security_answer_hash')
+
+@migration(13, 'Bộ đếm vé theo sự kiện')
+def _migrate_event_ticket_counters(connection):
+    dashboard_stats.reconcile(connection)
+
+def upgrade_database():
+    """Đưa CSDL lên phiên bản lược đồ mới nhất; trả về các migration đã chạy."""
+    db.session.close()
+    tables = set(db.inspect(db.engine).get_table_names())
+    head = MIGRATIONS[-1][0]
+    if 'schema_version' not in tables and Ticket.__tablename__ not in tables:
+        db.create_all()
+        db.session.add(SchemaVersion(version=head, description='Tạo mới lược đồ'))
+        db.session.commit()
+        return []
+
+    # Tạo các bảng còn thiếu (kể cả schema_version); create_all không sửa bảng đã có
+    db.create_all()
+    current = db.session.query(db.func.max(SchemaVersion.version)).scalar() or 0
+    db.session.close()
+
+    applied = []
+    for version, description, upgrade in MIGRATIONS:
+        if version <= current:
+            continue
+        with db.engine.begin() as connection:
+            upgrade(connection)
+            connection.execute(insert(SchemaVersion.__table__).values(
+                version=version, description=description, applied_at=datetime.datetime.utcnow()))
+        applied.append((version, description))
+    return applied
+
+# Đếm câu lệnh SQL theo luồng: dùng trong kiểm thử/benchmark để giữ số truy vấn
+# của mỗi route cố định (không phát sinh N+1 khi danh sách dài ra).
+_query_counters = threading.local()
+
+@sqla_event.listens_for(Engine, 'before_cursor_execute')
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    for counter in getattr(_query_counters, 'active', ()):
+        counter.statements.append(statement)
+
+class QueryCounter:
+    """Ghi lại các câu lệnh SQL chạy trong luồng hiện tại bên trong khối with.
+
+    Với budget, khối with báo AssertionError nếu số câu lệnh vượt quá ngân sách:
+
+        with QueryCounter(budget=3):
+            client.get('/admin/manage-tickets')
+    """
+    def __init__(self, budget=None):
+        self.budget = budget
+        self.statements = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def __enter__(self):
+        if not hasattr(_query_counters, 'active'):
+            _query_counters.active = []
+        _query_counters.active.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _query_counters.active.remove(self)
+        if exc_type is None and self.budget is not None and self.count > self.budget:
+            raise AssertionError(f'{self.count} câu lệnh SQL, vượt ngân sách {self.budget}:\n'
+                                 + '\n'.join(self.statements))
+        return False
+
+# Đo hiệu năng theo request: mỗi request giữ số câu SQL, tổng thời gian CSDL và render
+# template trong biến theo luồng; khi kết thúc được cộng vào histogram của endpoint.
+PROFILE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+PROFILE_METRICS = ('duration', 'db', 'template')
+
+class RequestProfiler:
+    def __init__(self, buckets=PROFILE_BUCKETS):
+        self.buckets = buckets
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.endpoints = {}
+            self.slowest = []  # heap nhỏ nhất ở đầu: (thời gian, câu lệnh, endpoint)
+
+    @property
+    def current(self):
+        return getattr(self._local, 'profile', None)
+
+    def start(self):
+        self._local.profile = {"started": time.perf_counter(), "queries": 0, "db": 0.0,
+                               "template": 0.0, "template_started": None, "statements": []}
+
+    def record_statement(self, statement, elapsed):
+        profile = self.current
+        if profile is None:
+            return
+        profile["queries"] += 1
+        profile["db"] += elapsed
+        # Chỉ giữ vài câu chậm nhất của request để không tốn bộ nhớ khi request chạy nhiều câu
+        entry = (elapsed, statement)
+        if len(profile["statements"]) < 5:
+            heapq.heappush(profile["statements"], entry)
+        elif entry > profile["statements"][0]:
+            heapq.heapreplace(profile["statements"], entry)
+
+    def template_started(self):
+        profile = self.current
+        if profile is not None and profile["template_started"] is None:
+            profile["template_started"] = time.perf_counter()
+
+    def template_finished(self):
+        profile = self.current
+        if profile is not None and profile["template_started"] is not None:
+            profile["template"] += time.perf_counter() - profile["template_started"]
+            profile["template_started"] = None
+
+    def _new_histogram(self):
+        return {"buckets": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0, "max": 0.0}
+
+    def _observe(self, histogram, value):
+        histogram["buckets"][bisect.bisect_left(self.buckets, value)] += 1
+        histogram["sum"] += value
+        histogram["count"] += 1
+        histogram["max"] = max(histogram["max"], value)
+
+    def finish(self, endpoint):
+        profile = self.current
+        self._local.profile = None
+        if profile is None:
+            return
+        profile["duration"] = time.perf_counter() - profile["started"]
+        limit = app.config['PROFILING_SLOW_STATEMENTS']
+        with self._lock:
+            stats = self.endpoints.get(endpoint)
+            if stats is None:
+                stats = self.endpoints[endpoint] = {name: self._new_histogram() for name in PROFILE_METRICS}
+                stats["queries"] = 0
+            for name in PROFILE_METRICS:
+                self._observe(stats[name], profile[name])
+            stats["queries"] += profile["queries"]
+            for elapsed, statement in profile["statements"]:
+                entry = (elapsed, statement, endpoint)
+                if len(self.slowest) < limit:
+                    heapq.heappush(self.slowest, entry)
+                elif entry > self.slowest[0]:
+                    heapq.heapreplace(self.slowest, entry)
+
+    def quantile(self, histogram, q):
+        """Ước lượng phân vị từ histogram: cận trên của bucket chứa phân vị q."""
+        if not histogram["count"]:
+            return 0.0
+        rank = q * histogram["count"]
+        seen = 0
+        for bound, count in zip(self.buckets, histogram["buckets"]):
+            seen += count
+            if seen >= rank:
+                return bound
+        return histogram["max"]
+
+    def snapshot(self):
+        with self._lock:
+            endpoints = {name: {key: (dict(value, buckets=list(value["buckets"])) if isinstance(value, dict) else value)
+                                for key, value in stats.items()}
+                         for name, stats in self.endpoints.items()}
+            slowest = sorted(self.slowest, reverse=True)
+        return endpoints, slowest
+
+    def prometheus(self):
+        """Xuất số liệu theo định dạng text của Prometheus."""
+        endpoints, _ = self.snapshot()
+        lines = []
+        descriptions = {
+            'duration': 'Thời gian xử lý request',
+            'db': 'Tổng thời gian chạy câu SQL trong request',
+            'template': 'Thời gian render template trong request',
+        }
+        for name in PROFILE_METRICS:
+            metric = f'ticketbox_request_{name}_seconds'
+            lines.append(f'# HELP {metric} {descriptions[name]}')
+            lines.append(f'# TYPE {metric} histogram')
+            for endpoint, stats in sorted(endpoints.items()):
+                histogram = stats[name]
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), histogram["buckets"]):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'{metric}_bucket{{endpoint="{endpoint}",le="{le}"}} {cumulative}')
+                lines.append(f'{metric}_sum{{endpoint="{endpoint}"}} {histogram["sum"]:.6f}')
+                lines.append(f'{metric}_count{{endpoint="{endpoint}"}} {histogram["count"]}')
+        lines.append('# HELP ticketbox_request_queries_total Số câu SQL đã chạy')
+        lines.append('# TYPE ticketbox_request_queries_total counter')
+        for endpoint, stats in sorted(endpoints.items()):
+            lines.append(f'ticketbox_request_queries_total{{endpoint="{endpoint}"}} {stats["queries"]}')
+        return '\n'.join(lines) + '\n'
+
+request_profiler = RequestProfiler()
+
+@sqla_event.listens_for(Engine, 'before_cursor_execute')
+def _profile_statement_start(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and request_profiler.current is not None:
+        context._profile_started = time.perf_counter()
+
+@sqla_event.listens_for(Engine, 'after_cursor_execute')
+def _profile_statement_end(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_profile_started', None)
+    if started is not None:
+        request_profiler.record_statement(statement, time.perf_counter() - started)
+
+@before_render_template.connect_via(app)
+def _profile_template_start(sender, template, context, **extra):
+    request_profiler.template_started()
+
+@template_rendered.connect_via(app)
+def _profile_template_end(sender, template, context, **extra):
+    request_profiler.template_finished()
+
+@app.before_request
+def _start_request_profile():
+    if app.config['PROFILING_ENABLED']:
+        request_profiler.start()
+
+@app.teardown_request
+def _finish_request_profile(exc):
+    if request_profiler.current is not None:
+        request_profiler.finish(request.endpoint or 'not_found')
+
 # 3. Logic duyệt và tạo vé điện tử
+# Thông tin đọc được từ mã QR: token mới có ticket_id, mã JSON cũ có ticket_code và user_id
+QrClaim = namedtuple('QrClaim', ['ticket_code', 'ticket_id', 'user_id', 'event_id'])
+
 class TicketController:
     @staticmethod
     def process_booking(user_id, event_id):
-        event = Event.query.get(event_id)
-        user = User.query.get(user_id)
-        if not event or event.available_tickets <= 0 or not user:
+        # Kho vé trong bộ nhớ đã biết hết vé (kể cả các chỗ đang được giữ) thì từ chối ngay
+        if seat_inventory.available(event_id, 1) <= 0:
             return None
+        db.session.rollback()
 
-        event.available_tickets -= 1
-        db.session.commit()
-
-        ticket_code = str(uuid.uuid4())
-        user_info_json = json.dumps({
-            "fullname": user.fullname,
-            "student_id": user.student_id,
-            "student_class": user.student_class,
-            "faculty": user.faculty,
-            "email": user.email,
-        })
-        event_info_json = json.dumps({
-            "name": event.name,
-            "date": event.date.strftime('%d/%m/%Y'),
-            "location": event.location,
-        })
+        remaining = None
+        try:
+            user = db.session.get(User, user_id)
+            event = db.session.get(Event, event_id)
+            if not user or not event:
+                db.session.rollback()
+                return None
+            # Gửi trùng: không giữ chỗ cho lượt chắc chắn vi phạm ràng buộc (user_id, event_id),
+            # chỗ giữ tạm đó làm người khác thấy hết vé
+            if db.session.query(Ticket.id).filter_by(user_id=user_id, event_id=event_id).first():
+                db.session.rollback()
+                return None
+
+            ticket_code = str(uuid.uuid4())
+            user_info_json = json.dumps({
+                "fullname": user.fullname,
+                "student_id": user.student_id,
+                "student_class": user.student_class,
+                "faculty": user.faculty,
+                "email": user.email,
+            })
+            event_info_json = json.dumps({
+                "name": event.name,
+                "date": event.date.strftime('%d/%m/%Y'),
+                "location": event.location,
+            })
+            # Kết thúc transaction đọc để phần ghi bên dưới mở transaction ghi ngay từ
+            # đầu (tránh nâng cấp khóa đọc -> ghi trên SQLite) và giữ khóa ghi ngắn nhất
+            db.session.rollback()
 
-        new_ticket = Ticket(
-            user_id=user_id,
-            event_id=event_id,
-            ticket_code=ticket_code,
-            is_approved=True,
-            is_used=False,
-            user_info_json=user_info_json,
-            event_info_json=event_info_json
-        )
-        db.session.add(new_ticket)
-        db.session.commit()
+            # Giữ chỗ trong kho vé: chỉ trừ khi còn vé
+            remaining = seat_inventory.take(event_id)
+            if remaining is None:
+                db.session.rollback()
+                return None
 
-        qr_data = {
-            "ticket_code": ticket_code,
-            "user_id": user_id,
-            "event_id": event_id
-        }
-        
-        TicketController.generate_e_ticket(json.dumps(qr_data), new_ticket)
+            new_ticket = Ticket(
+                user_id=user_id,
+                event_id=event_id,
+                ticket_code=ticket_code,
+                is_approved=True,
+                is_used=False,
+                user_info_json=user_info_json,
+                event_info_json=event_info_json
+            )
+            db.session.add(new_ticket)
+            # Nếu vi phạm ràng buộc (user_id, event_id) thì rollback và trả lại chỗ đã giữ
+            db.session.commit()
+        except (IntegrityError, OperationalError):
+            db.session.rollback()
+            if remaining is not None:
+                seat_inventory.release(event_id)
+            return None
+        except Exception:
+            db.session.rollback()
+            if remaining is not None:
+                seat_inventory.release(event_id)
+            raise
+
+        seat_inventory.confirm(event_id)
+        availability_feed.sold(event_id, seat_inventory.available(event_id, remaining))
+        catalog_cache.sold(event_id)
+        if app.config['TICKET_RENDER_MODE'] == 'inline':
+            TicketController.render_ticket(new_ticket)
+        else:
+            ticket_render_queue.submit(new_ticket.id)
         return ticket_code
 
+    QR_TOKEN_PREFIX = 'T1'
+    QR_MAC_BYTES = 10
+
+    @staticmethod
+    def _qr_mac(body):
+        key = app.config['QR_SIGNING_KEY'].encode('utf-8')
+        mac = hmac.new(key, TicketController.QR_TOKEN_PREFIX.encode('ascii') + body, hashlib.sha256)
+        return mac.digest()[:TicketController.QR_MAC_BYTES]
+
+    @staticmethod
+    def qr_payload(ticket):
+        # Token "T1" + base32(event_id, ticket_id, HMAC rút gọn): chỉ gồm chữ hoa và
+        # số nên mã QR dùng chế độ alphanumeric, nhỏ hơn hẳn chuỗi JSON trước đây
+        body = struct.pack('>II', ticket.event_id, ticket.id)
+        token = base64.b32encode(body + TicketController._qr_mac(body)).decode('ascii').rstrip('=')
+        return TicketController.QR_TOKEN_PREFIX + token
+
+    @staticmethod
+    def parse_qr(qr_data_string):
+        """Giải mã nội dung QR thành QrClaim, hoặc None nếu không hợp lệ.
+
+        Token giả mạo bị loại chỉ bằng kiểm tra HMAC, chưa cần truy vấn CSDL.
+        """
+        qr_data_string = (qr_data_string or '').strip()
+        if qr_data_string.upper().startswith(TicketController.QR_TOKEN_PREFIX):
+            token = qr_data_string[len(TicketController.QR_TOKEN_PREFIX):].upper()
+            try:
+                raw = base64.b32decode(token + '=' * (-len(token) % 8))
+            except (ValueError, TypeError):
+                return None
+            body, mac = raw[:8], raw[8:]
+            if len(body) != 8 or not hmac.compare_digest(mac, TicketController._qr_mac(body)):
+                return None
+            event_id, ticket_id = struct.unpack('>II', body)
+            return QrClaim(ticket_code=None, ticket_id=ticket_id, user_id=None, event_id=event_id)
+
+        if not app.config['QR_ACCEPT_LEGACY_JSON']:
+            return None
+        try:
+            data = json.loads(qr_data_string)
+            ticket_code = data.get('ticket_code')
+            user_id = int(data.get('user_id'))
+            event_id = int(data.get('event_id'))
+        except (ValueError, TypeError, AttributeError):
+            return None
+        if not ticket_code or not isinstance(ticket_code, str):
+            return None
+        return QrClaim(ticket_code=ticket_code, ticket_id=None, user_id=user_id, event_id=event_id)
+
+    @staticmethod
+    def render_ticket(ticket):
+        # Tạo sẵn ảnh vào cache để lần tải xuống đầu tiên không phải chờ
+        try:
+            ticket_images.get_or_render(ticket)
+            status = 'ready'
+        except Exception:
+            app.logger.exception('Không tạo được ảnh vé %s', ticket.ticket_code)
+            status = 'failed'
+
+        db.session.execute(update(Ticket).where(Ticket.id == ticket.id).values(render_status=status))
+        db.session.commit()
+        return status == 'ready'
+
     @staticmethod
     def generate_e_ticket(qr_data_json, ticket):
         qr = qrcode.QRCode(
@@ -167,18 +847,8 @@ class TicketController:
         qr_size = 200
         qr_img = qr_img.resize((qr_size, qr_size))
 
-        template_path = os.path.join(app.root_path, 'static', 'ticket_template.png')
-        try:
-            template = Image.open(template_path).resize((800, 400))
-        except FileNotFoundError:
-            template = Image.new('RGB', (800, 400), color='white')
-
+        template, font = ticket_art.get()
         draw = ImageDraw.Draw(template)
-        font_path = "arial.ttf"
-        try:
-            font = ImageFont.truetype(font_path, 20)
-        except IOError:
-            font = ImageFont.load_default()
 
         user_info = json.loads(ticket.user_info_json)
         event_info = json.loads(ticket.event_info_json)
@@ -194,13 +864,1662 @@ class TicketController:
         bottom = top + qr_size
 
         template.paste(qr_img, (left, top, right, bottom))
-        
-        tickets_dir = os.path.join(app.root_path, 'static', 'images', 'tickets')
-        os.makedirs(tickets_dir, exist_ok=True)
-        ticket_path = os.path.join(tickets_dir, f"{ticket.ticket_code}.png")
-        template.save(ticket_path)
+
+        output = io.BytesIO()
+        template.save(output, format='PNG')
+        return output.getvalue()
+
+class TicketArtCache:
+    """Ảnh nền vé (đã giải mã và resize) và font dùng chung trong tiến trình.
+
+    Mỗi vé nhận một bản sao của ảnh nền; cache được nạp lại khi file
+    ticket_template.png thay đổi (so sánh mtime).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._template = None
+        self._template_mtime = None
+        self._font = None
+
+    @staticmethod
+    def template_path():
+        return os.path.join(app.root_path, 'static', 'ticket_template.png')
+
+    @staticmethod
+    def template_mtime():
+        try:
+            return os.stat(TicketArtCache.template_path()).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def get(self):
+        template_path = self.template_path()
+        mtime = self.template_mtime()
+
+        with self._lock:
+            if self._template is None or mtime != self._template_mtime:
+                if mtime is None:
+                    template = Image.new('RGB', (800, 400), color='white')
+                else:
+                    template = Image.open(template_path).resize((800, 400))
+                self._template = template
+                self._template_mtime = mtime
+
+            if self._font is None:
+                try:
+                    self._font = ImageFont.truetype("arial.ttf", 20)
+                except IOError:
+                    self._font = ImageFont.load_default()
+
+            return self._template.copy(), self._font
+
+    def invalidate(self):
+        with self._lock:
+            self._template = None
+            self._template_mtime = None
+            self._font = None
+
+ticket_art = TicketArtCache()
+
+class TicketImageCache:
+    """Cache LRU ảnh vé, đánh khóa theo nội dung vé.
+
+    Khóa là mã băm của mọi dữ liệu in trên vé (kể cả mtime ảnh nền), nên
+    sửa vé hay đổi ảnh nền sẽ tự sinh khóa mới; ảnh cũ chỉ việc bị đẩy ra
+    khỏi cache. Khóa cũng được dùng làm ETag khi tải vé.
+    """
+
+    PRUNE_EVERY = 256
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._disk_writes = 0
+
+    @staticmethod
+    def key(ticket):
+        digest = hashlib.sha256()
+        for part in (TicketController.qr_payload(ticket), ticket.user_info_json or '',
+                     ticket.event_info_json or '', str(TicketArtCache.template_mtime())):
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()[:32]
+
+    def get_or_render(self, ticket):
+        key = self.key(ticket)
+        with self._lock:
+            png = self._memory.get(key)
+            if png is not None:
+                self._memory.move_to_end(key)
+                return key, png
+
+        png = self._read_disk(key)
+        if png is None:
+            png = TicketController.generate_e_ticket(TicketController.qr_payload(ticket), ticket)
+            self._write_disk(key, png)
+
+        with self._lock:
+            self._memory[key] = png
+            self._memory.move_to_end(key)
+            while len(self._memory) > app.config['TICKET_IMAGE_CACHE_ENTRIES']:
+                self._memory.popitem(last=False)
+        return key, png
+
+    def keep_on_disk(self, key):
+        """True nếu ảnh đã có trên đĩa; cập nhật mtime để ảnh không bị dọn trước ảnh mới tạo."""
+        path = self._disk_path(key)
+        if not path:
+            return False
+        try:
+            os.utime(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def render_to_disk(self, ticket):
+        # Dùng cho tạo ảnh hàng loạt: chỉ ghi ra đĩa, không giữ trong bộ nhớ
+        key = self.key(ticket)
+        self._write_disk(key, TicketController.generate_e_ticket(TicketController.qr_payload(ticket), ticket))
+        return key
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+
+    def _disk_path(self, key):
+        disk_dir = app.config['TICKET_IMAGE_DISK_CACHE_DIR']
+        return os.path.join(disk_dir, f"{key}.png") if disk_dir else None
+
+    def _read_disk(self, key):
+        path = self._disk_path(key)
+        if not path:
+            return None
+        try:
+            with open(path, 'rb') as f:
+                png = f.read()
+            os.utime(path)  # cập nhật mtime để dọn theo thứ tự LRU
+            return png
+        except FileNotFoundError:
+            return None
+
+    def _write_disk(self, key, png):
+        path = self._disk_path(key)
+        if not path:
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(png)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._disk_writes += 1
+            prune = self._disk_writes % self.PRUNE_EVERY == 0
+        if prune:
+            self._prune_disk(os.path.dirname(path))
+
+    def _prune_disk(self, disk_dir):
+        limit = app.config['TICKET_IMAGE_DISK_CACHE_FILES']
+        # Mỗi tiến trình/luồng tự dọn theo bộ đếm riêng: file có thể bị nơi khác xóa giữa
+        # lúc liệt kê và lúc đọc mtime hay xóa, khi đó chỉ việc bỏ qua
+        entries = []
+        for entry in os.scandir(disk_dir):
+            if not entry.name.endswith('.png'):
+                continue
+            try:
+                entries.append((entry.stat().st_mtime, entry.path))
+            except FileNotFoundError:
+                continue
+        if len(entries) <= limit:
+            return
+        entries.sort()
+        for _, path in entries[:len(entries) - limit]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+ticket_images = TicketImageCache()
+
+class TicketRenderQueue:
+    """Hàng đợi có giới hạn và các luồng nền tạo ảnh vé sau khi đặt vé."""
+
+    def __init__(self):
+        self.jobs = None
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            self.jobs = queue.Queue(maxsize=app.config['TICKET_RENDER_QUEUE_SIZE'])
+            for _ in range(app.config['TICKET_RENDER_WORKERS']):
+                thread = threading.Thread(target=self._work, name='ticket-render', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, ticket_id):
+        self.start()
+        try:
+            self.jobs.put_nowait(ticket_id)
+            return True
+        except queue.Full:
+            # Vé vẫn ở trạng thái 'pending' và sẽ được tạo khi tải xuống
+            return False
+
+    def join(self):
+        if self.jobs is not None:
+            self.jobs.join()
+
+    def _work(self):
+        while True:
+            ticket_id = self.jobs.get()
+            try:
+                with app.app_context():
+                    ticket = db.session.get(Ticket, ticket_id)
+                    if ticket and ticket.render_status != 'ready':
+                        TicketController.render_ticket(ticket)
+            except Exception:
+                app.logger.exception('Lỗi luồng tạo ảnh vé (ticket_id=%s)', ticket_id)
+            finally:
+                self.jobs.task_done()
+
+ticket_render_queue = TicketRenderQueue()
+
+class PasswordHasherBusy(Exception):
+    """Hàng đợi băm mật khẩu đã đầy; request nên được từ chối để thử lại sau."""
+
+class PasswordHasher:
+    """Nhóm luồng có giới hạn để băm và kiểm tra mật khẩu.
+
+    scrypt/PBKDF2 nhả GIL nhưng chiếm trọn một lõi CPU; giới hạn số luồng băm giữ cho
+    một đợt đăng nhập dồn dập không làm chậm việc đặt vé. Request chờ kết quả của mình;
+    khi đã có quá nhiều lượt chờ thì bị từ chối ngay bằng PasswordHasherBusy.
+    """
+
+    def __init__(self):
+        self.jobs = None
+        self._threads = []
+        self._lock = threading.Lock()
+        self._prefixes = {}
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            self.jobs = queue.Queue(maxsize=app.config['PASSWORD_HASH_QUEUE_SIZE'])
+            for _ in range(app.config['PASSWORD_HASH_WORKERS']):
+                thread = threading.Thread(target=self._work, name='password-hash', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _run(self, func, *args):
+        self.start()
+        future = Future()
+        try:
+            self.jobs.put_nowait((future, func, args))
+        except queue.Full:
+            raise PasswordHasherBusy()
+        return future.result()
+
+    def _work(self):
+        while True:
+            future, func, args = self.jobs.get()
+            try:
+                future.set_result(func(*args))
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                self.jobs.task_done()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, app.config['PASSWORD_HASH_METHOD'])
+
+    def verify(self, pwhash, password):
+        # Băm không hợp lệ (tài khoản chưa đặt mật khẩu, '!') thì không cần tốn một lượt băm
+        if not pwhash or pwhash.count('$') < 2 or password is None:
+            return False
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """Băm được tạo với thuật toán/tham số khác cấu hình hiện tại."""
+        method = app.config['PASSWORD_HASH_METHOD']
+        if method not in self._prefixes:
+            # werkzeug điền tham số mặc định ('scrypt' -> 'scrypt:32768:8:1'): băm thử một lần để biết
+            self._prefixes[method] = self.hash('').split('$', 1)[0]
+        return pwhash.split('$', 1)[0] != self._prefixes[method]
+
+password_hasher = PasswordHasher()
+
+class CheckinIndex:
+    """Chỉ mục vé theo sự kiện trong bộ nhớ cho cổng soát vé.
+
+    Nạp một lần cho mỗi sự kiện: ticket_code -> thông tin người giữ vé và
+    cờ đã sử dụng (kèm bảng ticket_id -> ticket_code cho token QR). Vé đặt
+    sau khi nạp được tra riêng rồi thêm vào chỉ mục; các thao tác sửa/xóa
+    vé gọi invalidate() để nạp lại.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._events = {}
+
+    @staticmethod
+    def _query(event_id):
+        return db.session.query(
+            Ticket.id, Ticket.ticket_code, Ticket.user_id, Ticket.is_used,
+            User.fullname, User.student_id, User.cccd, User.student_class, User.faculty, User.email
+        ).join(User, Ticket.user_id == User.id).filter(Ticket.event_id == event_id)
+
+    @staticmethod
+    def _entry(row):
+        return {
+            "user_id": row.user_id,
+            "used": bool(row.is_used),
+            "fullname": row.fullname,
+            "student_id": row.student_id or row.cccd,
+            "student_class": row.student_class,
+            "faculty": row.faculty,
+            "email": row.email,
+        }
+
+    def _tickets(self, event_id):
+        with self._lock:
+            tickets = self._events.get(event_id)
+        if tickets is not None:
+            return tickets
+
+        event = db.session.get(Event, event_id)
+        if not event:
+            return None
+        tickets = {
+            "info": {"event_name": event.name, "event_date": event.date.strftime('%d/%m/%Y')},
+            "codes": {},
+            "ids": {},
+        }
+        for row in self._query(event_id):
+            tickets["codes"][row.ticket_code] = self._entry(row)
+            tickets["ids"][row.id] = row.ticket_code
+        with self._lock:
+            return self._events.setdefault(event_id, tickets)
+
+    def lookup(self, event_id, ticket_code=None, ticket_id=None):
+        """Trả về (thông tin sự kiện, ticket_code, thông tin vé); vé không tồn tại
+        thì thông tin vé là None."""
+        tickets = self._tickets(event_id)
+        if tickets is None:
+            return None, None, None
+        if ticket_code is None:
+            ticket_code = tickets["ids"].get(ticket_id)
+        entry = tickets["codes"].get(ticket_code) if ticket_code else None
+        if entry is None:
+            # Vé đặt sau lần nạp chỉ mục
+            query = self._query(event_id)
+            if ticket_code:
+                query = query.filter(Ticket.ticket_code == ticket_code)
+            else:
+                query = query.filter(Ticket.id == ticket_id)
+            row = query.first()
+            if row:
+                with self._lock:
+                    entry = tickets["codes"].setdefault(row.ticket_code, self._entry(row))
+                    tickets["ids"][row.id] = row.ticket_code
+                ticket_code = row.ticket_code
+        return tickets["info"], ticket_code, entry
+
+    def invalidate(self, event_id=None):
+        with self._lock:
+            if event_id is None:
+                self._events.clear()
+            else:
+                self._events.pop(event_id, None)
+
+checkin_index = CheckinIndex()
+
+def check_in_ticket(claim, gate=None):
+    """Soát một vé từ QrClaim; trả về (kết quả, thông tin hiển thị) với kết quả là
+    'accepted', 'already_used' hoặc 'invalid'."""
+    event_id = claim.event_id
+    event_info, ticket_code, entry = checkin_index.lookup(event_id, claim.ticket_code, claim.ticket_id)
+    if entry is None or (claim.user_id is not None and entry['user_id'] != claim.user_id):
+        return 'invalid', None
+
+    info = dict(entry, ticket_code=ticket_code, **event_info)
+    del info['used']
+    if entry['used']:
+        return 'already_used', info
+
+    # UPDATE có điều kiện: hai cổng quét cùng lúc thì chỉ một cổng được chấp nhận
+    accepted = db.session.execute(
+        update(Ticket)
+        .where(Ticket.ticket_code == ticket_code, Ticket.event_id == event_id, Ticket.is_used.is_(False))
+        .values(is_used=True, used_at=datetime.datetime.utcnow(), checkin_gate=gate)
+    ).rowcount == 1
+    db.session.commit()
+
+    if not accepted and not db.session.query(Ticket.id).filter_by(ticket_code=ticket_code).first():
+        # Vé đã bị xóa ở tiến trình khác sau khi chỉ mục được nạp
+        checkin_index.invalidate(event_id)
+        return 'invalid', None
+    entry['used'] = True
+    return ('accepted' if accepted else 'already_used'), info
+
+def offline_ticket_key(text):
+    # Manifest chỉ chứa mã băm rút gọn, không lộ mã vé thật cho máy quét
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+
+def build_checkin_manifest(event):
+    """Danh sách vé hợp lệ của một sự kiện cho chế độ soát vé offline."""
+    valid = []
+    used = []
+    legacy = app.config['QR_ACCEPT_LEGACY_JSON']
+    for ticket in db.session.query(
+            Ticket.id, Ticket.ticket_code, Ticket.user_id, Ticket.event_id, Ticket.is_used
+    ).filter(Ticket.event_id == event.id):
+        keys = (used if ticket.is_used else valid)
+        keys.append(offline_ticket_key(TicketController.qr_payload(ticket)))
+        if legacy:
+            keys.append(offline_ticket_key(f"{ticket.ticket_code}:{ticket.user_id}"))
+    valid.sort()
+    used.sort()
+
+    digest = hashlib.sha256()
+    for key in valid:
+        digest.update(key.encode('ascii'))
+    digest.update(b'|')
+    for key in used:
+        digest.update(key.encode('ascii'))
+    version = digest.hexdigest()[:16]
+
+    manifest = {
+        "format": 1,
+        "event_id": event.id,
+        "event_name": event.name,
+        "event_date": event.date.strftime('%d/%m/%Y'),
+        "version": version,
+        "generated_at": datetime.datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+        "key": "sha256(token QR hoặc ticket_code:user_id với mã QR JSON cũ)[:16]",
+        "valid": valid,
+        "used": used,
+    }
+    # Chữ ký để máy chủ nhận lại đúng manifest mình đã phát khi cổng đồng bộ
+    manifest["signature"] = manifest_signature(event.id, version)
+    return manifest
+
+def manifest_signature(event_id, version):
+    return hmac.new(app.config['SECRET_KEY'].encode('utf-8'),
+                    f"{event_id}:{version}".encode('utf-8'), hashlib.sha256).hexdigest()
+
+def _scan_time(value):
+    """Thời điểm quét ISO 8601 -> datetime UTC không kèm múi giờ (như used_at), None nếu sai.
+
+    Giờ có múi giờ (Z, +07:00) được đổi sang UTC; giờ không có múi giờ được coi là UTC."""
+    if not value:
+        return datetime.datetime.utcnow()
+    try:
+        scanned_at = datetime.datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if scanned_at.tzinfo is not None:
+        scanned_at = scanned_at.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return scanned_at
+
+def _parse_scan(scan, default_gate):
+    # Một lượt quét: {qr_data hoặc ticket_code (+ user_id tùy chọn), scanned_at (ISO 8601), gate_id}.
+    # scanned_at là None nếu thời điểm quét không hợp lệ
+    if not isinstance(scan, dict):
+        return None
+    try:
+        if scan.get('qr_data'):
+            claim = TicketController.parse_qr(str(scan['qr_data']))
+        elif isinstance(scan.get('ticket_code'), str):
+            user_id = int(scan['user_id']) if scan.get('user_id') is not None else None
+            claim = QrClaim(ticket_code=scan['ticket_code'], ticket_id=None, user_id=user_id, event_id=None)
+        else:
+            claim = None
+    except (TypeError, ValueError):
+        return None
+    if not claim:
+        return None
+    gate = str(scan.get('gate_id') or default_gate or '')[:50] or None
+    return claim, _scan_time(scan.get('scanned_at')), gate
+
+def _chunks(items, size=500):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def check_in_batch(scans, event_id=None, default_gate=None):
+    """Soát nhiều vé trong một transaction.
+
+    Trả về kết quả theo đúng thứ tự đầu vào: 'accepted', 'already_used' hoặc
+    'invalid'. Vé bị quét nhiều lần (trong lô hoặc ở cổng khác) giữ lại lượt
+    quét sớm nhất làm lượt hợp lệ.
+    """
+    results = [None] * len(scans)
+    attempts = []
+    for index, scan in enumerate(scans):
+        parsed = _parse_scan(scan, default_gate)
+        if not parsed:
+            results[index] = {"ticket_code": scan.get('ticket_code') if isinstance(scan, dict) else None,
+                              "status": "invalid"}
+            continue
+        claim, scanned_at, gate = parsed
+        if scanned_at is None:
+            results[index] = {"ticket_code": claim.ticket_code, "status": "invalid",
+                              "message": "Thời điểm quét không hợp lệ."}
+            continue
+        attempts.append((scanned_at, index, claim, gate))
+
+    columns = (Ticket.id, Ticket.ticket_code, Ticket.user_id, Ticket.event_id,
+               Ticket.is_used, Ticket.used_at, Ticket.checkin_gate)
+    by_code = {}
+    by_id = {}
+    codes = list({claim.ticket_code for _, _, claim, _ in attempts if claim.ticket_code})
+    ids = list({claim.ticket_id for _, _, claim, _ in attempts if claim.ticket_code is None})
+    for chunk in _chunks(codes):
+        for row in db.session.query(*columns).filter(Ticket.ticket_code.in_(chunk)):
+            by_code[row.ticket_code] = row
+    for chunk in _chunks(ids):
+        for row in db.session.query(*columns).filter(Ticket.id.in_(chunk)):
+            by_id[row.id] = row
+
+    # Lượt quét sớm nhất hợp lệ của mỗi vé là ứng viên để đánh dấu đã dùng
+    first_scans = {}
+    for scanned_at, index, claim, gate in sorted(attempts, key=lambda attempt: (attempt[0], attempt[1])):
+        ticket = by_code.get(claim.ticket_code) if claim.ticket_code else by_id.get(claim.ticket_id)
+        if (not ticket or (event_id is not None and ticket.event_id != event_id)
+                or (claim.event_id is not None and ticket.event_id != claim.event_id)
+                or (claim.user_id is not None and claim.user_id != ticket.user_id)):
+            results[index] = {"ticket_code": claim.ticket_code, "status": "invalid"}
+            continue
+        first_scans.setdefault(ticket.id, (ticket, []))[1].append((scanned_at, index, gate))
+
+    accepted_ids = set()
+    candidates = [ticket.id for ticket, _ in first_scans.values() if not ticket.is_used]
+    for ids in _chunks(candidates):
+        used_at = case({tid: first_scans[tid][1][0][0] for tid in ids}, value=Ticket.id)
+        gates = case({tid: first_scans[tid][1][0][2] for tid in ids}, value=Ticket.id)
+        # Một câu UPDATE cho cả lô; điều kiện is_used = 0 loại các vé vừa được cổng khác soát
+        statement = (
+            update(Ticket)
+            .where(Ticket.id.in_(ids), Ticket.is_used.is_(False))
+            .values(is_used=True, used_at=used_at, checkin_gate=gates)
+            .execution_options(synchronize_session=False)
+        )
+        if db.engine.dialect.update_returning:
+            accepted_ids.update(db.session.execute(statement.returning(Ticket.id)).scalars())
+        else:
+            for tid in ids:
+                if db.session.execute(statement.where(Ticket.id == tid)).rowcount == 1:
+                    accepted_ids.add(tid)
+
+    earlier = []
+    touched_events = set()
+    for ticket_id, (ticket, valid) in first_scans.items():
+        touched_events.add(ticket.event_id)
+        first_at, first_index, first_gate = valid[0]
+        if ticket_id in accepted_ids:
+            results[first_index] = {"ticket_code": ticket.ticket_code, "status": "accepted"}
+            duplicates = valid[1:]
+        else:
+            duplicates = valid
+            if ticket.used_at is None or first_at < ticket.used_at:
+                # Cổng này quét trước nhưng đồng bộ sau: giữ lượt quét sớm nhất
+                earlier.append({"tid": ticket_id, "at": first_at, "gate": first_gate})
+            else:
+                first_at, first_gate = ticket.used_at, ticket.checkin_gate
+        for scanned_at, index, gate in duplicates:
+            if (scanned_at, gate) != (first_at, first_gate):
+                app.logger.warning('Vé %s bị dùng nhiều lần (cổng %s lúc %s, cổng %s lúc %s)',
+                                   ticket.ticket_code, first_gate, first_at, gate, scanned_at)
+            results[index] = {
+                "ticket_code": ticket.ticket_code,
+                "status": "already_used",
+                "first_used_at": first_at.isoformat() if first_at else None,
+                "first_gate": first_gate,
+            }
+
+    if earlier:
+        db.session.execute(
+            update(Ticket.__table__)
+            .where(Ticket.__table__.c.id == bindparam('tid'),
+                   or_(Ticket.__table__.c.used_at.is_(None), Ticket.__table__.c.used_at > bindparam('at')))
+            .values(used_at=bindparam('at'), checkin_gate=bindparam('gate')),
+            earlier
+        )
+    db.session.commit()
+
+    for touched in touched_events:
+        checkin_index.invalidate(touched)
+    return results
+
+# Thống kê cho trang admin: các bộ đếm trong bảng dashboard_counter được cập nhật trong
+# cùng transaction với thay đổi của User/Ticket/Event (qua sự kiện flush của session),
+# nên trang thống kê chỉ đọc một bảng nhỏ thay vì COUNT/GROUP BY trên toàn bộ dữ liệu.
+# Thao tác ghi hàng loạt bỏ qua ORM phải tự gọi apply() hoặc chạy reconcile().
+# Mỗi luồng cộng vào một trong DASHBOARD_COUNTER_SLOTS slot của bộ đếm, nên các lượt đặt vé
+# đồng thời không tranh nhau dòng ('tickets', '') hay dòng của cùng một khoa.
+class DashboardStats:
+    def _ticket_faculty(self, session, ticket, deleted_users):
+        # Ưu tiên người giữ vé đã có trong session (kể cả đang bị xóa cùng lần flush)
+        owner = ticket.__dict__.get('user') or deleted_users.get(ticket.user_id)
+        if owner is None:
+            with session.no_autoflush:
+                owner = session.get(User, ticket.user_id)
+        return owner.faculty if owner else None
+
+    def collect(self, session):
+        """Tính thay đổi bộ đếm từ các đối tượng sắp được flush."""
+        deltas = Counter()
+        deleted_users = {user.id: user for user in session.deleted if isinstance(user, User)}
+        for obj in session.new:
+            if isinstance(obj, User):
+                deltas[('users', '')] += 1
+                deltas[('faculty_users', obj.faculty or '')] += 1
+            elif isinstance(obj, Ticket):
+                deltas[('tickets', '')] += 1
+                deltas[('faculty_tickets', self._ticket_faculty(session, obj, deleted_users) or '')] += 1
+                deltas[('event_tickets', str(obj.event_id))] += 1
+            elif isinstance(obj, Event):
+                deltas[('events', '')] += 1
+        for obj in session.deleted:
+            if isinstance(obj, User):
+                deltas[('users', '')] -= 1
+                deltas[('faculty_users', obj.faculty or '')] -= 1
+            elif isinstance(obj, Ticket):
+                deltas[('tickets', '')] -= 1
+                deltas[('faculty_tickets', self._ticket_faculty(session, obj, deleted_users) or '')] -= 1
+                deltas[('event_tickets', str(obj.event_id))] -= 1
+            elif isinstance(obj, Event):
+                deltas[('events', '')] -= 1
+        for obj in session.dirty:
+            if not isinstance(obj, User):
+                continue
+            history = db.inspect(obj).attrs.faculty.history
+            if not history.has_changes():
+                continue
+            old = (history.deleted[0] if history.deleted else None) or ''
+            new = (history.added[0] if history.added else None) or ''
+            if old == new:
+                continue
+            # Vé được thống kê theo khoa hiện tại của người giữ vé
+            with session.no_autoflush:
+                held = session.query(db.func.count(Ticket.id)).filter(Ticket.user_id == obj.id).scalar()
+            deltas[('faculty_users', old)] -= 1
+            deltas[('faculty_users', new)] += 1
+            deltas[('faculty_tickets', old)] -= held
+            deltas[('faculty_tickets', new)] += held
+        return deltas
+
+    def _slot(self):
+        # Cố định theo luồng: các lần flush trong một transaction khóa cùng các dòng
+        return hash((os.getpid(), threading.get_ident())) % app.config['DASHBOARD_COUNTER_SLOTS']
+
+    def apply(self, connection, deltas):
+        table = DashboardCounter.__table__
+        slot = self._slot()
+        # Thứ tự cố định để hai transaction không khóa chéo nhau
+        for (name, key), delta in sorted(deltas.items()):
+            if not delta:
+                continue
+            updated = connection.execute(
+                update(table).where(table.c.name == name, table.c.key == key, table.c.slot == slot)
+                .values(value=table.c.value + delta)
+            ).rowcount
+            if not updated:
+                connection.execute(insert(table).values(name=name, key=key, slot=slot, value=delta))
+
+    def ticket_deltas(self, connection, *criteria):
+        """Thay đổi bộ đếm khi xóa hàng loạt các vé thỏa điều kiện (gọi trước câu DELETE)."""
+        rows = connection.execute(
+            db.select(User.faculty, Ticket.event_id, db.func.count(Ticket.id))
+            .select_from(Ticket).join(User, Ticket.user_id == User.id)
+            .where(*criteria).group_by(User.faculty, Ticket.event_id)
+        ).all()
+        deltas = Counter()
+        for faculty, event_id, count in rows:
+            deltas[('tickets', '')] -= count
+            deltas[('faculty_tickets', faculty or '')] -= count
+            deltas[('event_tickets', str(event_id))] -= count
+        return deltas
+
+    def snapshot(self):
+        """Đọc toàn bộ bộ đếm: {name: {key: value}}."""
+        counters = {}
+        rows = (db.session.query(DashboardCounter.name, DashboardCounter.key, db.func.sum(DashboardCounter.value))
+                .group_by(DashboardCounter.name, DashboardCounter.key))
+        for name, key, value in rows:
+            counters.setdefault(name, {})[key] = value
+        return counters
+
+    def recount(self, connection):
+        counts = Counter()
+        counts[('users', '')] = connection.execute(db.select(db.func.count(User.id))).scalar()
+        counts[('tickets', '')] = connection.execute(db.select(db.func.count(Ticket.id))).scalar()
+        counts[('events', '')] = connection.execute(db.select(db.func.count(Event.id))).scalar()
+        for faculty, count in connection.execute(
+                db.select(User.faculty, db.func.count(User.id)).group_by(User.faculty)):
+            counts[('faculty_users', faculty or '')] += count
+        for faculty, count in connection.execute(
+                db.select(User.faculty, db.func.count(Ticket.id))
+                .select_from(Ticket).join(User, Ticket.user_id == User.id).group_by(User.faculty)):
+            counts[('faculty_tickets', faculty or '')] += count
+        for event_id, count in connection.execute(
+                db.select(Ticket.event_id, db.func.count(Ticket.id)).group_by(Ticket.event_id)):
+            counts[('event_tickets', str(event_id))] += count
+        return counts
+
+    def reconcile(self, connection):
+        """Đếm lại từ dữ liệu gốc và ghi đè bộ đếm; trả về các bộ đếm bị lệch (name, key, cũ, đúng)."""
+        table = DashboardCounter.__table__
+        expected = self.recount(connection)
+        stored = Counter()
+        for row in connection.execute(db.select(table)):
+            stored[(row.name, row.key)] += row.value
+        drift = [(name, key, stored.get((name, key), 0), expected.get((name, key), 0))
+                 for name, key in sorted(set(stored) | set(expected))
+                 if stored.get((name, key), 0) != expected.get((name, key), 0)]
+        connection.execute(table.delete())
+        rows = [{"name": name, "key": key, "value": value} for (name, key), value in expected.items() if value]
+        if rows:
+            connection.execute(insert(table), rows)
+        return drift
+
+dashboard_stats = DashboardStats()
+
+@sqla_event.listens_for(db.session, 'before_flush')
+def _collect_dashboard_deltas(session, flush_context, instances):
+    deltas = dashboard_stats.collect(session)
+    if deltas:
+        session.info.setdefault('dashboard_deltas', Counter()).update(deltas)
+
+@sqla_event.listens_for(db.session, 'after_flush')
+def _apply_dashboard_deltas(session, flush_context):
+    deltas = session.info.pop('dashboard_deltas', None)
+    if deltas:
+        dashboard_stats.apply(session.connection(), deltas)
+
+@sqla_event.listens_for(db.session, 'after_soft_rollback')
+def _discard_dashboard_deltas(session, previous_transaction):
+    session.info.pop('dashboard_deltas', None)
+
+# Kho vé: với INVENTORY_MODE='memory', số vé còn lại của mỗi sự kiện nằm trong bộ nhớ và
+# đặt vé chỉ trừ bộ đếm (không ghi dòng event); luồng nền ghi các bộ đếm đã đổi xuống
+# event.available_tickets. Nguồn đúng là các dòng vé: khi nạp một sự kiện, số vé còn lại
+# được đếm lại bằng total_tickets - retired_tickets - số vé, nên lần ghi bị mất khi tiến
+# trình chết đột ngột được sửa ở lần nạp sau. Hoàn vé/đổi tổng số vé của admin ghi thẳng
+# vào CSDL trong transaction của admin và cộng vào bộ đếm sau khi commit.
+class SeatInventory:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)  # báo khi chỗ đang giữ được trả lại/xác nhận
+        self._remaining = {}  # event_id -> số vé còn lại
+        self._holds = Counter()  # event_id -> số chỗ đã giữ nhưng lượt đặt vé chưa commit
+        self._dirty = set()
+        self._flush_lock = threading.Lock()  # các lần ghi không chen nhau, giá trị mới luôn ghi sau
+        self._flusher = None
+        self.flushes = 0
+
+    @property
+    def in_memory(self):
+        return app.config['INVENTORY_MODE'] == 'memory'
+
+    @staticmethod
+    def count_remaining(connection, event_id=None):
+        """Số vé còn lại đếm từ dữ liệu gốc: {event_id: total - retired - số vé}."""
+        events = Event.__table__
+        sold = (db.select(Ticket.__table__.c.event_id, db.func.count().label('sold'))
+                .group_by(Ticket.__table__.c.event_id))
+        if event_id is not None:
+            sold = sold.where(Ticket.__table__.c.event_id == event_id)
+        sold = sold.subquery()
+        query = (db.select(events.c.id, events.c.total_tickets - events.c.retired_tickets - db.func.coalesce(sold.c.sold, 0))
+                 .outerjoin(sold, sold.c.event_id == events.c.id))
+        if event_id is not None:
+            query = query.where(events.c.id == event_id)
+        return dict(connection.execute(query).all())
+
+    def take(self, event_id):
+        """Giữ một chỗ cho lượt đặt vé; trả về số vé còn lại sau khi giữ, None nếu hết vé.
+
+        Chế độ 'database' chạy câu UPDATE trong transaction hiện tại của session. Chế độ
+        'memory': lượt đặt vé phải gọi confirm() sau khi commit hoặc release() khi thất bại;
+        nếu hết chỗ nhưng còn chỗ đang giữ thì chờ xem chỗ đó có được trả lại không."""
+        if not self.in_memory:
+            statement = (
+                update(Event)
+                .where(Event.id == event_id, Event.available_tickets > 0)
+                .values(available_tickets=Event.available_tickets - 1)
+            )
+            if db.engine.dialect.update_returning:
+                return db.session.execute(statement.returning(Event.available_tickets)).scalar()
+            if db.session.execute(statement).rowcount != 1:
+                return None
+            # Dòng sự kiện đang bị khóa bởi câu UPDATE trên nên đọc lại vẫn đúng
+            return db.session.execute(
+                db.select(Event.available_tickets).where(Event.id == event_id)
+            ).scalar()
+        with self._lock:
+            remaining = self._remaining.get(event_id)
+            if remaining is None:
+                # Nạp lần đầu (giữ khóa để không lượt đặt vé nào chen vào giữa lúc đếm)
+                remaining = self.count_remaining(db.session.connection(), event_id).get(event_id)
+                if remaining is None:
+                    return None
+                self._remaining[event_id] = remaining
+                self._dirty.add(event_id)
+            deadline = time.monotonic() + app.config['INVENTORY_RESERVATION_WAIT']
+            while remaining is not None and remaining <= 0:
+                left = deadline - time.monotonic()
+                if not self._holds[event_id] or left <= 0:
+                    return None
+                self._changed.wait(left)
+                remaining = self._remaining.get(event_id)
+            if remaining is None:
+                return None
+            self._remaining[event_id] = remaining - 1
+            self._holds[event_id] += 1
+            self._dirty.add(event_id)
+        self._start()
+        return remaining - 1
+
+    def confirm(self, event_id):
+        """Lượt đặt vé đã commit: chỗ đã giữ thành vé đã bán."""
+        if self.in_memory:
+            with self._lock:
+                self._drop_hold(event_id)
+
+    def release(self, event_id):
+        """Trả lại chỗ đã giữ khi lượt đặt vé thất bại (chế độ 'database' đã rollback)."""
+        if not self.in_memory:
+            return
+        with self._lock:
+            self._drop_hold(event_id)
+            if event_id in self._remaining:
+                self._remaining[event_id] += 1
+                self._dirty.add(event_id)
+            available = self.available(event_id, None)
+        # Phát lại số vé: nếu đã có ai thấy 0 trong lúc chỗ này đang giữ, hàng đợi được mở lại
+        if available is not None:
+            availability_feed.publish(event_id, available)
+
+    def _drop_hold(self, event_id):
+        # Gọi khi đang giữ self._lock
+        self._holds[event_id] -= 1
+        if self._holds[event_id] <= 0:
+            del self._holds[event_id]
+        self._changed.notify_all()
+
+    def refund(self, event, used):
+        """Vé bị xóa (gọi trong transaction của admin): vé chưa soát được hoàn chỗ."""
+        if used:
+            event.retired_tickets = (event.retired_tickets or 0) + 1
+        else:
+            event.available_tickets += 1
+            self._defer(event.id, 1)
+
+    def adjust_total(self, event, new_total):
+        """Đổi tổng số vé của sự kiện (gọi trong transaction của admin)."""
+        delta = new_total - event.total_tickets
+        event.total_tickets = new_total
+        event.available_tickets += delta
+        self._defer(event.id, delta)
+
+    def _defer(self, event_id, delta):
+        # Chỉ cộng vào bộ đếm khi transaction commit thành công
+        if self.in_memory and delta:
+            db.session.info.setdefault('inventory_deltas', Counter())[event_id] += delta
+
+    def _add(self, event_id, delta):
+        with self._lock:
+            if event_id in self._remaining:
+                self._remaining[event_id] += delta
+                self._dirty.add(event_id)
+        self._start()
+
+    def available(self, event_id, default):
+        """Số vé chưa bán mới nhất (gồm cả chỗ đang giữ cho lượt đặt vé chưa xong);
+        default (đọc từ CSDL) khi sự kiện chưa được nạp."""
+        remaining = self._remaining.get(event_id)
+        if remaining is None:
+            return default
+        return remaining + self._holds.get(event_id, 0)
+
+    def forget(self, event_id):
+        with self._lock:
+            self._remaining.pop(event_id, None)
+            self._dirty.discard(event_id)
+            self._changed.notify_all()
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._remaining)
+
+    def flush(self):
+        """Ghi các bộ đếm đã thay đổi xuống event.available_tickets (cần app context)."""
+        with self._flush_lock:
+            with self._lock:
+                rows = [{"event_id": event_id, "remaining": self._remaining[event_id]} for event_id in self._dirty]
+                self._dirty.clear()
+            if not rows:
+                return 0
+            try:
+                with db.engine.begin() as connection:
+                    self._write(connection, rows)
+            except Exception:
+                with self._lock:
+                    self._dirty.update(row["event_id"] for row in rows if row["event_id"] in self._remaining)
+                raise
+            self.flushes += 1
+            return len(rows)
+
+    @staticmethod
+    def _write(connection, rows):
+        events = Event.__table__
+        connection.execute(events.update().where(events.c.id == bindparam('event_id'))
+                           .values(available_tickets=bindparam('remaining')), rows)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(app.config['INVENTORY_FLUSH_SECONDS'])
+            try:
+                with app.app_context():
+                    self.flush()
+            except Exception:
+                app.logger.exception('Không ghi được số vé còn lại xuống CSDL')
+
+    def _start(self):
+        if self._flusher is None:
+            with self._lock:
+                if self._flusher is None:
+                    self._flusher = threading.Thread(target=self._flush_loop, name='inventory-flusher', daemon=True)
+                    self._flusher.start()
+
+    def reconcile(self, connection):
+        """Đếm lại số vé còn lại từ các dòng vé và sửa event.available_tickets (ví dụ sau khi
+        tiến trình chết trước lần ghi cuối); trả về các sự kiện bị lệch (event_id, cũ, đúng)."""
+        events = Event.__table__
+        expected = self.count_remaining(connection)
+        stored = dict(connection.execute(db.select(events.c.id, events.c.available_tickets)).all())
+        drift = [(event_id, stored[event_id], value) for event_id, value in sorted(expected.items())
+                 if stored[event_id] != value]
+        if drift:
+            self._write(connection, [{"event_id": event_id, "remaining": value} for event_id, _, value in drift])
+        return drift
+
+seat_inventory = SeatInventory()
+
+@atexit.register
+def _flush_inventory_on_exit():
+    if seat_inventory.snapshot():
+        with app.app_context():
+            seat_inventory.flush()
+
+@sqla_event.listens_for(db.session, 'after_commit')
+def _apply_inventory_deltas(session):
+    for event_id, delta in session.info.pop('inventory_deltas', {}).items():
+        seat_inventory._add(event_id, delta)
+
+@sqla_event.listens_for(db.session, 'after_soft_rollback')
+def _discard_inventory_deltas(session, previous_transaction):
+    session.info.pop('inventory_deltas', None)
+
+# Số vé còn lại của các sự kiện sắp diễn ra, phát cho trình duyệt qua SSE/long-poll.
+# Mỗi thay đổi tăng version; client gửi version đã thấy để chỉ nhận phần thay đổi.
+class AvailabilityFeed:
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._available = {}  # event_id -> số vé còn lại (None: sự kiện đã xóa/đã qua)
+        self._changed = {}    # event_id -> version của lần thay đổi gần nhất
+        self.version = 0
+        self.loaded = False
+        self.streams = 0
+        self._last_long_poll = 0.0
+        self._poller = None
+        self.listeners = []  # hàm (event_id, available) được gọi khi số vé thay đổi
+
+    def _set(self, event_id, available):
+        # Gọi khi đang giữ self._condition
+        if event_id in self._available and self._available[event_id] == available:
+            return False
+        self.version += 1
+        self._available[event_id] = available
+        self._changed[event_id] = self.version
+        for listener in self.listeners:
+            listener(event_id, available)
+        return True
+
+    def publish(self, event_id, available):
+        with self._condition:
+            if self._set(event_id, available):
+                self._condition.notify_all()
+
+    def sold(self, event_id, remaining):
+        """Từ luồng đặt vé: các lượt đặt song song có thể báo về lệch thứ tự, chỉ nhận giá trị nhỏ hơn."""
+        with self._condition:
+            current = self._available.get(event_id)
+            if current is None or remaining < current:
+                self._set(event_id, remaining)
+                self._condition.notify_all()
+
+    def refresh(self):
+        """Đọc lại số vé còn lại từ CSDL (cần app context)."""
+        today = datetime.datetime.combine(datetime.date.today(), datetime.time())
+        rows = db.session.query(Event.id, Event.available_tickets).filter(Event.date >= today).all()
+        db.session.rollback()
+        # Số trong kho vé mới hơn giá trị trong CSDL (được ghi xuống sau)
+        current = {event_id: seat_inventory.available(event_id, available) for event_id, available in rows}
+        with self._condition:
+            changed = False
+            for event_id, available in current.items():
+                changed |= self._set(event_id, available)
+            for event_id, available in list(self._available.items()):
+                if event_id not in current and available is not None:
+                    changed |= self._set(event_id, None)
+            self.loaded = True
+            if changed:
+                self._condition.notify_all()
+
+    def changes_since(self, since):
+        with self._condition:
+            if since <= 0 or since > self.version:
+                # Client mới hoặc version từ lần chạy trước của máy chủ: gửi toàn bộ
+                changes = {event_id: available for event_id, available in self._available.items()
+                           if available is not None}
+            else:
+                changes = {event_id: self._available[event_id]
+                           for event_id, version in self._changed.items() if version > since}
+            return changes, self.version
+
+    def wait(self, since, timeout):
+        with self._condition:
+            return self._condition.wait_for(lambda: self.version != since, timeout)
+
+    def _poll(self):
+        while True:
+            time.sleep(app.config['AVAILABILITY_POLL_SECONDS'])
+            if not self.streams and time.monotonic() - self._last_long_poll > 30:
+                continue
+            try:
+                with app.app_context():
+                    self.refresh()
+            except Exception:
+                app.logger.exception('Không đọc được số vé còn lại')
+
+    def _start(self):
+        # Gọi khi đang giữ self._condition
+        if self._poller is None:
+            self._poller = threading.Thread(target=self._poll, name='availability-poller', daemon=True)
+            self._poller.start()
+
+    def open_stream(self):
+        """Đăng ký một kết nối; False khi đã đủ số kết nối tối đa."""
+        with self._condition:
+            if self.streams >= app.config['AVAILABILITY_MAX_STREAMS']:
+                return False
+            self.streams += 1
+            self._start()
+        if not self.loaded:
+            self.refresh()
+        return True
+
+    def long_poll(self, since, wait):
+        """Chờ tối đa wait giây đến khi có thay đổi sau version since; trả về (changes, version, held).
+
+        Request chỉ được giữ lại chờ khi còn suất (dùng chung AVAILABILITY_MAX_STREAMS với SSE);
+        hết suất thì trả về ngay với held=False để trình duyệt tự hẹn lần hỏi sau."""
+        with self._condition:
+            self._last_long_poll = time.monotonic()
+            self._start()
+            held = bool(wait) and self.streams < app.config['AVAILABILITY_MAX_STREAMS']
+            if held:
+                self.streams += 1
+        try:
+            if not self.loaded:
+                self.refresh()
+            if held and 0 < since == self.version:
+                self.wait(since, wait)
+        finally:
+            if held:
+                self.close_stream()
+        changes, version = self.changes_since(since)
+        return changes, version, held
+
+    def close_stream(self):
+        with self._condition:
+            self.streams -= 1
+
+    def stream(self, since):
+        """Sinh các message SSE; phải gọi open_stream() trước."""
+        deadline = time.monotonic() + app.config['AVAILABILITY_STREAM_SECONDS']
+        try:
+            yield 'retry: 3000\n\n'
+            first = True
+            while True:
+                changes, version = self.changes_since(since)
+                if changes or first:
+                    payload = json.dumps({"version": version, "events": changes})
+                    yield f'id: {version}\nevent: availability\ndata: {payload}\n\n'
+                    first = False
+                since = version
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return
+                if not self.wait(since, min(left, app.config['AVAILABILITY_KEEPALIVE_SECONDS'])):
+                    yield ': ping\n\n'
+                    continue
+                # Gom các lượt đặt vé liên tiếp thành một message
+                time.sleep(app.config['AVAILABILITY_MIN_INTERVAL'])
+        finally:
+            self.close_stream()
+
+availability_feed = AvailabilityFeed()
+
+# Phòng chờ: sinh viên lấy số thứ tự khi bấm đặt vé, mỗi sự kiện cho vào theo token
+# bucket (WAITING_ROOM_ADMIT_RATE/giây, dồn tối đa WAITING_ROOM_BURST lượt). Khi còn
+# ít người thì được vào ngay; khi đông, trình duyệt hỏi vị trí qua API nhẹ (không
+# truy vấn CSDL) cho đến lượt. Hết vé thì hàng đợi đóng và mọi người nhận ngay kết quả.
+QueueStatus = namedtuple('QueueStatus', ['state', 'number', 'position', 'wait_seconds'])
+
+class EventQueue:
+    def __init__(self, now):
+        self.numbers = {}     # user_id -> số thứ tự
+        self.issued = 0       # số thứ tự lớn nhất đã phát
+        self.admitted = 0     # các số <= admitted đã được vào trang đặt vé
+        self.allowance = app.config['WAITING_ROOM_BURST']
+        self.updated = now
+        self.closed = False
+
+class WaitingRoom:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queues = {}  # event_id -> EventQueue
+        availability_feed.listeners.append(self.update)
+
+    def _advance(self, queue_, now):
+        rate = app.config['WAITING_ROOM_ADMIT_RATE']
+        queue_.allowance = min(app.config['WAITING_ROOM_BURST'], queue_.allowance + (now - queue_.updated) * rate)
+        queue_.updated = now
+        admit = min(int(queue_.allowance), queue_.issued - queue_.admitted)
+        queue_.admitted += admit
+        queue_.allowance -= admit
+
+    def _status(self, queue_, number):
+        # Gọi khi đang giữ self._lock
+        if queue_.closed:
+            return QueueStatus('sold_out', number, 0, 0)
+        self._advance(queue_, time.monotonic())
+        if number <= queue_.admitted:
+            return QueueStatus('admitted', number, 0, 0)
+        position = number - queue_.admitted
+        return QueueStatus('waiting', number, position, position / app.config['WAITING_ROOM_ADMIT_RATE'])
+
+    def join(self, event_id, user_id, available):
+        """Xếp hàng (hoặc lấy lại số cũ) cho sinh viên; available là số vé còn lại đọc từ CSDL."""
+        if not app.config['WAITING_ROOM_ENABLED']:
+            return QueueStatus('admitted', 0, 0, 0)
+        with self._lock:
+            queue_ = self._queues.get(event_id)
+            if queue_ is None:
+                queue_ = self._queues[event_id] = EventQueue(time.monotonic())
+            # Chỉ đóng theo số đọc từ CSDL; mở lại do update() khi admin thêm vé, tránh
+            # một lượt đọc cũ mở lại hàng đợi vừa đóng
+            if available is None or available <= 0:
+                queue_.closed = True
+            number = queue_.numbers.get(user_id)
+            if number is None and not queue_.closed:
+                queue_.issued += 1
+                number = queue_.numbers[user_id] = queue_.issued
+            return self._status(queue_, number or 0)
+
+    def status(self, event_id, user_id):
+        """Trạng thái hiện tại, hoặc None nếu sinh viên chưa xếp hàng cho sự kiện này."""
+        if not app.config['WAITING_ROOM_ENABLED']:
+            return QueueStatus('admitted', 0, 0, 0)
+        with self._lock:
+            queue_ = self._queues.get(event_id)
+            if queue_ is None:
+                return None
+            number = queue_.numbers.get(user_id)
+            if number is None:
+                return QueueStatus('sold_out', 0, 0, 0) if queue_.closed else None
+            return self._status(queue_, number)
+
+    def update(self, event_id, available):
+        """Số vé còn lại thay đổi: đóng hàng đợi khi hết vé, mở lại khi được thêm vé."""
+        with self._lock:
+            if available is None:
+                self._queues.pop(event_id, None)
+            elif event_id in self._queues:
+                self._queues[event_id].closed = available <= 0
+
+    def stats(self):
+        with self._lock:
+            return {event_id: {"issued": queue_.issued, "admitted": queue_.admitted, "closed": queue_.closed}
+                    for event_id, queue_ in self._queues.items()}
+
+waiting_room = WaitingRoom()
+
+# Cache dữ liệu sự kiện cho các trang danh sách/chi tiết. Dữ liệu được chụp thành
+# EventView (không gắn với session) nên dùng chung được giữa các request.
+# Thay đổi từ tiến trình khác chỉ được thấy sau CATALOG_CACHE_TTL giây.
+EventView = namedtuple('EventView', ['id', 'name', 'date', 'location', 'description',
+                                     'total_tickets', 'available_tickets', 'image_url'])
+EVENT_VIEW_COLUMNS = tuple(getattr(Event, name) for name in EventView._fields)
+CatalogEntry = namedtuple('CatalogEntry', ['data', 'version', 'created'])
+EventStat = namedtuple('EventStat', ['name', 'total_tickets', 'sold_tickets', 'available_tickets'])
+
+class CatalogCache:
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = 0
+        self._generation = 0
+        self._sold_at = {}  # event_id -> thời điểm có vé được đặt gần nhất
+        self._last_sold = 0.0
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def _fresh(self, entry, event_id, now):
+        if now - entry.created > app.config['CATALOG_CACHE_TTL']:
+            return False
+        sold = self._last_sold if event_id is None else self._sold_at.get(event_id, 0.0)
+        return entry.created >= sold or now - entry.created < app.config['CATALOG_COUNTS_MAX_AGE']
+
+    def get(self, key, loader, event_id=None):
+        """Lấy dữ liệu theo key, gọi loader() khi chưa có hoặc đã cũ; event_id=None nghĩa là
+        dữ liệu phụ thuộc mọi sự kiện (danh sách)."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._fresh(entry, event_id, now):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+            generation = self._generation
+
+        data = loader()
+        with self._lock:
+            self._version += 1
+            entry = CatalogEntry(data, self._version, now)
+            # Bị invalidate trong lúc đang đọc CSDL: trả dữ liệu nhưng không lưu
+            if generation == self._generation:
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                while len(self._entries) > app.config['CATALOG_CACHE_ENTRIES']:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return entry
+
+    def sold(self, event_id):
+        """Có vé được đặt/hoàn: số vé còn lại trong cache sẽ được đọc lại sau tối đa CATALOG_COUNTS_MAX_AGE."""
+        now = time.monotonic()
+        with self._lock:
+            self._sold_at[event_id] = now
+            self._last_sold = now
+
+    def invalidate(self):
+        """Sự kiện được thêm/sửa/xóa: bỏ toàn bộ cache."""
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions, "invalidations": self.invalidations,
+                    "hit_ratio": self.hits / lookups if lookups else 0.0}
+
+    def prometheus(self):
+        stats = self.stats()
+        lines = []
+        for name in ('hits', 'misses', 'evictions', 'invalidations'):
+            lines.append(f'# TYPE ticketbox_catalog_cache_{name}_total counter')
+            lines.append(f'ticketbox_catalog_cache_{name}_total {stats[name]}')
+        lines.append('# TYPE ticketbox_catalog_cache_entries gauge')
+        lines.append(f'ticketbox_catalog_cache_entries {stats["entries"]}')
+        return '\n'.join(lines) + '\n'
+
+catalog_cache = CatalogCache()
+
+def _event_view(row):
+    view = EventView(*row)
+    return view._replace(available_tickets=seat_inventory.available(view.id, view.available_tickets))
+
+def _load_event_list(*ordering):
+    return [_event_view(row) for row in db.session.query(*EVENT_VIEW_COLUMNS).order_by(*ordering).all()]
+
+def _load_event(event_id):
+    row = db.session.query(*EVENT_VIEW_COLUMNS).filter(Event.id == event_id).first()
+    return _event_view(row) if row else None
+
+def catalog_page(template, name, entry, **context):
+    """Render trang từ dữ liệu cache kèm ETag; trả 304 nếu trình duyệt đã có bản này."""
+    etag = hashlib.sha256(f'{request.endpoint}:{entry.version}:{current_user.get_id()}'.encode()).hexdigest()[:32]
+    # Trang còn thông báo flash chưa hiển thị thì luôn render lại
+    if '_flashes' not in session and request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = make_response(render_template(template, **{name: entry.data}, **context))
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+# Tìm kiếm toàn văn: các cột văn bản được bỏ dấu ('Đêm nhạc' -> 'dem nhac') rồi đưa vào
+# bảng FTS5 riêng (rowid = id của dòng gốc). Bảng được cập nhật trong cùng transaction
+# khi dòng gốc được thêm/sửa/xóa qua ORM. CSDL không có FTS5 dùng LIKE thay thế.
+def fold_text(value):
+    """Bỏ dấu tiếng Việt và viết thường."""
+    if not value:
+        return ''
+    value = unicodedata.normalize('NFD', value.replace('đ', 'd').replace('Đ', 'D'))
+    return ''.join(ch for ch in value if not unicodedata.combining(ch)).lower()
+
+class SearchIndex:
+    def __init__(self, table, model, fields, weights):
+        self.table = table
+        self.model = model
+        self.fields = fields
+        self.weights = weights  # trọng số bm25 theo từng cột
+        self.fts = db.table(table, db.column('rowid'))
+        self._supported = {}
+        self._insert = text(f'INSERT INTO {table} (rowid, {", ".join(fields)}) '
+                            f'VALUES (:rowid, {", ".join(":" + field for field in fields)})')
+        sqla_event.listen(model, 'after_insert', self._after_insert)
+        sqla_event.listen(model, 'after_update', self._after_update)
+        sqla_event.listen(model, 'after_delete', self._after_delete)
+
+    def supported(self, connection):
+        url = str(connection.engine.url)
+        if url not in self._supported:
+            options = set()
+            if connection.dialect.name == 'sqlite':
+                options = {row[0] for row in connection.exec_driver_sql('PRAGMA compile_options')}
+            self._supported[url] = 'ENABLE_FTS5' in options
+        return self._supported[url]
+
+    def create(self, connection):
+        """Tạo bảng FTS5 nếu CSDL hỗ trợ và chưa có; trả về False nếu không hỗ trợ."""
+        if not self.supported(connection):
+            return False
+        # Chỉ mục tiền tố 2-3 ký tự để tìm theo từ đang gõ dở
+        connection.exec_driver_sql(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} USING fts5({', '.join(self.fields)}, "
+            "tokenize='unicode61', prefix='2 3')")
+        return True
+
+    def _row(self, row_id, *values):
+        row = {field: fold_text(value) for field, value in zip(self.fields, values)}
+        row["rowid"] = row_id
+        return row
+
+    def index(self, connection, obj):
+        if not self.supported(connection):
+            return
+        self.remove(connection, obj.id)
+        connection.execute(self._insert, self._row(obj.id, *(getattr(obj, field) for field in self.fields)))
+
+    def remove(self, connection, row_id):
+        if self.supported(connection):
+            connection.execute(text(f'DELETE FROM {self.table} WHERE rowid = :rowid'), {"rowid": row_id})
+
+    def rebuild(self, connection, batch=5000):
+        """Dựng lại chỉ mục từ bảng gốc (sau khi nhập dữ liệu hàng loạt bỏ qua ORM)."""
+        connection.execute(text(f'DELETE FROM {self.table}'))
+        columns = [self.model.id] + [getattr(self.model, field) for field in self.fields]
+        rows = connection.execute(db.select(*columns))
+        while True:
+            chunk = rows.fetchmany(batch)
+            if not chunk:
+                break
+            connection.execute(self._insert, [self._row(*row) for row in chunk])
+
+    def _after_insert(self, mapper, connection, target):
+        self.index(connection, target)
+
+    def _after_update(self, mapper, connection, target):
+        state = db.inspect(target)
+        if any(state.attrs[field].history.has_changes() for field in self.fields):
+            self.index(connection, target)
+
+    def _after_delete(self, mapper, connection, target):
+        self.remove(connection, target.id)
+
+    def filter(self, query, text_query):
+        """Lọc query của model theo text_query, sắp xếp theo độ liên quan.
+
+        Mỗi từ khớp theo tiền tố ("nha" tìm được "nhạc") và đều phải có mặt. Trả về None
+        nếu CSDL không hỗ trợ FTS5 để nơi gọi tự dùng cách tìm khác."""
+        if not self.supported(db.session.connection()):
+            return None
+        tokens = re.findall(r'\w+', fold_text(text_query))
+        match = ' '.join(f'"{token}"*' for token in tokens)
+        weights = ', '.join(str(weight) for weight in self.weights)
+        return (query.join(self.fts, self.fts.c.rowid == self.model.id)
+                .filter(text(f'{self.table} MATCH :match').bindparams(match=match))
+                .order_by(text(f'bm25({self.table}, {weights})')))
+
+event_search = SearchIndex('event_search', Event, ('name', 'location', 'description'), (10.0, 4.0, 1.0))
+
+user_search = SearchIndex('user_search', User, ('fullname', 'username', 'email'), (10.0, 3.0, 2.0))
+SEARCH_INDEXES = (event_search, user_search)
+
+# Hook của model ghi vào các bảng FTS5 ở mọi lần thêm/sửa, nên db.create_all() (CSDL mới,
+# kiểm thử, script) tạo luôn các bảng này; upgrade_database() dựng lại nội dung bằng migration
+@sqla_event.listens_for(db.metadata, 'after_create')
+def _create_search_indexes(metadata, connection, **kw):
+    for index in SEARCH_INDEXES:
+        index.create(connection)
+
+@sqla_event.listens_for(db.metadata, 'after_drop')
+def _drop_search_indexes(metadata, connection, **kw):
+    for index in SEARCH_INDEXES:
+        if index.supported(connection):
+            connection.exec_driver_sql(f'DROP TABLE IF EXISTS {index.table}')
+
+def find_events(query, page=1, per_page=24):
+    """Tìm sự kiện theo độ liên quan; trả về (danh sách Event, còn trang sau hay không)."""
+    offset = (page - 1) * per_page
+    if not re.search(r'\w', query):
+        events = Event.query.order_by(Event.date.asc()).offset(offset).limit(per_page + 1).all()
+        return events[:per_page], len(events) > per_page
+    ranked = event_search.filter(Event.query, query)
+    if ranked is None:
+        return find_events_like(query, page, per_page)
+    events = ranked.offset(offset).limit(per_page + 1).all()
+    return events[:per_page], len(events) > per_page
+
+def find_events_like(query, page=1, per_page=24):
+    """Cách tìm cũ bằng ILIKE trên tên sự kiện (quét toàn bảng, phân biệt dấu)."""
+    events = (Event.query.filter(Event.name.ilike(f'%{query}%'))
+              .offset((page - 1) * per_page).limit(per_page + 1).all())
+    return events[:per_page], len(events) > per_page
+
+def _prefix(column, value):
+    # So sánh khoảng thay cho LIKE 'abc%' để dùng được chỉ mục unique của cột
+    return and_(column >= value, column < value + '\U0010ffff')
+
+def find_users(query, text_query, page=1, per_page=20):
+    """Tìm người dùng trong query đã lọc sẵn; trả về (danh sách User, còn trang sau hay không).
+
+    Chuỗi một từ có chữ số được coi là tiền tố mã sinh viên/CCCD/tên đăng nhập, còn lại
+    tìm toàn văn họ tên/tên đăng nhập/email không phân biệt dấu và chữ hoa/thường."""
+    text_query = text_query.strip()
+    offset = (page - 1) * per_page
+    if re.fullmatch(r'[\w-]*\d[\w-]*', text_query):
+        # Mỗi cột đi theo chỉ mục riêng của nó rồi gộp lại, tránh sắp xếp cả tập kết quả
+        found = OrderedDict()
+        prefixes = {text_query, text_query.upper()}
+        for column in (User.student_id, User.cccd, User.username):
+            matches = (query.filter(or_(*[_prefix(column, prefix) for prefix in prefixes]))
+                       .order_by(column).limit(offset + per_page + 1))
+            for user in matches:
+                found.setdefault(user.id, user)
+        users = list(found.values())[offset:offset + per_page + 1]
+        return users[:per_page], len(users) > per_page
+    elif re.search(r'\w', text_query):
+        ranked = user_search.filter(query, text_query)
+        if ranked is None:
+            pattern = f'%{text_query}%'
+            ranked = query.filter(or_(User.fullname.ilike(pattern), User.username.ilike(pattern),
+                                      User.email.ilike(pattern))).order_by(User.id)
+        query = ranked
+    else:
+        query = query.order_by(User.id)
+    users = query.offset(offset).limit(per_page + 1).all()
+    return users[:per_page], len(users) > per_page
+
+# Định danh đăng nhập: bảng login_identifier được cập nhật trong cùng transaction khi
+# người dùng được thêm/sửa/xóa qua ORM (đăng ký, thêm/sửa người dùng, hồ sơ cá nhân).
+class LoginIdentifiers:
+    kinds = ('username', 'email', 'student_id', 'cccd')  # thứ tự ưu tiên khi trùng giá trị
+
+    def __init__(self):
+        self.table = LoginIdentifier.__table__
+        sqla_event.listen(User, 'after_insert', self._after_insert)
+        sqla_event.listen(User, 'after_update', self._after_update)
+        sqla_event.listen(User, 'before_delete', self._before_delete)
+
+    def _rows(self, user_id, *values):
+        rows = []
+        for kind, value in zip(self.kinds, values):
+            # Bỏ qua giá trị rỗng: form lưu '' cho CCCD/email không nhập
+            if value:
+                rows.append({'identifier': value, 'kind': kind, 'user_id': user_id})
+        return rows
+
+    def index(self, connection, user):
+        self.remove(connection, user.id)
+        rows = self._rows(user.id, *(getattr(user, kind) for kind in self.kinds))
+        if rows:
+            connection.execute(insert(self.table), rows)
+
+    def remove(self, connection, user_id):
+        connection.execute(self.table.delete().where(self.table.c.user_id == user_id))
+
+    def rebuild(self, connection, batch=5000):
+        """Dựng lại bảng từ bảng user (sau khi nhập dữ liệu hàng loạt bỏ qua ORM)."""
+        connection.execute(self.table.delete())
+        columns = [User.id] + [getattr(User, kind) for kind in self.kinds]
+        rows = connection.execute(db.select(*columns))
+        while True:
+            chunk = rows.fetchmany(batch)
+            if not chunk:
+                break
+            connection.execute(insert(self.table), [row for user in chunk for row in self._rows(*user)])
+
+    def _after_insert(self, mapper, connection, target):
+        self.index(connection, target)
+
+    def _after_update(self, mapper, connection, target):
+        state = db.inspect(target)
+        if any(state.attrs[kind].history.has_changes() for kind in self.kinds):
+            self.index(connection, target)
+
+    def _before_delete(self, mapper, connection, target):
+        self.remove(connection, target.id)
+
+    def find_user(self, value, kinds=None):
+        """Tìm người dùng theo một định danh bằng một truy vấn qua khóa chính."""
+        kinds = kinds or self.kinds
+        if not value:
+            return None
+        # Lọc loại định danh sau khi đọc để chỉ dò một khoảng của khóa chính theo identifier
+        rows = (db.session.query(LoginIdentifier.kind, User)
+                .join(User, User.id == LoginIdentifier.user_id)
+                .filter(LoginIdentifier.identifier == value)
+                .all())
+        rows = [row for row in rows if row.kind in kinds]
+        if not rows:
+            return None
+        return min(rows, key=lambda row: kinds.index(row.kind)).User
+
+login_identifiers = LoginIdentifiers()
+
+# Phân trang keyset: con trỏ là giá trị (cột sắp xếp, id) của dòng cuối trang trước,
+# nên mỗi trang chỉ đọc per_page dòng qua chỉ mục, không phụ thuộc vào độ sâu trang.
+KeysetPage = namedtuple('KeysetPage', ['items', 'next_cursor', 'per_page'])
+
+def _encode_cursor(values):
+    values = [value.isoformat() if isinstance(value, datetime.datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+def _decode_cursor(cursor, columns):
+    # Con trỏ đến từ query string nên mỗi giá trị phải đúng kiểu Python của cột (int cho id,
+    # str cho username, chuỗi ISO cho ngày giờ); sai bất kỳ chỗ nào thì coi như trang đầu
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(columns):
+            return None
+        decoded = []
+        for column, value in zip(columns, values):
+            expected = column.type.python_type
+            if expected is datetime.datetime:
+                if not isinstance(value, str):
+                    return None
+                value = datetime.datetime.fromisoformat(value)
+                if value.tzinfo is not None:
+                    return None
+            elif type(value) is not expected:  # type() để loại bool (bool là lớp con của int)
+                return None
+            elif expected is int and not -2 ** 63 <= value < 2 ** 63:
+                return None
+            decoded.append(value)
+        return decoded
+    except (ValueError, TypeError, NotImplementedError):
+        return None
+
+def keyset_paginate(query, model, sort_key, descending, cursor, per_page):
+    """Lấy một trang của query theo (sort_key, id); con trỏ sai định dạng được coi như trang đầu."""
+    columns = [model.id] if sort_key == 'id' else [getattr(model, sort_key), model.id]
+    after = _decode_cursor(cursor, columns) if cursor else None
+    if after is not None:
+        # (a, id) > (x, last_id)  <=>  a > x OR (a = x AND id > last_id); đảo chiều khi giảm dần
+        condition = None
+        for column, value in reversed(list(zip(columns, after))):
+            beyond = column < value if descending else column > value
+            condition = beyond if condition is None else or_(beyond, and_(column == value, condition))
+        query = query.filter(condition)
+
+    ordering = [column.desc() if descending else column.asc() for column in columns]
+    rows = query.order_by(*ordering).limit(per_page + 1).all()
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = _encode_cursor([getattr(rows[-1], column.key) for column in columns])
+    return KeysetPage(rows, next_cursor, per_page)
+
+def page_args(sort_keys, default_order='desc'):
+    """Đọc per_page/sort/order/cursor từ query string, bỏ qua giá trị không hợp lệ."""
+    sizes = app.config['ADMIN_PAGE_SIZES']
+    per_page = request.args.get('per_page', type=int)
+    sort = request.args.get('sort')
+    return {
+        "per_page": per_page if per_page in sizes else sizes[0],
+        "sort_key": sort if sort in sort_keys else sort_keys[0],
+        "descending": request.args.get('order', default_order) != 'asc',
+        "cursor": request.args.get('cursor') or None,
+    }
+
+TICKET_SORT_KEYS = ('booking_date', 'id')
+USER_SORT_KEYS = ('id', 'username')
+
+def ticket_page_query(filters):
+    # Sự kiện và người giữ vé được nạp cùng câu truy vấn thay vì mỗi dòng một SELECT
+    query = Ticket.query.options(joinedload(Ticket.event))
+    if filters.get('event_id'):
+        query = query.filter(Ticket.event_id == filters['event_id'])
+    if filters.get('status') in ('used', 'unused'):
+        query = query.filter(Ticket.is_used == (filters['status'] == 'used'))
+    if filters.get('faculty'):
+        query = query.join(Ticket.user).filter(User.faculty == filters['faculty']).options(contains_eager(Ticket.user))
+    else:
+        query = query.options(joinedload(Ticket.user))
+    return query
+
+def user_page_query(filters):
+    query = User.query
+    # Đoàn trường chỉ quản lý tài khoản sinh viên
+    role = 'sinh_vien' if current_user.role != 'admin' else filters.get('role')
+    if role:
+        query = query.filter(User.role == role)
+    if filters.get('faculty'):
+        query = query.filter(User.faculty == filters['faculty'])
+    if filters.get('student_class'):
+        query = query.filter(User.student_class == filters['student_class'])
+    return query
+
+def _list_filters(*names):
+    filters = {}
+    for name in names:
+        value = request.args.get(name, '').strip()
+        if value:
+            filters[name] = int(value) if name == 'event_id' and value.isdigit() else value
+    return filters
 
 # 4. Các Routes và quyền truy cập
+def use_read_engine(fn):
+    """Route chỉ đọc: truy vấn chạy trên engine đọc trừ khi người dùng vừa ghi dữ liệu.
+
+    Đặt ngay dưới @app.route để cả việc tải current_user cũng đọc từ engine đọc."""
+    @wraps(fn)
+    def decorated_view(*args, **kwargs):
+        g.db_read_engine = (app.config['READ_ROUTING_ENABLED'] and 'read' in db.engines
+                            and time.time() - session.get('_db_write_at', 0) > app.config['READ_STALENESS_SECONDS'])
+        return fn(*args, **kwargs)
+    return decorated_view
+
+@app.after_request
+def _remember_database_write(response):
+    # Mốc ghi gần nhất nằm trong cookie phiên để request sau (ở bất kỳ worker nào) biết mà đọc CSDL chính
+    if g.pop('db_wrote', False) and 'read' in db.engines:
+        session['_db_write_at'] = time.time()
+    return response
+
 def required_roles(*roles):
     def wrapper(fn):
         @wraps(fn)
@@ -212,6 +2531,15 @@ def required_roles(*roles):
         return decorated_view
     return wrapper
 
+@app.errorhandler(PasswordHasherBusy)
+def password_hasher_busy(error):
+    # Đăng ký, đổi mật khẩu... khi hàng đợi băm mật khẩu đầy (đăng nhập tự xử lý riêng)
+    db.session.rollback()
+    if request.path.startswith('/api/'):
+        return jsonify(status='error', message='Hệ thống đang quá tải, vui lòng thử lại sau.'), 503, {'Retry-After': '5'}
+    flash('Hệ thống đang quá tải, vui lòng thử lại sau vài giây.', 'warning')
+    return redirect(request.url)
+
 @app.route('/forgot-password', methods=['GET', 'POST'])
 def forgot_password():
     if current_user.is_authenticated:
@@ -219,10 +2547,7 @@ def forgot_password():
     
     if request.method == 'POST':
         identifier = request.form.get('identifier')
-        user = User.query.filter(or_(
-            User.username == identifier,
-            User.email == identifier
-        )).first()
+        user = login_identifiers.find_user(identifier, kinds=('username', 'email'))
         if user and user.security_question and user.security_answer_hash:
             return redirect(url_for('verify_security_answer', user_id=user.id))
         else:
@@ -243,6 +2568,7 @@ def verify_security_answer(user_id):
     
     if request.method == 'POST':
         answer = request.form.get('security_answer')
+        db.session.close()  # không giữ transaction đọc trong lúc chờ băm (xem login)
         if user.check_security_answer(answer):
             return redirect(url_for('reset_password', user_id=user.id))
         else:
@@ -289,14 +2615,24 @@ def login():
         username = request.form.get('username')
         password = request.form.get('password')
         
-        user = User.query.filter(or_(
-            User.username == username,
-            User.email == username,
-            User.student_id == username,
-            User.cccd == username
-        )).first()
-
-        if user and user.check_password(password):
+        user = login_identifiers.find_user(username)
+        # Đóng transaction đọc trước khi chờ băm mật khẩu: với SQLite, transaction đọc còn
+        # mở giữ khóa SHARED và chặn mọi lượt ghi (đặt vé) trong suốt thời gian chờ
+        db.session.close()
+        try:
+            valid = user is not None and user.check_password(password)
+        except PasswordHasherBusy:
+            flash('Hệ thống đang quá tải, vui lòng thử đăng nhập lại sau vài giây.', 'warning')
+            return render_template('login.html'), 503, {'Retry-After': '5'}
+
+        if valid:
+            try:
+                if password_hasher.needs_rehash(user.password_hash):
+                    db.session.add(user)
+                    user.set_password(password)
+                    db.session.commit()
+            except PasswordHasherBusy:
+                pass  # băm lại ở lần đăng nhập sau
             login_user(user)
             flash('Đăng nhập thành công!', 'success')
             
@@ -390,6 +2726,8 @@ def register():
         except ValueError:
             flash('Ngày sinh không hợp lệ.', 'danger')
             return redirect(url_for('register'))
+        except PasswordHasherBusy:
+            raise  # errorhandler báo hệ thống đang quá tải
         except Exception as e:
             db.session.rollback()
             flash(f'Lỗi đăng ký. Vui lòng kiểm tra lại thông tin. Lỗi: {e}', 'danger')
@@ -418,8 +2756,7 @@ def dashboard():
 @login_required
 @required_roles('sinh_vien')
 def student_dashboard():
-    events = Event.query.all()
-    return render_template('student.html', events=events)
+    return catalog_page('student.html', 'events', catalog_cache.get(('events',), _load_event_list))
 
 @app.route('/student/my-profile', methods=['GET', 'POST'])
 @login_required
@@ -490,6 +2827,8 @@ def my_profile():
             db.session.rollback()
             flash('Lỗi khi cập nhật hồ sơ. Vui lòng kiểm tra thông tin (có thể do trùng lặp).', 'error')
             return render_template('student_profile.html', user=current_user)
+        except PasswordHasherBusy:
+            raise  # errorhandler báo hệ thống đang quá tải
         except Exception as e:
             db.session.rollback()
             flash(f'Lỗi máy chủ: {str(e)}', 'error')
@@ -501,7 +2840,7 @@ def my_profile():
 @login_required
 @required_roles('sinh_vien')
 def my_tickets():
-    tickets = Ticket.query.filter_by(user_id=current_user.id).all()
+    tickets = Ticket.query.options(joinedload(Ticket.event)).filter_by(user_id=current_user.id).all()
     return render_template('my_tickets.html', tickets=tickets)
 
 @app.route('/student/search', methods=['GET'])
@@ -509,8 +2848,10 @@ def my_tickets():
 @required_roles('sinh_vien')
 def search_events():
     query = request.args.get('query', '')
-    events = Event.query.filter(Event.name.ilike(f'%{query}%')).all()
-    return render_template('student.html', events=events)
+    page = max(request.args.get('page', 1, type=int), 1)
+    events, has_more = find_events(query, page, app.config['SEARCH_PAGE_SIZE'])
+    return render_template('student.html', events=events,
+                           search={"query": query, "page": page, "has_more": has_more})
 
 @app.route('/student/book/<int:event_id>')
 @login_required
@@ -521,28 +2862,68 @@ def book_ticket(event_id):
     if existing_ticket:
         flash('Bạn đã có vé cho sự kiện này rồi.', 'info')
         return redirect(url_for('view_ticket', ticket_code=existing_ticket.ticket_code))
-        
+
+    status = waiting_room.join(event.id, current_user.id, seat_inventory.available(event.id, event.available_tickets))
+    if status.state == 'sold_out':
+        flash('Vé của sự kiện này đã hết.', 'danger')
+        return redirect(url_for('student_dashboard'))
+    if status.state == 'waiting':
+        return redirect(url_for('waiting_room_page', event_id=event_id))
     return redirect(url_for('confirm_booking', event_id=event_id))
 
+@app.route('/student/waiting-room/<int:event_id>')
+@login_required
+@required_roles('sinh_vien')
+def waiting_room_page(event_id):
+    status = waiting_room.status(event_id, current_user.id)
+    if status is None or status.state != 'waiting':
+        return redirect(url_for('book_ticket', event_id=event_id))
+    event = Event.query.get_or_404(event_id)
+    return render_template('waiting_room.html', event=event, status=status,
+                           poll_seconds=app.config['WAITING_ROOM_POLL_SECONDS'])
+
+@app.route('/api/events/<int:event_id>/queue')
+def waiting_room_poll(event_id):
+    """Vị trí trong hàng đợi. Chỉ đọc mã người dùng trong session, không truy vấn CSDL."""
+    user_id = session.get('_user_id')
+    if user_id is None:
+        return jsonify(status='error', message='Bạn cần đăng nhập.'), 401
+    status = waiting_room.status(event_id, int(user_id))
+    if status is None:
+        return jsonify(status='error', message='Bạn chưa xếp hàng cho sự kiện này.'), 404
+    data = {"status": 'ok', "state": status.state, "position": status.position,
+            "wait_seconds": round(status.wait_seconds), "poll_after": app.config['WAITING_ROOM_POLL_SECONDS']}
+    if status.state == 'admitted':
+        data["redirect_url"] = url_for('confirm_booking', event_id=event_id)
+    return jsonify(data)
+
 @app.route('/student/confirm-booking/<int:event_id>', methods=['GET', 'POST'])
 @login_required
 @required_roles('sinh_vien')
 def confirm_booking(event_id):
+    # Chưa tới lượt thì quay lại phòng chờ, hết vé thì từ chối trước khi chạm tới CSDL
+    status = waiting_room.status(event_id, current_user.id)
+    if status is None or status.state == 'waiting':
+        return redirect(url_for('book_ticket', event_id=event_id))
+    if status.state == 'sold_out':
+        flash('Vé của sự kiện này đã hết.', 'danger')
+        return redirect(url_for('student_dashboard'))
     event = Event.query.get_or_404(event_id)
     
     if request.method == 'POST':
-        existing_ticket = Ticket.query.filter_by(user_id=current_user.id, event_id=event_id).first()
-        if existing_ticket:
-            flash('Bạn đã có vé cho sự kiện này rồi.', 'info')
-            return redirect(url_for('view_ticket', ticket_code=existing_ticket.ticket_code))
-        
         ticket_code = TicketController.process_booking(current_user.id, event_id)
         if ticket_code:
             flash('Đặt vé thành công!', 'success')
             return redirect(url_for('view_ticket', ticket_code=ticket_code))
-        else:
-            flash('Vé đã hết hoặc có lỗi xảy ra.', 'danger')
-            return redirect(url_for('student_dashboard'))
+
+        # Ràng buộc duy nhất (user_id, event_id) đã chặn đặt trùng; chỉ tra
+        # vé cũ ở nhánh thất bại để báo cho sinh viên
+        existing_ticket = Ticket.query.filter_by(user_id=current_user.id, event_id=event_id).first()
+        if existing_ticket:
+            flash('Bạn đã có vé cho sự kiện này rồi.', 'info')
+            return redirect(url_for('view_ticket', ticket_code=existing_ticket.ticket_code))
+        flash('Vé đã hết hoặc có lỗi xảy ra.', 'danger')
+        return redirect(url_for('student_dashboard'))
     
     return render_template('confirm_booking.html', event=event)
 
@@ -567,40 +2948,93 @@ def download_ticket(ticket_code):
         flash('Không tìm thấy vé để tải xuống.', 'danger')
         return redirect(url_for('student_dashboard'))
     
-    ticket_filename = f"{ticket_code}.png"
-    ticket_path = os.path.join(app.root_path, 'static', 'images', 'tickets')
-    
     try:
-        return send_from_directory(
-            directory=ticket_path,
-            path=ticket_filename,
-            as_attachment=True,
-            mimetype='image/png'
-        )
-    except FileNotFoundError:
-        flash('File vé không tồn tại trên máy chủ.', 'danger')
+        etag, png = ticket_images.get_or_render(ticket)
+    except Exception:
+        app.logger.exception('Không tạo được ảnh vé %s', ticket_code)
+        flash('Không tạo được file vé. Vui lòng thử lại sau.', 'danger')
         return redirect(url_for('view_ticket', ticket_code=ticket_code))
 
+    # ETag theo nội dung: trình duyệt đã có ảnh thì nhận 304 thay vì tải lại.
+    # ?inline=1 dùng để hiển thị vé trực tiếp trong trang (ticket_success.html)
+    response = send_file(
+        io.BytesIO(png),
+        mimetype='image/png',
+        as_attachment='inline' not in request.args,
+        download_name=f"{ticket_code}.png",
+        etag=etag,
+        last_modified=ticket.booking_date,
+        max_age=0,
+    )
+    response.cache_control.private = True
+    return response
+
+@app.route('/admin/metrics')
+@login_required
+@required_roles('admin')
+def admin_metrics():
+    endpoints, slowest = request_profiler.snapshot()
+    rows = []
+    for endpoint, stats in endpoints.items():
+        duration = stats['duration']
+        count = duration['count'] or 1
+        rows.append({
+            "endpoint": endpoint,
+            "count": duration['count'],
+            "avg_ms": duration['sum'] / count * 1000,
+            "p50_ms": request_profiler.quantile(duration, 0.5) * 1000,
+            "p95_ms": request_profiler.quantile(duration, 0.95) * 1000,
+            "max_ms": duration['max'] * 1000,
+            "queries": stats['queries'] / count,
+            "db_ms": stats['db']['sum'] / count * 1000,
+            "template_ms": stats['template']['sum'] / count * 1000,
+        })
+    rows.sort(key=lambda row: row['avg_ms'] * row['count'], reverse=True)
+    return render_template('admin_metrics.html', rows=rows, slowest=slowest,
+                           enabled=app.config['PROFILING_ENABLED'], catalog=catalog_cache.stats())
+
+@app.route('/admin/metrics/reset', methods=['POST'])
+@login_required
+@required_roles('admin')
+def reset_metrics():
+    request_profiler.reset()
+    flash('Đã xóa số liệu hiệu năng.', 'success')
+    return redirect(url_for('admin_metrics'))
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Số liệu cho Prometheus: admin đã đăng nhập hoặc gửi kèm METRICS_TOKEN."""
+    token = app.config['METRICS_TOKEN']
+    authorized = token and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')
+    if not authorized and not (current_user.is_authenticated and current_user.role == 'admin'):
+        return Response('Forbidden\n', status=403, mimetype='text/plain')
+    return Response(request_profiler.prometheus() + catalog_cache.prometheus(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/admin/dashboard')
+@use_read_engine
 @login_required
 @required_roles('admin')
 def admin_dashboard():
-    total_users = User.query.count()
-    total_tickets = Ticket.query.count()
-    total_events = Event.query.count()
-    event_stats = db.session.query(
-        Event.name,
-        Event.total_tickets,
-        Event.available_tickets
-    ).all()
-    faculty_stats = db.session.query(
-        User.faculty,
-        db.func.count(User.id)
-    ).group_by(User.faculty).all()
-    faculty_ticket_stats = db.session.query(
-        User.faculty,
-        db.func.count(Ticket.id)
-    ).join(User).group_by(User.faculty).all()
+    counters = dashboard_stats.snapshot()
+    total_users = counters.get('users', {}).get('', 0)
+    total_tickets = counters.get('tickets', {}).get('', 0)
+    total_events = counters.get('events', {}).get('', 0)
+    # Danh sách sự kiện lấy từ cache trang sự kiện; số vé đã đặt từ bộ đếm, số vé còn lại
+    # từ kho vé (chế độ 'memory' mới hơn event.available_tickets chờ ghi xuống CSDL)
+    sold = counters.get('event_tickets', {})
+    event_stats = [
+        EventStat(event.name, event.total_tickets, sold.get(str(event.id), 0),
+                  seat_inventory.available(event.id, event.available_tickets))
+        for event in catalog_cache.get(('events',), _load_event_list).data
+    ]
+
+    def by_faculty(name):
+        # Khoa để trống được hiển thị như chưa khai báo, giống nhóm NULL của GROUP BY
+        rows = [(key or None, value) for key, value in counters.get(name, {}).items() if value]
+        return sorted(rows, key=lambda row: (row[0] is not None, row[0] or ''))
+
+    faculty_stats = by_faculty('faculty_users')
+    faculty_ticket_stats = by_faculty('faculty_tickets')
     return render_template(
         'admin.html',
         total_users=total_users,
@@ -615,8 +3049,7 @@ def admin_dashboard():
 @login_required
 @required_roles('doan_truong')
 def doan_truong_dashboard():
-    events = Event.query.all()
-    return render_template('doantruong.html', events=events)
+    return catalog_page('doantruong.html', 'events', catalog_cache.get(('events',), _load_event_list))
 
 @app.route('/admin/add-event', methods=['GET', 'POST'])
 @login_required
@@ -656,6 +3089,8 @@ def add_event():
             )
             db.session.add(new_event)
             db.session.commit()
+            availability_feed.publish(new_event.id, new_event.available_tickets)
+            catalog_cache.invalidate()
             flash('Sự kiện đã được thêm thành công!', 'success')
             
             if current_user.role == 'admin':
@@ -676,17 +3111,13 @@ def edit_event(event_id):
     event = Event.query.get_or_404(event_id)
     if request.method == 'POST':
         try:
-            old_tickets = event.total_tickets
             new_total_tickets = int(request.form.get('total_tickets'))
             
             event.name = request.form.get('name')
             event.date = datetime.datetime.strptime(request.form.get('date'), '%Y-%m-%d').date()
             event.location = request.form.get('location')
             event.description = request.form.get('description')
-            event.total_tickets = new_total_tickets
-            
-            tickets_sold = old_tickets - event.available_tickets
-            event.available_tickets = new_total_tickets - tickets_sold
+            seat_inventory.adjust_total(event, new_total_tickets)
 
             if 'event_image' in request.files:
                 file = request.files['event_image']
@@ -705,6 +3136,8 @@ def edit_event(event_id):
                     return redirect(url_for('edit_event', event_id=event.id))
             
             db.session.commit()
+            availability_feed.publish(event.id, seat_inventory.available(event.id, event.available_tickets))
+            catalog_cache.invalidate()
             flash('Sự kiện đã được cập nhật thành công!', 'success')
             
             if current_user.role == 'admin':
@@ -723,12 +3156,9 @@ def edit_event(event_id):
 def delete_event(event_id):
     event = Event.query.get_or_404(event_id)
     try:
-        tickets_to_delete = Ticket.query.filter_by(event_id=event_id).all()
-        for ticket in tickets_to_delete:
-            ticket_path = os.path.join(app.root_path, 'static', 'images', 'tickets', f"{ticket.ticket_code}.png")
-            if os.path.exists(ticket_path):
-                os.remove(ticket_path)
-            db.session.delete(ticket)
+        connection = db.session.connection()
+        dashboard_stats.apply(connection, dashboard_stats.ticket_deltas(connection, Ticket.event_id == event_id))
+        Ticket.query.filter_by(event_id=event_id).delete(synchronize_session=False)
 
         if event.image_url:
             image_path = os.path.join(app.config['UPLOAD_FOLDER'], os.path.basename(event.image_url))
@@ -737,6 +3167,10 @@ def delete_event(event_id):
 
         db.session.delete(event)
         db.session.commit()
+        checkin_index.invalidate(event_id)
+        seat_inventory.forget(event_id)
+        availability_feed.publish(event_id, None)
+        catalog_cache.invalidate()
         flash('Sự kiện và các vé liên quan đã được xóa thành công!', 'success')
     except Exception as e:
         db.session.rollback()
@@ -751,8 +3185,8 @@ def delete_event(event_id):
 @login_required
 @required_roles('admin', 'doan_truong')
 def manage_events():
-    events = Event.query.order_by(Event.date.asc()).all()
-    return render_template('manage_events.html', events=events)    
+    entry = catalog_cache.get(('events', 'by_date'), lambda: _load_event_list(Event.date.asc()))
+    return catalog_page('manage_events.html', 'events', entry)
 
 @app.route('/static/uploads/event_images/<filename>')
 def uploaded_file(filename):
@@ -762,7 +3196,8 @@ def uploaded_file(filename):
 @login_required
 @required_roles('admin', 'doan_truong')
 def qr_scan():
-    return render_template('qr_scan.html')
+    events = Event.query.order_by(Event.date.asc()).all()
+    return render_template('qr_scan.html', events=events)
 
 @app.route('/qr-result', methods=['GET', 'POST'])
 @login_required
@@ -788,59 +3223,23 @@ def qr_result():
             flash("Không có dữ liệu QR để xử lý.", 'error')
             return render_template('qr_result.html', user_info=None, ticket_status="Không có dữ liệu")
 
-        try:
-            data = json.loads(qr_data_string)
-            ticket_code = data.get('ticket_code')
-            user_id = data.get('user_id')
-            event_id = data.get('event_id')
-
-            if not all([ticket_code, user_id, event_id]):
-                ticket_status = "Dữ liệu QR không hợp lệ. Thiếu thông tin cần thiết."
-                flash(ticket_status, 'error')
-                return render_template('qr_result.html', user_info=None, ticket_status=ticket_status)
-
-            ticket = Ticket.query.filter_by(
-                ticket_code=ticket_code,
-                user_id=user_id,
-                event_id=event_id
-            ).first()
+        parsed = TicketController.parse_qr(qr_data_string)
+        if not parsed:
+            ticket_status = "Dữ liệu QR không hợp lệ. Thiếu thông tin cần thiết."
+            flash(ticket_status, 'error')
+            return render_template('qr_result.html', user_info=None, ticket_status=ticket_status)
 
-            if not ticket:
+        try:
+            status, user_info = check_in_ticket(parsed)
+            if status == 'invalid':
                 ticket_status = "Vé không hợp lệ hoặc không tồn tại."
                 flash(ticket_status, 'error')
-                return render_template('qr_result.html', user_info=None, ticket_status=ticket_status)
-
-            user = User.query.get(user_id)
-            event = Event.query.get(event_id)
-
-            if not user or not event:
-                ticket_status = "Không tìm thấy thông tin người dùng hoặc sự kiện."
-                flash(ticket_status, 'error')
-                return render_template('qr_result.html', user_info=None, ticket_status=ticket_status)
-
-            user_info = {
-                "fullname": user.fullname,
-                "student_id": user.student_id or user.cccd,
-                "student_class": user.student_class,
-                "faculty": user.faculty,
-                "email": user.email,
-                "event_name": event.name,
-                "event_date": event.date.strftime('%d/%m/%Y'),
-                "ticket_code": ticket.ticket_code
-            }
-
-            if ticket.is_used:
+            elif status == 'already_used':
                 ticket_status = "Vé đã được sử dụng"
                 flash(ticket_status, 'warning')
             else:
                 ticket_status = "Vé hợp lệ"
-                ticket.is_used = True
-                db.session.commit()
                 flash('Vé đã được sử dụng thành công.', 'success')
-            
-        except json.JSONDecodeError:
-            ticket_status = "Dữ liệu QR không phải JSON hợp lệ."
-            flash(ticket_status, 'error')
         except Exception as e:
             db.session.rollback()
             ticket_status = f"Lỗi máy chủ: {str(e)}"
@@ -848,12 +3247,130 @@ def qr_result():
             
     return render_template('qr_result.html', user_info=user_info, ticket_status=ticket_status)
 
+@app.route('/api/checkin', methods=['POST'])
+@login_required
+@required_roles('admin', 'doan_truong')
+def api_checkin():
+    data = request.get_json(silent=True) or {}
+    parsed = TicketController.parse_qr(data.get('qr_data') or '')
+    if not parsed:
+        return jsonify(status='invalid', message='Dữ liệu QR không hợp lệ.'), 400
+
+    try:
+        status, ticket = check_in_ticket(parsed, gate=str(data.get('gate_id') or '')[:50] or None)
+    except Exception as e:
+        db.session.rollback()
+        return jsonify(status='error', message=f'Lỗi máy chủ: {e}'), 500
+
+    messages = {
+        'accepted': 'Vé hợp lệ',
+        'already_used': 'Vé đã được sử dụng',
+        'invalid': 'Vé không hợp lệ hoặc không tồn tại.',
+    }
+    return jsonify(status=status, message=messages[status], ticket=ticket)
+
+@app.route('/api/checkin/batch', methods=['POST'])
+@login_required
+@required_roles('admin', 'doan_truong')
+def api_checkin_batch():
+    data = request.get_json(silent=True) or {}
+    scans = data.get('scans')
+    if not isinstance(scans, list):
+        return jsonify(status='invalid', message='Thiếu danh sách lượt quét.'), 400
+    if len(scans) > app.config['CHECKIN_BATCH_LIMIT']:
+        return jsonify(status='invalid', message='Quá nhiều lượt quét trong một lần gửi.'), 413
+
+    event_id = data.get('event_id')
+    if event_id is not None:
+        try:
+            event_id = int(event_id)
+        except (TypeError, ValueError):
+            return jsonify(status='invalid', message='Mã sự kiện không hợp lệ.'), 400
+    try:
+        results = check_in_batch(scans, event_id=event_id,
+                                 default_gate=str(data.get('gate_id') or '')[:50] or None)
+    except Exception as e:
+        db.session.rollback()
+        return jsonify(status='error', message=f'Lỗi máy chủ: {e}'), 500
+    return jsonify(status='ok', results=results)
+
+@app.route('/api/checkin/<int:event_id>/manifest')
+@login_required
+@required_roles('admin', 'doan_truong')
+def checkin_manifest(event_id):
+    event = Event.query.get_or_404(event_id)
+    manifest = build_checkin_manifest(event)
+
+    response = jsonify(manifest)
+    response.set_etag(manifest['version'])
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.make_conditional(request)
+    if response.status_code == 200 and 'gzip' in request.headers.get('Accept-Encoding', ''):
+        response.set_data(gzip.compress(response.get_data()))
+        response.headers['Content-Encoding'] = 'gzip'
+        response.vary.add('Accept-Encoding')
+    return response
+
+@app.route('/api/checkin/<int:event_id>/offline-scans', methods=['POST'])
+@login_required
+@required_roles('admin', 'doan_truong')
+def checkin_offline_scans(event_id):
+    Event.query.get_or_404(event_id)
+    data = request.get_json(silent=True) or {}
+    scans = data.get('scans')
+    if not isinstance(scans, list):
+        return jsonify(status='invalid', message='Thiếu danh sách lượt quét.'), 400
+    if len(scans) > app.config['CHECKIN_BATCH_LIMIT']:
+        return jsonify(status='invalid', message='Quá nhiều lượt quét trong một lần gửi.'), 413
+
+    version = data.get('manifest_version')
+    signature = data.get('manifest_signature')
+    if version and not hmac.compare_digest(str(signature or ''), manifest_signature(event_id, str(version))):
+        return jsonify(status='invalid', message='Chữ ký manifest không hợp lệ.'), 400
+
+    gate = str(data.get('gate_id') or '')[:50] or None
+    try:
+        results = check_in_batch(scans, event_id=event_id, default_gate=gate)
+    except Exception as e:
+        db.session.rollback()
+        return jsonify(status='error', message=f'Lỗi máy chủ: {e}'), 500
+    return jsonify(status='ok', results=results)
+
 @app.route('/admin/manage-tickets')
+@use_read_engine
 @login_required
 @required_roles('admin', 'doan_truong')
 def manage_tickets():
-    tickets = Ticket.query.order_by(Ticket.booking_date.desc()).all()
-    return render_template('manage_tickets.html', tickets=tickets)
+    filters = _list_filters('event_id', 'status', 'faculty')
+    paging = page_args(TICKET_SORT_KEYS)
+    page = keyset_paginate(ticket_page_query(filters), Ticket, **paging)
+    events = Event.query.order_by(Event.date.desc()).all()
+    list_args = dict(filters, per_page=page.per_page, sort=paging['sort_key'],
+                     order='desc' if paging['descending'] else 'asc')
+    return render_template('manage_tickets.html', tickets=page.items, page=page, events=events,
+                           filters=filters, list_args=list_args, sort_keys=TICKET_SORT_KEYS,
+                           page_sizes=app.config['ADMIN_PAGE_SIZES'])
+
+@app.route('/api/admin/tickets')
+@use_read_engine
+@login_required
+@required_roles('admin', 'doan_truong')
+def api_list_tickets():
+    """Bản JSON của trang quản lý vé, dùng next_cursor để tải tiếp."""
+    filters = _list_filters('event_id', 'status', 'faculty')
+    page = keyset_paginate(ticket_page_query(filters), Ticket, **page_args(TICKET_SORT_KEYS))
+    items = [{
+        "id": ticket.id,
+        "ticket_code": ticket.ticket_code,
+        "event_id": ticket.event_id,
+        "event_name": ticket.event.name if ticket.event else None,
+        "user_id": ticket.user_id,
+        "fullname": ticket.user.fullname if ticket.user else None,
+        "booking_date": ticket.booking_date.isoformat() if ticket.booking_date else None,
+        "is_used": ticket.is_used,
+    } for ticket in page.items]
+    return jsonify(status='ok', items=items, next_cursor=page.next_cursor, per_page=page.per_page)
 
 
 @app.route('/admin/edit-ticket/<int:ticket_id>', methods=['GET', 'POST'])
@@ -883,6 +3400,7 @@ def edit_ticket(ticket_id):
                 ticket.event_info_json = request.form.get('event_info_json')
 
             db.session.commit()
+            checkin_index.invalidate(ticket.event_id)
             flash('Vé đã được cập nhật thành công!', 'success')
             return redirect(url_for('manage_tickets'))
         except Exception as e:
@@ -898,18 +3416,18 @@ def edit_ticket(ticket_id):
 @required_roles('admin', 'doan_truong')
 def delete_ticket(ticket_id):
     ticket = Ticket.query.get_or_404(ticket_id)
+    event_id = ticket.event_id
     try:
         event = Event.query.get(ticket.event_id)
-        if event and not ticket.is_used:
-            event.available_tickets += 1
-        
-        ticket_filename = f"{ticket.ticket_code}.png"
-        ticket_path = os.path.join(app.root_path, 'static', 'images', 'tickets', ticket_filename)
-        if os.path.exists(ticket_path):
-            os.remove(ticket_path)
+        if event:
+            seat_inventory.refund(event, used=ticket.is_used)
 
         db.session.delete(ticket)
         db.session.commit()
+        checkin_index.invalidate(event_id)
+        if event:
+            availability_feed.publish(event.id, seat_inventory.available(event.id, event.available_tickets))
+            catalog_cache.sold(event.id)
         flash('Vé đã được xóa thành công!', 'success')
     except Exception as e:
         db.session.rollback()
@@ -932,17 +3450,59 @@ def update_ticket_status(ticket_id):
         flash('Đã cập nhật trạng thái vé thành "Chưa sử dụng".', 'success')
     
     db.session.commit()
+    checkin_index.invalidate(ticket.event_id)
     return redirect(url_for('manage_tickets'))
 
 @app.route('/admin/manage-users')
+@use_read_engine
 @login_required
 @required_roles('admin', 'doan_truong')
 def manage_users():
-    if current_user.role == 'admin':
-        users = User.query.all()
-    else:  # doan_truong
-        users = User.query.filter_by(role='sinh_vien').all()
-    return render_template('manage_users.html', users=users)
+    filters = _list_filters('role', 'faculty', 'student_class')
+    paging = page_args(USER_SORT_KEYS, default_order='asc')
+    page = keyset_paginate(user_page_query(filters), User, **paging)
+    list_args = dict(filters, per_page=page.per_page, sort=paging['sort_key'],
+                     order='desc' if paging['descending'] else 'asc')
+    return render_template('manage_users.html', users=page.items, page=page, filters=filters,
+                           list_args=list_args, sort_keys=USER_SORT_KEYS,
+                           page_sizes=app.config['ADMIN_PAGE_SIZES'])
+
+def _user_json(user):
+    return {
+        "id": user.id,
+        "username": user.username,
+        "fullname": user.fullname,
+        "role": user.role,
+        "email": user.email,
+        "student_id": user.student_id,
+        "cccd": user.cccd,
+        "faculty": user.faculty,
+        "student_class": user.student_class,
+        "edit_url": url_for('edit_user', user_id=user.id),
+    }
+
+@app.route('/api/admin/users')
+@use_read_engine
+@login_required
+@required_roles('admin', 'doan_truong')
+def api_list_users():
+    """Bản JSON của trang quản lý người dùng, dùng next_cursor để tải tiếp."""
+    filters = _list_filters('role', 'faculty', 'student_class')
+    page = keyset_paginate(user_page_query(filters), User, **page_args(USER_SORT_KEYS, default_order='asc'))
+    items = [_user_json(user) for user in page.items]
+    return jsonify(status='ok', items=items, next_cursor=page.next_cursor, per_page=page.per_page)
+
+@app.route('/api/admin/users/search')
+@login_required
+@required_roles('admin', 'doan_truong')
+def api_search_users():
+    """Tìm người dùng cho ô gợi ý: q theo họ tên (không dấu), mã sinh viên/CCCD, email;
+    lọc thêm theo role, faculty, student_class."""
+    filters = _list_filters('role', 'faculty', 'student_class')
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 20, type=int), 1), 100)
+    users, has_more = find_users(user_page_query(filters), request.args.get('q', ''), page, per_page)
+    return jsonify(status='ok', items=[_user_json(user) for user in users], page=page, has_more=has_more)
 
 @app.route('/admin/add-user', methods=['GET', 'POST'])
 @login_required
@@ -1007,6 +3567,8 @@ def add_user():
             db.session.commit()
             flash('Người dùng đã được thêm thành công!', 'success')
             return redirect(url_for('manage_users'))
+        except PasswordHasherBusy:
+            raise  # errorhandler báo hệ thống đang quá tải
         except Exception as e:
             db.session.rollback()
             flash(f'Lỗi khi thêm người dùng: {e}', 'danger')
@@ -1079,6 +3641,8 @@ def edit_user(user_id):
         except IntegrityError:
             db.session.rollback()
             flash('Lỗi cập nhật: Tên đăng nhập, email hoặc CCCD đã tồn tại.', 'danger')
+        except PasswordHasherBusy:
+            raise  # errorhandler báo hệ thống đang quá tải
         except Exception as e:
             db.session.rollback()
             flash(f'Lỗi khi cập nhật người dùng: {e}', 'danger')
@@ -1100,19 +3664,20 @@ def delete_user(user_id):
     
     try:
         tickets_to_delete = Ticket.query.filter_by(user_id=user_id).all()
+        refunded = []
         for ticket in tickets_to_delete:
-            if not ticket.is_used:
-                event = Event.query.get(ticket.event_id)
-                if event:
-                    event.available_tickets += 1
-            
-            ticket_path = os.path.join(app.root_path, 'static', 'images', 'tickets', f"{ticket.ticket_code}.png")
-            if os.path.exists(ticket_path):
-                os.remove(ticket_path)
+            event = Event.query.get(ticket.event_id)
+            if event:
+                seat_inventory.refund(event, used=ticket.is_used)
+                refunded.append(event)
             db.session.delete(ticket)
 
         db.session.delete(user)
         db.session.commit()
+        checkin_index.invalidate()
+        for event in refunded:
+            availability_feed.publish(event.id, seat_inventory.available(event.id, event.available_tickets))
+            catalog_cache.sold(event.id)
         flash('Người dùng và tất cả các vé liên quan đã được xóa thành công.', 'success')
     except Exception as e:
         db.session.rollback()
@@ -1121,26 +3686,185 @@ def delete_user(user_id):
     return redirect(url_for('manage_users'))
 
 @app.route('/events')
+@use_read_engine
 @login_required
 @required_roles('sinh_vien')
 def events():
-    events = Event.query.all()
-    return render_template('events.html', events=events)
+    return catalog_page('events.html', 'events', catalog_cache.get(('events',), _load_event_list))
+
+@app.route('/api/events/availability/stream')
+@login_required
+def availability_stream():
+    """Server-Sent Events: số vé còn lại của các sự kiện, chỉ gửi phần thay đổi."""
+    if not availability_feed.open_stream():
+        return jsonify(status='error', message='Máy chủ đang bận, vui lòng thử lại sau.'), 503
+    since = request.headers.get('Last-Event-ID', type=int) or 0
+    return Response(availability_feed.stream(since), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/events/availability')
+@login_required
+def availability_poll():
+    """Long-poll cho trình duyệt không dùng được SSE: chờ tối đa `wait` giây đến khi có thay đổi.
+
+    poll_after là số giây trình duyệt nên đợi trước lần hỏi sau (0 nếu request đã được giữ chờ)."""
+    since = request.args.get('since', 0, type=int)
+    wait = min(max(request.args.get('wait', 0, type=float), 0), 25)
+    changes, version, held = availability_feed.long_poll(since, wait)
+    poll_after = 0 if held else app.config['AVAILABILITY_FALLBACK_POLL_SECONDS']
+    return jsonify(status='ok', version=version, events=changes, poll_after=poll_after)
 
 @app.route('/event/<int:event_id>')
 @login_required
 @required_roles('sinh_vien')
 def event_detail(event_id):
-    event = Event.query.get_or_404(event_id)
-    return render_template('event_detail.html', event=event)
+    entry = catalog_cache.get(('event', event_id), lambda: _load_event(event_id), event_id=event_id)
+    if entry.data is None:
+        abort(404)
+    return catalog_page('event_detail.html', 'event', entry)
+
+# 5. Lệnh quản trị (flask --app run <lệnh>)
+PRERENDER_COLUMNS = (Ticket.id, Ticket.ticket_code, Ticket.user_id, Ticket.event_id,
+                     Ticket.user_info_json, Ticket.event_info_json)
+
+def _ticket_from_row(row):
+    # Vé tạm (không gắn vào session) chỉ đủ dữ liệu để tạo ảnh
+    return Ticket(**{column.key: value for column, value in zip(PRERENDER_COLUMNS, row)})
+
+def _prerender_ticket(row):
+    # Chạy trong tiến trình con: dựng lại vé từ dữ liệu dòng, không cần CSDL
+    ticket = _ticket_from_row(row)
+    try:
+        ticket_images.render_to_disk(ticket)
+        return ticket.id, None
+    except Exception as e:
+        return ticket.id, f"{ticket.ticket_code}: {e}"
+
+@app.cli.command('render-tickets')
+@click.argument('event_id', type=int)
+@click.option('--chunk-size', default=500, show_default=True, help='Số vé đọc từ CSDL mỗi lượt.')
+@click.option('--workers', default=os.cpu_count() or 1, show_default=True, help='Số tiến trình tạo ảnh.')
+@click.option('--force', is_flag=True, help='Tạo lại cả những vé đã có ảnh trong cache đĩa.')
+def render_tickets_command(event_id, chunk_size, workers, force):
+    """Tạo sẵn ảnh cho toàn bộ vé đã duyệt của một sự kiện."""
+    if not app.config['TICKET_IMAGE_DISK_CACHE_DIR']:
+        raise click.ClickException('Cần bật TICKET_IMAGE_DISK_CACHE_DIR để tạo ảnh vé hàng loạt.')
+    if not db.session.get(Event, event_id):
+        raise click.ClickException(f'Không tìm thấy sự kiện {event_id}.')
+    # Cache đĩa chỉ giữ TICKET_IMAGE_DISK_CACHE_FILES ảnh: sự kiện nhiều vé hơn thì lượt tạo
+    # sau sẽ đẩy ảnh vừa tạo ra khỏi đĩa và lần chạy sau không bỏ qua được vé nào
+    total = db.session.query(db.func.count(Ticket.id)).filter(
+        Ticket.event_id == event_id, Ticket.is_approved.is_(True)).scalar()
+    limit = app.config['TICKET_IMAGE_DISK_CACHE_FILES']
+    if total > limit:
+        raise click.ClickException(
+            f'Sự kiện {event_id} có {total} vé nhưng cache đĩa chỉ giữ {limit} ảnh; '
+            f'đặt FLASK_TICKET_IMAGE_DISK_CACHE_FILES ít nhất {total} rồi chạy lại.')
+
+    rendered = skipped = failed = 0
+    failures = []
+    last_id = 0
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while True:
+            # Đọc theo khóa (id > last_id) từng lượt để bộ nhớ không tăng theo số vé
+            rows = db.session.query(*PRERENDER_COLUMNS).filter(
+                Ticket.event_id == event_id,
+                Ticket.is_approved.is_(True),
+                Ticket.id > last_id
+            ).order_by(Ticket.id).limit(chunk_size).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+
+            pending = []
+            for row in rows:
+                if not force and ticket_images.keep_on_disk(ticket_images.key(_ticket_from_row(row))):
+                    skipped += 1
+                else:
+                    pending.append(tuple(row))
+
+            ready_ids = []
+            failed_ids = []
+            for ticket_id, error in pool.map(_prerender_ticket, pending,
+                                             chunksize=max(1, len(pending) // (workers * 4))):
+                if error:
+                    failed_ids.append(ticket_id)
+                    if len(failures) < 20:
+                        failures.append(error)
+                else:
+                    ready_ids.append(ticket_id)
+            rendered += len(ready_ids)
+            failed += len(failed_ids)
+
+            for status, ticket_ids in (('ready', ready_ids), ('failed', failed_ids)):
+                if ticket_ids:
+                    db.session.execute(update(Ticket).where(Ticket.id.in_(ticket_ids)).values(render_status=status))
+            db.session.commit()
+
+            elapsed = time.perf_counter() - started
+            click.echo(f'... {rendered + skipped + failed} vé ({rendered / elapsed:.1f} vé/giây)')
+
+    elapsed = time.perf_counter() - started
+    click.echo(f'Đã tạo: {rendered}  bỏ qua (đã có): {skipped}  lỗi: {failed}  '
+               f'thời gian: {elapsed:.2f}s  ({rendered / elapsed if elapsed else 0:.1f} vé/giây)')
+    for error in failures:
+        click.echo(f'  {error}', err=True)
+
+@app.cli.command('stats-reconcile')
+def stats_reconcile_command():
+    """Đếm lại bộ đếm của trang thống kê từ dữ liệu gốc (chạy định kỳ, ví dụ bằng cron)."""
+    with db.engine.begin() as connection:
+        drift = dashboard_stats.reconcile(connection)
+    for name, key, stored, expected in drift:
+        click.echo(f'Lệch {name}[{key or "-"}]: {stored} -> {expected}')
+    click.echo(f'Đã đồng bộ bộ đếm thống kê ({len(drift)} giá trị bị lệch).')
+
+@app.cli.command('inventory-reconcile')
+def inventory_reconcile_command():
+    """Đếm lại số vé còn lại của mọi sự kiện từ các dòng vé (sau sự cố hoặc khi nghi bị lệch)."""
+    with db.engine.begin() as connection:
+        drift = seat_inventory.reconcile(connection)
+    for event_id, stored, expected in drift:
+        click.echo(f'Lệch sự kiện {event_id}: {stored} -> {expected}')
+    click.echo(f'Đã đối soát số vé còn lại ({len(drift)} sự kiện bị lệch).')
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Nâng cấp lược đồ và tạo tài khoản/sự kiện mẫu (chạy một lần trước khi khởi động máy chủ)."""
+    create_initial_data()
+    click.echo('Đã khởi tạo CSDL và dữ liệu mẫu.')
+
+@app.cli.command('db-upgrade')
+def db_upgrade_command():
+    """Chạy các migration lược đồ CSDL còn thiếu."""
+    applied = upgrade_database()
+    for version, description in applied:
+        click.echo(f'Đã áp dụng migration {version}: {description}')
+    version = db.session.query(db.func.max(SchemaVersion.version)).scalar()
+    click.echo(f'Lược đồ CSDL đang ở phiên bản {version}.')
+
+# 6. Khởi chạy ứng dụng và tạo dữ liệu ban đầu
+def configure_app(config=None):
+    """Ghi đè các khóa trong config lên app toàn cục của module rồi trả về chính app đó.
+
+    Đây không phải app factory: run.py chỉ có một app, mọi lần gọi đều sửa cùng một đối tượng.
+    Biến môi trường FLASK_<KHÓA> đã được áp dụng khi import (mục 1), nên gọi không có config
+    không đổi gì. Không chạm vào CSDL: migration
+    và dữ liệu mẫu chạy một lần bằng `flask --app run init-db` trước khi khởi động các worker.
+    CSDL chọn bằng DATABASE_URL khi import run.py.
+    """
+    config = dict(config or {})
+    # Khóa ký QR đang đi theo SECRET_KEY thì tiếp tục đi theo khóa mới
+    if ('SECRET_KEY' in config and 'QR_SIGNING_KEY' not in config
+            and app.config['QR_SIGNING_KEY'] == app.config['SECRET_KEY']):
+        config['QR_SIGNING_KEY'] = config['SECRET_KEY']
+    app.config.update(config)
+    return app
 
-# 5. Khởi chạy ứng dụng và tạo dữ liệu ban đầu
 def create_initial_data():
     with app.app_context(): 
-        db.create_all()
-        
-        tickets_dir = os.path.join(app.root_path, 'static', 'images', 'tickets')
-        os.makedirs(tickets_dir, exist_ok=True)
+        upgrade_database()
         
         event_images_dir = os.path.join(app.root_path, 'static', 'Uploads', 'event_images')
         os.makedirs(event_images_dir, exist_ok=True)
@@ -1249,5 +3973,7 @@ def create_initial_data():
         db.session.commit()
 
 if __name__ == '__main__':
+    # Máy chủ phát triển (một tiến trình); production dùng wsgi.py với gunicorn
+    configure_app()
     create_initial_data()
-    app.run(debug=True, host='0.0.0.0')
\ No newline at end of file
+    app.run(debug=os.environ.get('FLASK_DEBUG') == '1', host='0.0.0.0', threaded=True)
@@ -0,0 +1,31 @@
+// Hỏi vị trí trong phòng chờ định kỳ; tới lượt thì chuyển sang trang đặt vé,
+// hết vé thì về trang chủ sinh viên.
+(function () {
+    const box = document.getElementById('waiting-status');
+    if (!box) {
+        return;
+    }
+
+    function schedule(seconds) {
+        window.setTimeout(poll, Math.max(1, seconds) * 1000);
+    }
+
+    function poll() {
+        fetch(box.dataset.poll, { credentials: 'same-origin', cache: 'no-store' })
+            .then((response) => response.json())
+            .then((data) => {
+                if (data.state === 'admitted') {
+                    window.location.href = data.redirect_url;
+                } else if (data.state === 'waiting') {
+                    document.getElementById('waiting-position').textContent = data.position - 1;
+                    document.getElementById('waiting-time').textContent = data.wait_seconds;
+                    schedule(data.poll_after);
+                } else {
+                    window.location.reload();
+                }
+            })
+            .catch(() => schedule(Number(box.dataset.pollSeconds) * 2));
+    }
+
+    schedule(Number(box.dataset.pollSeconds));
+})();
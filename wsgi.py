@@ -0,0 +1,9 @@
+# Điểm vào WSGI cho máy chủ production:
+#
+#   flask --app run init-db                  # một lần: migration + dữ liệu mẫu
+#   gunicorn -c gunicorn.conf.py wsgi:app
+#
+# Cấu hình qua biến môi trường FLASK_<KHÓA> (đọc khi import run.py) và gunicorn.conf.py.
+from run import configure_app
+
+app = configure_app()